@@ -1,3 +1,4 @@
 import twitterscraper.entrypoint
 
-twitterscraper.entrypoint.main()
+if __name__ == "__main__":
+    twitterscraper.entrypoint.main()
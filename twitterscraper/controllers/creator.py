@@ -1,8 +1,10 @@
 import asyncio
+import datetime
 
 from twitterscraper.services import Repository, TwitterAPIClient
-from twitterscraper.models import TwitterProfile, FetchPersistJob
-from twitterscraper.utils import daterange, day_to_timestamps, get_uuid
+from twitterscraper.models import TwitterProfile, FetchPersistRangesJob
+from twitterscraper.settings import MainSettings
+from twitterscraper.utils import date_to_timestamp, split_timestamp_range, get_uuid, chunked
 import twitterscraper.controllers.fetchandpersist
 
 
@@ -18,16 +20,23 @@ async def run_creator(username: str):
 async def _create_profile_initial_fetchandpersist_jobs(profile: TwitterProfile):
     to_ts = None
     jobs = list()
+    settings = MainSettings.get()
 
     coroutines = list()
-    # one job per day, since (date when profile joined) until (yesterday inclusive)
-    for day in daterange(start_date=profile.joined_date, end_inclusive=False):
-        from_ts, to_ts = day_to_timestamps(day)
-        jobs.append(FetchPersistJob(
+    # ranges of backfill_range_days, since (date when profile joined) until (yesterday inclusive);
+    # packed in jobs of multiple ranges. Workers split the ranges with many tweets.
+    ranges = split_timestamp_range(
+        from_ts=date_to_timestamp(profile.joined_date),
+        to_ts=date_to_timestamp(datetime.date.today()),
+        step=settings.jobs.backfill_range_days * 86400
+    )
+    for ranges_chunk in chunked(ranges, settings.jobs.ranges_per_job):
+        to_ts = ranges_chunk[-1][1]
+        jobs.append(FetchPersistRangesJob(
             job_id=get_uuid(),
             userid=profile.userid,
-            from_timestamp=from_ts,
-            to_timestamp=to_ts
+            ranges=ranges_chunk,
+            priority=settings.amqp.priorities.creator
         ))
 
     if jobs:
@@ -1,13 +1,17 @@
-import asyncio
-import json
+from typing import *
 
+import sqlalchemy.exc
 from aioify import aioify
+from sqlmodel import Session
 
 from twitterscraper.services.persistence import Repository
-from twitterscraper.services.twitter import TwitterNitterClient
+from twitterscraper.services.twitter import TwitterTimelineRouter, TwitterNitterClient
 from twitterscraper.services.databus import AMQPClient
-from twitterscraper.models.jobs import FetchPersistJob
+from twitterscraper.services.knowntweets import KnownTweetsFilter
+from twitterscraper.models.domain import TwitterProfile, ScrapedTweet, ProfileCoverage
+from twitterscraper.models.jobs import FetchPersistJob, FetchPersistRangesJob, JobScrollCheckpoint, decode_job
 from twitterscraper.settings import MainSettings, AMQPSettings
+from twitterscraper.utils import get_uuid, split_timestamp_range, get_timestamp
 import twitterscraper.controllers.jobs
 
 
@@ -15,22 +19,19 @@ async def run_fetchandpersist_worker(msg_limit=None):
     amqp_settings: AMQPSettings = MainSettings.get().amqp
     queue_settings = amqp_settings.queues.fetchpersist
     await AMQPClient.get().consume(
-        queue=queue_settings.name,
+        queues=queue_settings.get_lanes(),
         callback=_fetchandpersist_job_callback,
         workers=queue_settings.workers,
-        msg_limit=msg_limit
+        msg_limit=msg_limit,
+        max_per_partition_key=queue_settings.workers_per_profile,
+        prefetch_count=queue_settings.prefetch_count
     )
 
 
-async def enqueue_fetchandpersist_jobs(*jobs: FetchPersistJob):
+async def enqueue_fetchandpersist_jobs(*jobs: Union[FetchPersistJob, FetchPersistRangesJob]) -> int:
+    """Enqueue the jobs, returning the amount of skipped (duplicated) ranges"""
     settings: AMQPSettings = MainSettings.get().amqp
-    queue_settings = settings.queues.fetchpersist
-    await twitterscraper.controllers.jobs.enqueue_jobs(
-        *jobs,
-        exchange=settings.exchange,
-        routingkey=queue_settings.name,
-        persistent=queue_settings.persistent
-    )
+    return await twitterscraper.controllers.jobs.enqueue_queue_jobs(*jobs, queue_settings=settings.queues.fetchpersist)
 
 
 async def save_profile_last_scan_timestamp(userid: str, timestamp: int):
@@ -43,35 +44,208 @@ async def save_profile_last_scan_timestamp(userid: str, timestamp: int):
 
 
 async def _fetchandpersist_job_callback(payload: bytes):
-    payload_js = json.loads(payload)
-    job = FetchPersistJob(**payload_js)
+    job = decode_job(payload, (FetchPersistJob, FetchPersistRangesJob))
+    try:
+        await _fetchandpersist_job(job)
+    except Exception as ex:
+        await twitterscraper.controllers.jobs.set_job_failed(job.job_id)
+        raise ex
+
+
+async def _fetchandpersist_job(job: Union[FetchPersistJob, FetchPersistRangesJob]):
     repository = Repository.get()
     async with repository.session_async() as session:
         profile = await repository.get_profile_by(userid=job.userid)
-        tweets = await TwitterNitterClient.get().get_tweets_in_range(
-            username=profile.username,
-            from_timestamp=job.from_timestamp,
-            to_timestamp=job.to_timestamp
-        )
-
-        print(f"Persisting {len(tweets)} tweets...")
-        failed_persist_tweets = list()
+        completed_ranges = await twitterscraper.controllers.jobs.get_job_completed_ranges(job.job_id)
 
         # We need to set the whole TwitterProfile object on each TwitterTweet object
         # Commit here to set a checkpoint; each tweet saved is commited/rolledback individually,
         # so error persisting an individual tweet does not affect the rest.
         await aioify(session.commit)()
 
-        for tweet in tweets:
-            try:
-                tweet.profile = profile
-                await repository.save_object_async(tweet)
-                await aioify(session.commit)()
-            except Exception as ex:
-                print("Tweet persist failed", ex, tweet)
-                failed_persist_tweets.append((tweet, ex))
-                await aioify(session.rollback)()
+        for from_ts, to_ts in job.get_ranges():
+            if (from_ts, to_ts) in completed_ranges:
+                print(f"Range {from_ts}~{to_ts} already completed on a previous attempt")
+                continue
+
+            covered_range, split_jobs = await _fetchandpersist_range(session, profile, job, from_ts, to_ts)
+            if covered_range:
+                await repository.add_profile_coverage(profile.id, ProfileCoverage.Kind.FETCH, *covered_range)
+
+            # Ranges are only tracked for multi-range jobs, since single-range jobs are finalized right after;
+            # split ranges are always set as completed (removing the scroll checkpoint), on the same commit as the
+            # new jobs historic, which is committed before publishing them, so if this job is retried, it does not
+            # resume the scroll and split the range again
+            if split_jobs or isinstance(job, FetchPersistRangesJob):
+                await twitterscraper.controllers.jobs.set_job_range_completed(job.job_id, from_ts, to_ts)
+            if split_jobs:
+                await enqueue_fetchandpersist_jobs(*split_jobs)
+            await aioify(session.commit)()
 
         await twitterscraper.controllers.jobs.set_job_finalized(job.job_id)
 
-    print(f"{len(tweets) - len(failed_persist_tweets)} tweets persisted, {len(failed_persist_tweets)} failed")
+    if MainSettings.get().jobs.known_tweets_filter:
+        print("Known tweets filter:", KnownTweetsFilter.get().stats())
+
+
+async def _fetchandpersist_range(
+        session: Session,
+        profile: TwitterProfile,
+        job: Union[FetchPersistJob, FetchPersistRangesJob],
+        from_ts: int,
+        to_ts: int
+) -> Tuple[Optional[Tuple[int, int]], List[FetchPersistJob]]:
+    """Fetch and persist the tweets of a profile in a time range.
+    Tweets are persisted after each page, followed by a scroll checkpoint (next page cursor), so if the job fails
+    and is retried, the scroll is resumed from the checkpoint.
+    If the range is longer than a day, and has more pages than the split_pages_threshold setting, stop fetching
+    after that amount of pages, and split the rest of the range in new jobs, sized by the page density observed
+    (see _get_split_ranges).
+    Recent ranges are fetched from the Nitter RSS feed if it reaches back to the range start.
+    Return the range fully fetched and persisted, to be registered as covered (None if any tweet failed persisting),
+    and the new jobs for the rest of the range, to be enqueued by the caller."""
+    split_pages_threshold = MainSettings.get().jobs.split_pages_threshold
+    split_to_ts = None
+
+    checkpoint = await twitterscraper.controllers.jobs.get_job_scroll_checkpoint(job.job_id, from_ts, to_ts)
+    if not checkpoint:
+        rss_tweets = await _fetch_range_rss(profile, from_ts, to_ts)
+        if rss_tweets is not None:
+            failed_count = await _persist_tweets(session, profile, rss_tweets)
+            return (None if failed_count else (from_ts, to_ts)), []
+
+    if checkpoint:
+        print(f"Range {from_ts}~{to_ts} resumed from page {checkpoint.pages_count + 1} "
+              f"({checkpoint.tweets_count} tweets fetched on a previous attempt)")
+    else:
+        checkpoint = JobScrollCheckpoint(
+            from_timestamp=from_ts,
+            to_timestamp=to_ts,
+            cursor=""
+        )
+
+    async for page_tweets, next_page, page_source in TwitterTimelineRouter.get().iter_tweets_in_range_pages(
+        username=profile.username,
+        userid=profile.userid,
+        from_timestamp=from_ts,
+        to_timestamp=to_ts,
+        source=checkpoint.source if checkpoint.cursor else None,
+        start_cursor=checkpoint.cursor or None
+    ):
+        checkpoint.source = page_source
+        checkpoint.failed_count += await _persist_tweets(session, profile, page_tweets)
+        checkpoint.pages_count += 1
+        checkpoint.tweets_count += len(page_tweets)
+        if page_tweets:
+            page_last_timestamp = min(tweet.timestamp for tweet in page_tweets)
+            checkpoint.last_timestamp = min(checkpoint.last_timestamp or page_last_timestamp, page_last_timestamp)
+        if not next_page:
+            break
+
+        checkpoint.cursor = next_page
+        await twitterscraper.controllers.jobs.set_job_scroll_checkpoint(job.job_id, checkpoint)
+        await aioify(session.commit)()
+
+        if checkpoint.last_timestamp and checkpoint.pages_count >= split_pages_threshold and to_ts - from_ts > 86400:
+            # Pages are returned from newest to oldest tweets; Nitter does not return seconds,
+            # so the last minute fetched is fetched again by the new jobs
+            split_to_ts = min(to_ts, checkpoint.last_timestamp + 60)
+            break
+
+    split_jobs = list()
+    if split_to_ts is not None and split_to_ts > from_ts:
+        split_ranges = _get_split_ranges(
+            from_ts=from_ts,
+            to_ts=split_to_ts,
+            fetched_seconds=to_ts - split_to_ts,
+            fetched_pages=checkpoint.pages_count,
+            split_pages_threshold=split_pages_threshold
+        )
+        split_jobs = [
+            FetchPersistJob(
+                job_id=get_uuid(),
+                userid=job.userid,
+                from_timestamp=child_from_ts,
+                to_timestamp=child_to_ts,
+                priority=job.priority
+            )
+            for child_from_ts, child_to_ts in split_ranges
+        ]
+        print(f"Range {from_ts}~{to_ts} has more than {split_pages_threshold} pages, "
+              f"split in {len(split_jobs)} new jobs")
+
+    if checkpoint.failed_count:
+        return None, split_jobs
+    return ((split_to_ts if split_to_ts is not None else from_ts), to_ts), split_jobs
+
+
+def _get_split_ranges(
+        from_ts: int,
+        to_ts: int,
+        fetched_seconds: int,
+        fetched_pages: int,
+        split_pages_threshold: int
+) -> List[Tuple[int, int]]:
+    """Split the rest of a range (from_ts~to_ts) not fetched after reaching the split_pages_threshold, in ranges
+    expected to have half the threshold pages each, from the page density observed on the part of the range fetched
+    (fetched_pages in fetched_seconds). Ranges are at least an hour long; sparser parts of the range may result
+    in ranges longer than a day, that are split again when fetched if they reach the threshold."""
+    seconds_per_page = max(fetched_seconds, 0) / max(fetched_pages, 1)
+    step = max(int(seconds_per_page * max(split_pages_threshold // 2, 1)), 3600)
+    return split_timestamp_range(from_ts, to_ts, step)
+
+
+async def _fetch_range_rss(profile: TwitterProfile, from_ts: int, to_ts: int) -> Optional[List[ScrapedTweet]]:
+    """Fetch the tweets of a recent range (starting within the rss_max_age setting) from the Nitter RSS feed.
+    Return None if the range is not recent, or the feed does not reach back to the range start, or failed."""
+    rss_max_age = MainSettings.get().jobs.rss_max_age
+    if rss_max_age is None or get_timestamp() - from_ts > rss_max_age.total_seconds():
+        return None
+
+    try:
+        return await TwitterNitterClient.get().get_tweets_in_range_rss(
+            username=profile.username,
+            from_timestamp=from_ts,
+            to_timestamp=to_ts
+        )
+    except Exception as ex:
+        print("Nitter RSS fetch failed, falling back to search:", ex)
+        return None
+
+
+async def _persist_tweets(session: Session, profile: TwitterProfile, tweets: List[ScrapedTweet]) -> int:
+    """Persist the tweets one by one, returning the amount of tweets that failed persisting.
+    Tweets already persisted (fetched again on overlapping ranges) are not considered failed.
+    If the known_tweets_filter setting is enabled, tweets known to be persisted are skipped before trying to save them.
+    The TwitterTweet ORM objects are built here, right before saving each tweet."""
+    repository = Repository.get()
+    known_filter = KnownTweetsFilter.get() if MainSettings.get().jobs.known_tweets_filter else None
+    known_count = 0
+    if known_filter is not None and tweets:
+        unknown_ids = await known_filter.filter_unknown(profile.id, (tweet.tweet_id for tweet in tweets))
+        known_count = len(tweets) - len(unknown_ids)
+        tweets = [tweet for tweet in tweets if tweet.tweet_id in unknown_ids]
+
+    print(f"Persisting {len(tweets)} tweets...")
+    failed_persist_tweets = list()
+    existing_count = 0
+
+    for tweet in tweets:
+        try:
+            await repository.save_object_async(tweet.to_tweet(profile))
+            await aioify(session.commit)()
+        except sqlalchemy.exc.IntegrityError:
+            existing_count += 1
+            await aioify(session.rollback)()
+        except Exception as ex:
+            print("Tweet persist failed", ex, tweet)
+            failed_persist_tweets.append((tweet, ex))
+            await aioify(session.rollback)()
+
+    if known_filter is not None:
+        failed_ids = {tweet.tweet_id for tweet, _ in failed_persist_tweets}
+        known_filter.add(profile.id, (tweet.tweet_id for tweet in tweets if tweet.tweet_id not in failed_ids))
+
+    print(f"{len(tweets) - len(failed_persist_tweets) - existing_count} tweets persisted, "
+          f"{existing_count} already existing, {known_count} skipped as known, {len(failed_persist_tweets)} failed")
+    return len(failed_persist_tweets)
@@ -1,36 +1,165 @@
-import asyncio
+import collections
+from typing import *
 
-from twitterscraper.services import Repository, AMQPClient
-from twitterscraper.models import BaseJob, JobHistoric
+import sqlalchemy.exc
+from aioify import aioify
+
+from twitterscraper.services import Repository, AMQPClient, AMQPPublishError
+from twitterscraper.models import BaseJob, JobHistoric, JobHistoricKey, JobScrollCheckpoint, encode_job
+from twitterscraper.settings import MainSettings, AMQPSettings
 from twitterscraper.utils import get_timestamp
 
 
-async def enqueue_jobs(*jobs: BaseJob, exchange: str, routingkey: str, persistent: bool):
-    await asyncio.gather(
-        AMQPClient.get().enqueue(
+async def enqueue_jobs(*jobs: BaseJob, exchange: str, routingkey: str, persistent: bool) -> int:
+    """Enqueue and persist the given jobs, skipping the duplicated ranges (see filter_duplicated_jobs).
+    If some jobs could not be published, their idempotency keys are released and AMQPPublishError is raised.
+    Return the amount of skipped ranges."""
+    encoding = MainSettings.get().amqp.jobs_encoding
+    jobs, skipped_count = await filter_duplicated_jobs(*jobs)
+    if not jobs:
+        return skipped_count
+
+    # Jobs are persisted (and committed) before being published, so consumers always find their historic
+    jobs, save_skipped_count = await save_jobs(*jobs)
+    skipped_count += save_skipped_count
+    if not jobs:
+        return skipped_count
+
+    try:
+        await AMQPClient.get().enqueue(
             exchange=exchange,
             routingkey=routingkey,
             persistent=persistent,
-            payloads=[job.json() for job in jobs]
-        ),
-        save_jobs(*jobs)
+            payloads=[encode_job(job, encoding) for job in jobs],
+            # jobs are balanced by profile when consumed
+            partition_keys=[getattr(job, "userid", None) for job in jobs],
+            message_ids=[job.job_id for job in jobs],
+            message_types=[f"{job.job_type}/v{job.job_version}" for job in jobs]
+        )
+    except AMQPPublishError as ex:
+        # the ranges of the jobs that may not be enqueued must not be skipped as pending
+        await release_unpublished_jobs(*(jobs[index].job_id for index in ex.unconfirmed_indexes))
+        raise ex
+    return skipped_count
+
+
+async def enqueue_queue_jobs(*jobs: BaseJob, queue_settings: AMQPSettings.Queues.QueueConfig) -> int:
+    """Enqueue jobs on the lanes of the given queue, according to the priority of each job.
+    Return the amount of skipped (duplicated) ranges."""
+    settings = MainSettings.get().amqp
+    skipped_count = 0
+    lanes_jobs: Dict[str, List[BaseJob]] = collections.defaultdict(list)
+    for job in jobs:
+        lanes_jobs[queue_settings.get_lane_name(job.priority)].append(job)
+
+    for lane_name, lane_jobs in lanes_jobs.items():
+        await AMQPClient.get().declare_queue(lane_name)
+        skipped_count += await enqueue_jobs(
+            *lane_jobs,
+            exchange=settings.exchange,
+            routingkey=lane_name,
+            persistent=queue_settings.persistent
+        )
+    return skipped_count
+
+
+async def filter_duplicated_jobs(*jobs: BaseJob) -> Tuple[List[BaseJob], int]:
+    """Remove the time ranges of the jobs which idempotency key matches a job that is still pending (created recently
+    and not finalized), or that was recently finalized. Ranges repeated within the given jobs are also removed.
+    Jobs with multiple ranges are kept with their remaining ranges, while jobs left without ranges are removed.
+    Return (jobs to enqueue, amount of skipped ranges)."""
+    settings = MainSettings.get().jobs
+    now = get_timestamp()
+    jobs_keys = {job.job_id: job.get_idempotency_keys() for job in jobs}
+    keys = {key for job_keys in jobs_keys.values() for key in job_keys.values()}
+    if not keys:
+        return list(jobs), 0
+
+    skip_keys = await Repository.get().get_jobs_keys_duplicated(
+        idempotency_keys=keys,
+        pending_created_after=now - settings.dedup_pending_window,
+        finalized_after=now - settings.dedup_finished_window
     )
 
+    filtered_jobs = list()
+    skipped_count = 0
+    for job in jobs:
+        job_keys = jobs_keys[job.job_id]
+        if not job_keys:
+            filtered_jobs.append(job)
+            continue
+
+        ranges = [job_range for job_range, key in job_keys.items() if key not in skip_keys]
+        skip_keys.update(job_keys.values())
+        skipped_count += len(job_keys) - len(ranges)
+        if len(ranges) == len(job_keys):
+            filtered_jobs.append(job)
+        elif ranges:
+            # only jobs with multiple ranges can be left with part of their ranges
+            filtered_jobs.append(job.copy(update=dict(ranges=ranges)))
+
+    if skipped_count:
+        print(f"Skipped {skipped_count} duplicated job ranges (already pending or recently finalized)")
+    return filtered_jobs, skipped_count
 
-async def save_jobs(*jobs: BaseJob):
+
+async def save_jobs(*jobs: BaseJob, attempts: int = 3) -> Tuple[List[BaseJob], int]:
+    """Persist the historic of the given jobs, with their idempotency keys. Keys of the same jobs that were pending
+    before the dedup_pending_window (lost) are released. The current session is committed, including any other
+    pending changes (e.g. the progress of the job that created these jobs), so they are committed together.
+    Saving a key that is pending on another job, enqueued concurrently, violates a unique index: then the jobs are
+    filtered again (see filter_duplicated_jobs) and the rest are saved, up to `attempts` times.
+    Return (saved jobs, amount of skipped ranges)."""
+    repository = Repository.get()
+    skipped_count = 0
+    async with repository.session_async() as session:
+        for attempt in range(1, attempts + 1):
+            try:
+                # only the jobs are rolled back on conflict, keeping the other pending changes of the session
+                async with repository.savepoint_async():
+                    await _save_jobs_keys(*jobs)
+                break
+            except sqlalchemy.exc.IntegrityError as ex:
+                if attempt == attempts:
+                    raise ex
+                print("Jobs ranges enqueued concurrently by another job, filtering the jobs again")
+                jobs, filter_skipped_count = await filter_duplicated_jobs(*jobs)
+                skipped_count += filter_skipped_count
+        await aioify(session.commit)()
+    return list(jobs), skipped_count
+
+
+async def _save_jobs_keys(*jobs: BaseJob):
     repository = Repository.get()
     now_timestamp = get_timestamp()
-    async with repository.session_async():
-        coroutines = list()
-        for job in jobs:
-            job_persist = JobHistoric(
-                job_id=job.job_id,
-                data=job.dict(exclude={"job_id"}),
-                timestamp_created=now_timestamp
-            )
-            coroutines.append(repository.save_object_async(job_persist))
+    jobs_keys = {job.job_id: job.get_idempotency_keys() for job in jobs}
+    await repository.release_jobs_keys(
+        idempotency_keys={key for job_keys in jobs_keys.values() for key in job_keys.values()},
+        created_before=now_timestamp - MainSettings.get().jobs.dedup_pending_window
+    )
+    jobs_persist = [
+        JobHistoric(
+            job_id=job.job_id,
+            data=job.dict(exclude={"job_id"}),
+            timestamp_created=now_timestamp
+        )
+        for job in jobs
+    ]
+    # flushed before the keys referencing them; the keys are flushed to check the unique index
+    await repository.save_object_async(*jobs_persist, flush=True)
+    await repository.save_object_async(*[
+        JobHistoricKey(job_id=job_id, idempotency_key=key, timestamp_created=now_timestamp)
+        for job_id, job_keys in jobs_keys.items()
+        for key in job_keys.values()
+    ], flush=True)
 
-        await asyncio.gather(*coroutines)
+
+async def release_unpublished_jobs(*job_ids: str):
+    """Release the idempotency keys of jobs that could not be published, so their ranges can be enqueued again"""
+    repository = Repository.get()
+    async with repository.session_async() as session:
+        await repository.release_jobs_keys_of_jobs(job_ids)
+        await aioify(session.commit)()
 
 
 async def set_job_finalized(job_id: str):
@@ -43,3 +172,70 @@ async def set_job_finalized(job_id: str):
 
         job_persisted.timestamp_finalized = get_timestamp()
         await repository.save_object_async(job_persisted)
+        await repository.set_job_keys_finalized(job_id, job_persisted.timestamp_finalized)
+
+
+async def set_job_failed(job_id: str):
+    """Increase the failures count of a persisted job"""
+    repository = Repository.get()
+    async with repository.session_async():
+        job_persisted = await repository.get_job_historic(job_id)
+        if not job_persisted:
+            print("Job historic", job_id, "not persisted!")
+            return
+
+        job_persisted.failures = (job_persisted.failures or 0) + 1
+        job_persisted.last_failure_timestamp = get_timestamp()
+        await repository.save_object_async(job_persisted)
+
+
+async def get_job_completed_ranges(job_id: str) -> Set[Tuple[int, int]]:
+    """Get the time ranges of a persisted job already completed on previous attempts"""
+    job_persisted = await Repository.get().get_job_historic(job_id)
+    if not job_persisted or not job_persisted.progress:
+        return set()
+    return {(from_ts, to_ts) for from_ts, to_ts in job_persisted.progress.get("completed_ranges", [])}
+
+
+async def set_job_range_completed(job_id: str, from_ts: int, to_ts: int):
+    """Persist a time range of a job as completed, so it is skipped if the job is retried"""
+    repository = Repository.get()
+    async with repository.session_async():
+        job_persisted = await repository.get_job_historic(job_id)
+        if not job_persisted:
+            print("Job historic", job_id, "not persisted!")
+            return
+
+        # assign a new dict, since changes inside JSON columns are not tracked
+        progress = dict(job_persisted.progress or {})
+        progress["completed_ranges"] = [*progress.get("completed_ranges", []), [from_ts, to_ts]]
+        progress.pop("scroll", None)
+        job_persisted.progress = progress
+        await repository.save_object_async(job_persisted)
+
+
+async def get_job_scroll_checkpoint(job_id: str, from_ts: int, to_ts: int) -> Optional[JobScrollCheckpoint]:
+    """Get the scroll checkpoint persisted by a previous attempt of a job for the given time range, if any"""
+    job_persisted = await Repository.get().get_job_historic(job_id)
+    if not job_persisted or not job_persisted.progress or not job_persisted.progress.get("scroll"):
+        return None
+
+    checkpoint = JobScrollCheckpoint.parse_obj(job_persisted.progress["scroll"])
+    if (checkpoint.from_timestamp, checkpoint.to_timestamp) != (from_ts, to_ts):
+        return None
+    return checkpoint
+
+
+async def set_job_scroll_checkpoint(job_id: str, checkpoint: JobScrollCheckpoint):
+    """Persist the scroll checkpoint of a job (only one per job, for the range being fetched)"""
+    repository = Repository.get()
+    async with repository.session_async():
+        job_persisted = await repository.get_job_historic(job_id)
+        if not job_persisted:
+            print("Job historic", job_id, "not persisted!")
+            return
+
+        progress = dict(job_persisted.progress or {})
+        progress["scroll"] = checkpoint.dict()
+        job_persisted.progress = progress
+        await repository.save_object_async(job_persisted)
@@ -1,11 +1,13 @@
-import json
 import asyncio
 from typing import *
 
-from twitterscraper.services import AMQPClient, Repository, TwitterNitterClient
-from twitterscraper.models import PersistedReviewJob, TwitterTweet
+from aioify import aioify
+
+from twitterscraper.services import AMQPClient, Repository, TwitterNitterClient, TwitterAPIClient, TwitterTimelineRouter
+from twitterscraper.models import PersistedReviewJob, PersistedReviewRangesJob, TwitterTweet, TwitterProfile, \
+    ScrapedTweet, ProfileCoverage, TweetsRangeFingerprint, decode_job
 from twitterscraper.settings import MainSettings, AMQPSettings
-from twitterscraper.utils import get_timestamp
+from twitterscraper.utils import get_timestamp, get_ids_fingerprint, IdsFingerprint
 import twitterscraper.controllers.jobs
 
 
@@ -14,41 +16,307 @@ async def run_persistedreview_worker(msg_limit=None):
     amqp_settings: AMQPSettings = MainSettings.get().amqp
     queue_settings = amqp_settings.queues.persistedreview
     await AMQPClient.get().consume(
-        queue=queue_settings.name,
+        queues=queue_settings.get_lanes(),
         callback=_persistedreview_job_callback,
         workers=queue_settings.workers,
-        msg_limit=msg_limit
+        msg_limit=msg_limit,
+        max_per_partition_key=queue_settings.workers_per_profile,
+        prefetch_count=queue_settings.prefetch_count
     )
 
 
-async def enqueue_persistedreview_jobs(*jobs: PersistedReviewJob):
+async def enqueue_persistedreview_jobs(*jobs: Union[PersistedReviewJob, PersistedReviewRangesJob]) -> int:
+    """Enqueue the jobs, returning the amount of skipped (duplicated) ranges"""
     settings: AMQPSettings = MainSettings.get().amqp
-    queue_settings = settings.queues.persistedreview
-    await twitterscraper.controllers.jobs.enqueue_jobs(
+    return await twitterscraper.controllers.jobs.enqueue_queue_jobs(
         *jobs,
-        exchange=settings.exchange,
-        routingkey=queue_settings.name,
-        persistent=queue_settings.persistent
+        queue_settings=settings.queues.persistedreview
     )
 
 
 async def _persistedreview_job_callback(payload: bytes):
-    payload_js = json.loads(payload)
-    job = PersistedReviewJob(**payload_js)
+    job = decode_job(payload, (PersistedReviewJob, PersistedReviewRangesJob))
+    try:
+        await _persistedreview_job(job)
+    except Exception as ex:
+        await twitterscraper.controllers.jobs.set_job_failed(job.job_id)
+        raise ex
+
+
+async def _persistedreview_job(job: Union[PersistedReviewJob, PersistedReviewRangesJob]):
     repository = Repository.get()
-    async with repository.session_async():
+    async with repository.session_async() as session:
         profile = await repository.get_profile_by(userid=job.userid)
+        completed_ranges = await twitterscraper.controllers.jobs.get_job_completed_ranges(job.job_id)
+
+        for from_ts, to_ts in job.get_ranges():
+            if (from_ts, to_ts) in completed_ranges:
+                print(f"Range {from_ts}~{to_ts} already completed on a previous attempt")
+                continue
+
+            await _persistedreview_range(profile, from_ts, to_ts)
+            await repository.add_profile_coverage(profile.id, ProfileCoverage.Kind.REVIEW, from_ts, to_ts)
+            await aioify(session.commit)()
+
+            # Ranges are only tracked for multi-range jobs, since single-range jobs are finalized right after
+            if isinstance(job, PersistedReviewRangesJob):
+                await twitterscraper.controllers.jobs.set_job_range_completed(job.job_id, from_ts, to_ts)
+                await aioify(session.commit)()
+
+    await twitterscraper.controllers.jobs.set_job_finalized(job.job_id)
+
+
+async def _persistedreview_range(profile: TwitterProfile, from_ts: int, to_ts: int):
+    """Review the persisted tweets of a profile in a time range.
+    The online pages are compared with the fingerprint of the last review of the range: if all the pages and the
+    persisted tweets (hash of their ids) did not change, the range is set as reviewed without loading the persisted
+    tweets nor double-checking deletions. Otherwise, from the first changed page on, the persisted and online tweets
+    are compared (all at once, or streamed page by page if the review_streaming setting is enabled), and the
+    fingerprint of the review is saved."""
+    repository = Repository.get()
+    jobs_settings = MainSettings.get().jobs
+    use_fingerprints = jobs_settings.review_fingerprints
+    fingerprint = None
+    if use_fingerprints:
+        fingerprint = await repository.get_tweets_range_fingerprint(profile.id, from_ts, to_ts)
+
+    streaming_review = None
+    if jobs_settings.review_streaming:
+        streaming_review = _StreamingReview(profile, from_ts, to_ts, jobs_settings.review_streaming_batch_size)
+    online_tweets = list()
+
+    async def review_pages(*pages: List[ScrapedTweet]):
+        for page in pages:
+            if streaming_review is None:
+                online_tweets.extend(page)
+            else:
+                await streaming_review.add_online_page(page)
+
+    # pages matching the fingerprint, held back (not reviewed) while the range may not have changed
+    unchanged_pages: Optional[List[List[ScrapedTweet]]] = None
+    if fingerprint is not None and fingerprint.pages_hashes:
+        unchanged_pages = list()
+    pages_hashes = list()
+    pages_source = None
+    async for page_tweets, next_page, source in TwitterTimelineRouter.get().iter_tweets_in_range_pages(
+        username=profile.username,
+        userid=profile.userid,
+        from_timestamp=from_ts,
+        to_timestamp=to_ts,
+        include_replies=True
+    ):
+        if not page_tweets:
+            continue
+        if source != pages_source:
+            # the router fell back to another source, which pages restart from the newest tweet
+            pages_source = source
+            pages_hashes = list()
+        pages_hashes.append(get_ids_fingerprint(tweet.tweet_id for tweet in page_tweets))
+
+        if unchanged_pages is not None:
+            page_index = len(pages_hashes) - 1
+            if fingerprint.source == source and \
+                    fingerprint.pages_hashes[page_index:page_index + 1] == pages_hashes[page_index:] and \
+                    (page_index > 0 or await _is_persisted_unchanged(profile, from_ts, to_ts, fingerprint)):
+                unchanged_pages.append(page_tweets)
+                continue
+            # the range changed: review the pages held back, and the rest of pages from now on
+            pending_pages, unchanged_pages = unchanged_pages, None
+            await review_pages(*pending_pages)
+        await review_pages(page_tweets)
+
+    if unchanged_pages is not None:
+        if len(pages_hashes) == len(fingerprint.pages_hashes):
+            print(f"Range {from_ts}~{to_ts} did not change since the last review ({len(pages_hashes)} pages compared)")
+            now = get_timestamp()
+            await repository.set_tweets_reviewed(profile.id, from_ts, to_ts, now)
+            fingerprint.timestamp = now
+            await repository.save_object_async(fingerprint)
+            return
+        # less pages than on the last review
+        await review_pages(*unchanged_pages)
+
+    if streaming_review is not None:
+        persisted_fingerprint = await streaming_review.finish()
+    else:
         remaining_tweets, removed_tweets = await _get_tweets_differences(
             username=profile.username,
-            from_ts=job.from_timestamp,
-            to_ts=job.to_timestamp
+            from_ts=from_ts,
+            to_ts=to_ts,
+            online_tweets=online_tweets
         )
         await _update_tweets_timestamps(remaining_tweets, removed_tweets)
+        persisted_fingerprint = get_ids_fingerprint(tweet.tweet_id for tweet in remaining_tweets)
 
-    await twitterscraper.controllers.jobs.set_job_finalized(job.job_id)
+    if use_fingerprints and pages_source is not None:
+        if fingerprint is None:
+            fingerprint = TweetsRangeFingerprint(profile_id=profile.id, from_timestamp=from_ts, to_timestamp=to_ts)
+        fingerprint.source = pages_source
+        fingerprint.pages_hashes = pages_hashes
+        fingerprint.persisted_fingerprint = persisted_fingerprint
+        fingerprint.timestamp = get_timestamp()
+        await repository.save_object_async(fingerprint)
+
+
+async def _is_persisted_unchanged(
+        profile: TwitterProfile,
+        from_ts: int,
+        to_ts: int,
+        fingerprint: TweetsRangeFingerprint
+) -> bool:
+    """Return if the active persisted tweets of the range are the same as on the fingerprint"""
+    persisted_ids = await Repository.get().get_active_tweets_ids(profile.id, from_ts, to_ts)
+    return get_ids_fingerprint(persisted_ids) == fingerprint.persisted_fingerprint
+
+
+class _SortedIdsDiff:
+    """Sorted-merge diff between the ids of the persisted tweets, streamed sorted from highest (newest) to lowest,
+    and the online tweets, given in pages sorted from newest to oldest (as returned by Nitter and the Twitter API).
+    The lowest id of each online page is a watermark: the persisted ids down to it are either on the page,
+    or missing online. Only the current page and the next persisted id are kept in memory.
+    If an online page contains a tweet newer than the previous page watermark, the tweet was already given as missing:
+    it is a false positive (see _StreamingReview). When the router falls back to another source, its pages restart
+    from the newest tweet: while they are above the watermark, no persisted ids are compared again."""
+
+    def __init__(self, persisted_ids: AsyncIterator[int]):
+        self._persisted_ids = persisted_ids
+        self._next_persisted_id: Optional[int] = None
+        self._exhausted = False
+
+    async def _peek(self) -> Optional[int]:
+        if self._next_persisted_id is None and not self._exhausted:
+            try:
+                self._next_persisted_id = await self._persisted_ids.__anext__()
+            except StopAsyncIteration:
+                self._exhausted = True
+        return self._next_persisted_id
+
+    async def iter_page_diff(self, online_tweets_ids: Iterable[str]) -> AsyncIterator[Tuple[str, bool]]:
+        """Yield (persisted tweet id, found online) for the persisted tweets down to the oldest tweet of the page"""
+        online_ids = {int(tweet_id) for tweet_id in online_tweets_ids if tweet_id.isdigit()}
+        if not online_ids:
+            return
+        watermark = min(online_ids)
+        while True:
+            persisted_id = await self._peek()
+            if persisted_id is None or persisted_id < watermark:
+                return
+            self._next_persisted_id = None
+            yield str(persisted_id), persisted_id in online_ids
 
+    async def iter_rest_diff(self) -> AsyncIterator[str]:
+        """Yield the persisted tweets ids older than all the online pages given (thus missing online)"""
+        while True:
+            persisted_id = await self._peek()
+            if persisted_id is None:
+                return
+            self._next_persisted_id = None
+            yield str(persisted_id)
 
-async def _get_tweets_differences(username: str, from_ts: int, to_ts: int) -> Tuple[List[TwitterTweet], List[TwitterTweet]]:
+
+class _StreamingReview:
+    """Review of the persisted tweets of a profile in a time range, with the online pages compared while fetched
+    (see _SortedIdsDiff). The remaining tweets are set as reviewed, and the missing tweets double-checked, in batches
+    of batch_size tweets, so memory does not grow with the amount of tweets in the range. Missing tweets found on a
+    later page before being double-checked (out of order, or on the pages of the source the router fell back to)
+    are set as remaining."""
+
+    def __init__(self, profile: TwitterProfile, from_ts: int, to_ts: int, batch_size: int):
+        self._batch_size = batch_size
+        self._timestamp = get_timestamp()
+        self._diff = _SortedIdsDiff(_iter_persisted_tweets_ids(profile.id, from_ts, to_ts, batch_size))
+        self._remaining_ids: List[str] = list()
+        self._missing_ids: List[str] = list()
+        self._remaining_count = 0
+        self._removed_count = 0
+        self._remaining_fingerprint = IdsFingerprint()
+
+    async def add_online_page(self, page_tweets: List[ScrapedTweet]):
+        page_tweets_ids = [tweet.tweet_id for tweet in page_tweets]
+        found_missing_ids = set(page_tweets_ids).intersection(self._missing_ids)
+        if found_missing_ids:
+            self._missing_ids = [tweet_id for tweet_id in self._missing_ids if tweet_id not in found_missing_ids]
+            for tweet_id in found_missing_ids:
+                await self._add(tweet_id, True)
+
+        async for tweet_id, found_online in self._diff.iter_page_diff(page_tweets_ids):
+            await self._add(tweet_id, found_online)
+
+    async def finish(self) -> str:
+        """Process the persisted tweets not compared yet (missing online) and the pending batches.
+        Return the fingerprint of the remaining tweets ids (see get_ids_fingerprint)."""
+        async for tweet_id in self._diff.iter_rest_diff():
+            await self._add(tweet_id, False)
+        await self._flush_missing()
+        await self._flush_remaining()
+        print(f"Tweets differences (streamed): remaining={self._remaining_count} removed={self._removed_count}")
+        return self._remaining_fingerprint.hexdigest()
+
+    async def _add(self, tweet_id: str, found_online: bool):
+        if found_online:
+            self._remaining_ids.append(tweet_id)
+            if len(self._remaining_ids) >= self._batch_size:
+                await self._flush_remaining()
+        else:
+            self._missing_ids.append(tweet_id)
+            if len(self._missing_ids) >= self._batch_size:
+                await self._flush_missing()
+
+    async def _flush_remaining(self):
+        if not self._remaining_ids:
+            return
+        await Repository.get().set_tweets_timestamps(self._remaining_ids, last_review_timestamp=self._timestamp)
+        self._remaining_count += len(self._remaining_ids)
+        self._remaining_fingerprint.add(self._remaining_ids)
+        self._remaining_ids = list()
+
+    async def _flush_missing(self):
+        if not self._missing_ids:
+            return
+        missing_tweets_ids = set(self._missing_ids)
+        self._missing_ids = list()
+        print(f"Found {len(missing_tweets_ids)} removed tweets, double-checking individually... {missing_tweets_ids}")
+        removed_tweets_ids = await verify_removed_tweets(missing_tweets_ids)
+        print(f"Finally detected {len(removed_tweets_ids)} removed tweets: {removed_tweets_ids}")
+
+        await Repository.get().set_tweets_timestamps(
+            removed_tweets_ids,
+            last_review_timestamp=self._timestamp,
+            deletion_detected_timestamp=self._timestamp
+        )
+        self._removed_count += len(removed_tweets_ids)
+        self._remaining_ids.extend(missing_tweets_ids - removed_tweets_ids)
+        if len(self._remaining_ids) >= self._batch_size:
+            await self._flush_remaining()
+
+
+async def _iter_persisted_tweets_ids(profile_id: int, from_ts: int, to_ts: int, batch_size: int) -> AsyncIterator[int]:
+    """Iterate the ids of the active tweets of a profile in a time range, from highest to lowest,
+    loading them from the database in pages of batch_size ids. Non-numeric ids are skipped."""
+    repository = Repository.get()
+    before_tweet_id = None
+    while True:
+        tweets_ids = await repository.get_tweets_ids_page(
+            profile_id=profile_id,
+            from_timestamp=from_ts,
+            to_timestamp=to_ts,
+            limit=batch_size,
+            before_tweet_id=before_tweet_id
+        )
+        for tweet_id in tweets_ids:
+            if tweet_id.isdigit():
+                yield int(tweet_id)
+        if len(tweets_ids) < batch_size:
+            return
+        before_tweet_id = tweets_ids[-1]
+
+
+async def _get_tweets_differences(
+        username: str,
+        from_ts: int,
+        to_ts: int,
+        online_tweets: List[ScrapedTweet]
+) -> Tuple[List[TwitterTweet], List[TwitterTweet]]:
     """Compare the tweets from a user, during the given time range, between those persisted and those fetched now.
     Detect which tweets remain and which are deleted.
     Return tuple of List[TwitterTweet], where:
@@ -66,25 +334,16 @@ async def _get_tweets_differences(username: str, from_ts: int, to_ts: int) -> Tu
     if not persisted_tweets:
         return [], []
 
-    # TODO Avoid getting COMPLETE tweets data from Nitter... or keep doing so to get possibly missing tweets
-    online_tweets = await TwitterNitterClient.get().get_tweets_in_range(
-        username=username,
-        from_timestamp=from_ts,
-        to_timestamp=to_ts,
-        include_replies=True
-    )
-
     persisted_tweets = _tweets_list_to_dict(persisted_tweets)
-    online_tweets = _tweets_list_to_dict(online_tweets)
     persisted_tweets_ids = set(persisted_tweets)
-    online_tweets_ids = set(online_tweets)
+    online_tweets_ids = {tweet.tweet_id for tweet in online_tweets}
 
     removed_tweets_ids = persisted_tweets_ids - online_tweets_ids
     # Double-check by verifying each tweet individually - generic search may return less tweets
     # (for example, tweets quoting a tweet that no longer exists are not returned on search, although still exist)
     if removed_tweets_ids:
         print(f"Found {len(removed_tweets_ids)} removed tweets, double-checking individually... {removed_tweets_ids}")
-        removed_tweets_ids = await TwitterNitterClient.get().get_tweets_removed(removed_tweets_ids)
+        removed_tweets_ids = await verify_removed_tweets(removed_tweets_ids)
         print(f"Finally detected {len(removed_tweets_ids)} removed tweets: {removed_tweets_ids}")
 
     remaining_tweets_ids = persisted_tweets_ids - removed_tweets_ids
@@ -98,6 +357,25 @@ async def _get_tweets_differences(username: str, from_ts: int, to_ts: int) -> Tu
     return remaining_tweets, removed_tweets
 
 
+async def verify_removed_tweets(tweets_ids: Set[str]) -> Set[str]:
+    """Verify which of the given tweets (candidates to be removed) no longer exist, using the backend set on the
+    deletion_verification setting. The Twitter API backend verifies them in batches, and the tweets it could not verify
+    are verified on Nitter."""
+    removed_tweets_ids = set()
+    unverified_tweets_ids = set(tweets_ids)
+
+    if MainSettings.get().jobs.deletion_verification == "api":
+        statuses = await TwitterAPIClient.get().get_tweets_statuses(tweets_ids)
+        removed_tweets_ids = {tweet_id for tweet_id, status in statuses.items() if not status.exists}
+        unverified_tweets_ids -= set(statuses)
+        if unverified_tweets_ids:
+            print(f"{len(unverified_tweets_ids)} tweets could not be verified on the Twitter API, verifying on Nitter")
+
+    if unverified_tweets_ids:
+        removed_tweets_ids |= await TwitterNitterClient.get().get_tweets_removed(unverified_tweets_ids)
+    return removed_tweets_ids
+
+
 async def _update_tweets_timestamps(remaining_tweets: List[TwitterTweet], removed_tweets: List[TwitterTweet]):
     repository = Repository.get()
     now = get_timestamp()
@@ -0,0 +1,72 @@
+import time
+import random
+import asyncio
+import datetime
+from typing import *
+
+from twitterscraper.settings import MainSettings, TasksSettings
+import twitterscraper.controllers.tasks_scanners
+
+_stop_event: Optional[asyncio.Event] = None
+
+
+async def run_scheduler():
+    """Run the tasks periodically, according to their TasksSettings schedule, until stop_scheduler() is called.
+    Each task runs without overlapping with its previous run; different tasks may run at the same time."""
+    global _stop_event
+    _stop_event = asyncio.Event()
+    settings = MainSettings.get().tasks
+
+    print("Running Scheduler")
+    await asyncio.gather(
+        _run_scheduled_task(
+            name="NewTweetsScan",
+            schedule=settings.new_tweets_scan,
+            task=twitterscraper.controllers.tasks_scanners.run_task_newtweetsscan
+        ),
+        _run_scheduled_task(
+            name="SyncProfilesTweets",
+            schedule=settings.persisted_tweets_scan,
+            task=twitterscraper.controllers.tasks_scanners.run_task_syncprofilestweets
+        ),
+    )
+    print("Scheduler stopped")
+
+
+def stop_scheduler():
+    """Stop the scheduler. Tasks currently running are completed before run_scheduler() returns."""
+    if _stop_event is not None:
+        _stop_event.set()
+
+
+async def _run_scheduled_task(name: str, schedule: TasksSettings.Task, task: Callable[[], Awaitable[None]]):
+    if not schedule.enabled:
+        print(f"Task {name} has no schedule, will not run")
+        return
+
+    last_run_start = None
+    while not _stop_event.is_set():
+        now = _utcnow()
+        next_run = schedule.get_next_run(now=now, last_run_start=last_run_start)
+        delay = (next_run - now).total_seconds() + random.uniform(0, schedule.jitter)
+        print(f"Next run of task {name} in {delay:.0f}s")
+
+        try:
+            await asyncio.wait_for(_stop_event.wait(), timeout=delay)
+            # stop event set while waiting
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        last_run_start = _utcnow()
+        start = time.monotonic()
+        try:
+            await task()
+            result = "completed"
+        except Exception as ex:
+            result = f"failed ({ex!r})"
+        print(f"Task {name} run {result} in {time.monotonic() - start:.1f}s")
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
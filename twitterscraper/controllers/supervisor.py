@@ -0,0 +1,181 @@
+import os
+import time
+import queue
+import signal
+import asyncio
+import multiprocessing
+import multiprocessing.process
+from typing import *
+
+from twitterscraper.settings import SupervisorSettings
+
+_stop_event: Optional[asyncio.Event] = None
+_stats_queue: Optional[multiprocessing.Queue] = None
+"""Queue to report the stats of a worker process to its supervisor (only set on supervised processes)"""
+_stats_interval: float = 60
+
+
+class _WorkerProcess:
+    """A supervised worker process slot, with the process currently running on it and its restart backoff"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.start_time: Optional[float] = None
+        self.next_start_time: float = 0
+        self.consecutive_failures = 0
+        self.restarts_count = 0
+        self.finished = False
+        """The last process exited cleanly (exit code 0), so it is not restarted"""
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+async def run_supervisor(name: str, processes: int, target: Callable[[], Any], settings: SupervisorSettings):
+    """Run the target (a worker entrypoint function) on `processes` child processes, each one with its own event loop
+    and connections, until stop_supervisor() is called, or all the children exit cleanly. Children that crash (exit
+    with a non-zero exit code, or killed by a signal) are restarted, waiting an exponential backoff after consecutive
+    crashes. On stop, SIGTERM is sent to each child, so they drain their in-flight jobs, and killed if still running
+    after the stop timeout. The stats reported by each child are printed."""
+    global _stop_event
+    _stop_event = asyncio.Event()
+    context = multiprocessing.get_context("spawn")
+    stats_queue = context.Queue()
+    workers = [_WorkerProcess(index) for index in range(processes)]
+
+    print(f"Running {name} supervisor with {processes} processes")
+    try:
+        while not _stop_event.is_set():
+            now = time.monotonic()
+            for worker in workers:
+                if worker.process is not None and not worker.is_alive:
+                    _on_worker_exited(name, worker, settings, now)
+                if worker.process is None and not worker.finished and now >= worker.next_start_time and \
+                        not _stop_event.is_set():
+                    _start_worker(context, name, worker, target, stats_queue, settings)
+
+            _read_stats(name, workers, stats_queue)
+            if all(worker.finished for worker in workers):
+                print(f"All {name} processes finished")
+                break
+            try:
+                await asyncio.wait_for(_stop_event.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await _stop_workers(name, workers, settings)
+        _read_stats(name, workers, stats_queue)
+    print(f"{name} supervisor stopped")
+
+
+def stop_supervisor():
+    """Stop the supervisor, and its children after they drain their in-flight jobs"""
+    if _stop_event is not None:
+        _stop_event.set()
+
+
+def _start_worker(
+        context: multiprocessing.context.BaseContext,
+        name: str,
+        worker: _WorkerProcess,
+        target: Callable[[], Any],
+        stats_queue: multiprocessing.Queue,
+        settings: SupervisorSettings
+):
+    worker.process = context.Process(
+        target=_run_supervised_worker,
+        args=(target, stats_queue, settings.stats_interval),
+        name=f"{name}-{worker.index}",
+        daemon=False
+    )
+    worker.process.start()
+    worker.start_time = time.monotonic()
+    print(f"{name} process {worker.index} started (pid={worker.process.pid})")
+
+
+def _on_worker_exited(name: str, worker: _WorkerProcess, settings: SupervisorSettings, now: float):
+    """Schedule the restart of a crashed worker process. Processes that exited cleanly are not restarted."""
+    exitcode = worker.process.exitcode
+    if exitcode == 0:
+        worker.finished = True
+        worker.process = None
+        print(f"{name} process {worker.index} finished")
+        return
+
+    if now - worker.start_time >= settings.restart_reset_after:
+        worker.consecutive_failures = 0
+    worker.consecutive_failures += 1
+    delay = min(settings.restart_delay * 2 ** (worker.consecutive_failures - 1), settings.restart_delay_max)
+    worker.next_start_time = now + delay
+    worker.restarts_count += 1
+    worker.process = None
+    print(f"{name} process {worker.index} exited (exitcode={exitcode}), restarting in {delay:.1f}s "
+          f"(restart #{worker.restarts_count})")
+
+
+async def _stop_workers(name: str, workers: List[_WorkerProcess], settings: SupervisorSettings):
+    running = [worker for worker in workers if worker.is_alive]
+    print(f"Stopping {len(running)} {name} processes...")
+    for worker in running:
+        try:
+            os.kill(worker.process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + settings.stop_timeout
+    while any(worker.is_alive for worker in running) and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    for worker in running:
+        if worker.is_alive:
+            print(f"{name} process {worker.index} did not stop after {settings.stop_timeout}s, killing it")
+            worker.process.kill()
+        worker.process.join()
+
+
+def _read_stats(name: str, workers: List[_WorkerProcess], stats_queue: multiprocessing.Queue):
+    workers_by_pid = {worker.process.pid: worker for worker in workers if worker.process is not None}
+    while True:
+        try:
+            pid, stats = stats_queue.get_nowait()
+        except queue.Empty:
+            return
+        worker = workers_by_pid.get(pid)
+        if worker is None:
+            continue
+        print(f"{name} process {worker.index} (pid={pid}, restarts={worker.restarts_count}) stats: {stats}")
+
+
+def _run_supervised_worker(target: Callable[[], Any], stats_queue: multiprocessing.Queue, stats_interval: float):
+    """Entrypoint of the supervised child processes"""
+    global _stats_queue, _stats_interval
+    _stats_queue = stats_queue
+    _stats_interval = stats_interval
+    target()
+
+
+async def run_reporting_stats(worker: Awaitable[None], get_stats: Callable[[], Dict[str, Any]]):
+    """Run a worker coroutine. If running on a supervised process, report the stats (get_stats) to the supervisor
+    periodically while the worker runs, and once after it ends."""
+    if _stats_queue is None:
+        await worker
+        return
+
+    async def _report_periodically():
+        while True:
+            await asyncio.sleep(_stats_interval)
+            _report_stats()
+
+    def _report_stats():
+        try:
+            _stats_queue.put_nowait((os.getpid(), get_stats()))
+        except Exception as ex:
+            print("Could not report stats to the supervisor:", ex)
+
+    reporter = asyncio.create_task(_report_periodically())
+    try:
+        await worker
+    finally:
+        reporter.cancel()
+        _report_stats()
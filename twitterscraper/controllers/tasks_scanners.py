@@ -2,10 +2,14 @@ import asyncio
 import datetime
 from typing import *
 
-from twitterscraper.services import Repository, TwitterAPIClient, TwitterProfileNotFoundError
-from twitterscraper.models import TwitterProfile, FetchPersistJob, PersistedReviewJob
+from twitterscraper.services import Repository, TwitterAPIClient
+from twitterscraper.models import (
+    TwitterProfile, ProfileCoverage, FetchPersistJob, FetchPersistRangesJob, PersistedReviewRangesJob
+)
+from twitterscraper.settings import MainSettings
 from twitterscraper.utils import (
-    get_timestamp, get_uuid, date_to_datetime_range, timestamp_to_datetime, datetime_to_timestamp
+    get_timestamp, get_uuid, date_to_datetime_range, timestamp_to_datetime, datetime_to_timestamp, chunked,
+    is_review_due, date_to_timestamp, split_timestamp_range, get_timestamp_ranges_gaps, split_timestamp_range_by_days
 )
 import twitterscraper.controllers.fetchandpersist
 import twitterscraper.controllers.persistedreview
@@ -24,7 +28,7 @@ async def run_task_syncprofilestweets():
         print(f"{len(profiles)} active profiles for SyncProfilesTweets")
 
         now_timestamp = get_timestamp()
-        await asyncio.gather(*[
+        skipped_counts = await asyncio.gather(*[
             _create_syncprofilestweets_profile_jobs(
                 userid=profile.userid,
                 from_date=profile.joined_date,
@@ -33,7 +37,7 @@ async def run_task_syncprofilestweets():
             for profile in profiles
         ])
 
-    print("Task SyncProfilesTweets completed")
+    print(f"Task SyncProfilesTweets completed ({sum(skipped_counts)} duplicated ranges skipped)")
 
 
 async def run_task_newtweetsscan():
@@ -47,56 +51,170 @@ async def run_task_newtweetsscan():
     print("Task NewTweetsScan completed")
 
 
+async def run_task_fillcoveragegaps(username: Optional[str] = None):
+    """Enqueue FetchAndPersist jobs for the time ranges of the active profiles (or the given profile) which were
+    never fetched successfully, between the profile joined date and its last scan timestamp.
+    Ranges enqueued but not yet completed are considered gaps too, so this should run when no backfill is pending."""
+    print("Running task FillCoverageGaps")
+    repository = Repository.get()
+    async with repository.session_async():
+        if username:
+            profiles = [await repository.get_profile_by(username=username)]
+        else:
+            profiles = await repository.list_profiles_async(filter_active_profiles=True)
+        skipped_counts = await asyncio.gather(*[
+            _create_fillcoveragegaps_profile_jobs(profile)
+            for profile in profiles if profile.last_scan_timestamp
+        ])
+
+    print(f"Task FillCoverageGaps completed ({sum(skipped_counts)} duplicated ranges skipped)")
+
+
+async def _create_fillcoveragegaps_profile_jobs(profile: TwitterProfile) -> int:
+    """Create FetchAndPersist jobs for the coverage gaps of a single profile.
+    Return the amount of skipped (duplicated) ranges."""
+    settings = MainSettings.get()
+    from_ts = date_to_timestamp(profile.joined_date)
+    to_ts = profile.last_scan_timestamp
+    coverage = await Repository.get().get_profile_coverage(
+        profile_id=profile.id,
+        kind=ProfileCoverage.Kind.FETCH,
+        from_timestamp=from_ts,
+        to_timestamp=to_ts
+    )
+
+    gaps = get_timestamp_ranges_gaps(coverage, from_ts, to_ts)
+    ranges = [
+        gap_range
+        for gap_from_ts, gap_to_ts in gaps
+        for gap_range in split_timestamp_range(gap_from_ts, gap_to_ts, settings.jobs.backfill_range_days * 86400)
+    ]
+    gaps_seconds = sum(gap_to_ts - gap_from_ts for gap_from_ts, gap_to_ts in gaps)
+    print(f"Profile {profile.userid}: {len(gaps)} coverage gaps, {gaps_seconds} seconds not covered")
+
+    jobs = [
+        FetchPersistRangesJob(
+            job_id=get_uuid(),
+            userid=profile.userid,
+            ranges=ranges_chunk,
+            priority=settings.amqp.priorities.creator
+        )
+        for ranges_chunk in chunked(ranges, settings.jobs.ranges_per_job)
+    ]
+    return await twitterscraper.controllers.fetchandpersist.enqueue_fetchandpersist_jobs(*jobs)
+
+
 async def _profile_new_tweets_scan(profile: TwitterProfile):
+    """Create FetchAndPersist jobs for the new tweets of a profile, one per day, so long ranges (e.g. after an outage)
+    are fetched concurrently. The last_scan_timestamp watermark only advances up to where the ranges fetched since
+    it are contiguous (according to the profile fetch coverage), so ranges of failed jobs are not lost: if not covered
+    after the dedup_pending_window, they are enqueued again."""
     repository = Repository.get()
+    settings = MainSettings.get()
     now = get_timestamp()
-    # TODO create split tasks by time (one per day)
-    job = FetchPersistJob(
-        job_id=get_uuid(),
-        userid=profile.userid,
+
+    coverage = await repository.get_profile_coverage(
+        profile_id=profile.id,
+        kind=ProfileCoverage.Kind.FETCH,
         from_timestamp=profile.last_scan_timestamp,
         to_timestamp=now
     )
-    await twitterscraper.controllers.fetchandpersist.enqueue_fetchandpersist_jobs(job)
-
-    profile.last_scan_timestamp = now
+    if coverage and coverage[0][0] <= profile.last_scan_timestamp:
+        profile.last_scan_timestamp = max(profile.last_scan_timestamp, min(coverage[0][1], now))
+    enqueued_ts = max(profile.last_scan_timestamp, profile.last_scan_enqueued_timestamp or 0)
+
+    # Ranges enqueued before the pending window and still not covered are considered lost
+    lost_before_ts = now - settings.jobs.dedup_pending_window
+    ranges = list()
+    for gap_from_ts, gap_to_ts in get_timestamp_ranges_gaps(coverage, profile.last_scan_timestamp, enqueued_ts):
+        if gap_from_ts < lost_before_ts:
+            ranges.extend(split_timestamp_range_by_days(gap_from_ts, min(gap_to_ts, lost_before_ts)))
+    lost_ranges_count = len(ranges)
+    ranges.extend(split_timestamp_range_by_days(enqueued_ts, now))
+
+    jobs = [
+        FetchPersistJob(
+            job_id=get_uuid(),
+            userid=profile.userid,
+            from_timestamp=from_ts,
+            to_timestamp=to_ts,
+            priority=settings.amqp.priorities.new_tweets_scan
+        )
+        for from_ts, to_ts in ranges
+    ]
+    print(f"Profile {profile.userid}: {len(jobs)} new tweets jobs ({lost_ranges_count} lost ranges enqueued again), "
+          f"scanned until {profile.last_scan_timestamp}")
+    await twitterscraper.controllers.fetchandpersist.enqueue_fetchandpersist_jobs(*jobs)
+
+    profile.last_scan_enqueued_timestamp = now
     await repository.save_object_async(profile)
 
 
 async def _sync_profiles_active(profiles: List[TwitterProfile]) -> List[TwitterProfile]:
-    """Verify which profiles are still active. Active profiles are returned, while unactive profiles are ignored.
-    The state of the inactive-detected profiles is persisted on DB. Usernames are synced with the DB."""
-    results = await asyncio.gather(*[_sync_profile_active(profile) for profile in profiles])
-    active_userids = [userid for userid, active in results if active]
-    return [profile for profile in profiles if profile.userid in active_userids]
-
-
-async def _sync_profile_active(profile: TwitterProfile) -> Tuple[str, bool]:
-    """Verify if single TwitterProfile is still active. If active, return (userid, True).
-    If inactive, persist the state in DB and return (userid, False). Username is synced with the DB."""
-    try:
-        current_username = await TwitterAPIClient.get().get_username(profile.userid)
-        profile.username = current_username
-        active = profile.active = True
-    except TwitterProfileNotFoundError:
-        # TODO what happens with private users? (still exist, but tweets can't be fetched) TEST WITH MY TEST USER
-        active = profile.active = False
-        print(f"Profile", profile, "changed to INACTIVE")
-
-    await Repository.get().save_object_async(profile)
-    return profile.userid, active
-
-
-async def _create_syncprofilestweets_profile_jobs(userid: str, from_date: datetime.date, to_ts: int):
-    """Create PersistedReview jobs for a single user, during the given timestamps range (inclusive-exclusive)."""
-    # TODO Should generate jobs only for dates when the user has tweets (check from persisted)
-    jobs = list()
+    """Verify which profiles are still active, looking them up in batches. Active profiles are returned, while
+    unactive profiles are ignored. The state of the inactive-detected profiles is persisted on DB.
+    Usernames are synced with the DB. Profiles which lookup failed keep their state, and are ignored on this run."""
+    repository = Repository.get()
+    lookup = await TwitterAPIClient.get().get_usernames(profile.userid for profile in profiles)
+
+    active_profiles = list()
+    changed_profiles = list()
+    for profile in profiles:
+        if profile.userid in lookup.usernames:
+            current_username = lookup.usernames[profile.userid]
+            if profile.username != current_username or not profile.active:
+                profile.username = current_username
+                profile.active = True
+                changed_profiles.append(profile)
+            active_profiles.append(profile)
+        elif profile.userid in lookup.not_found:
+            # TODO what happens with private users? (still exist, but tweets can't be fetched) TEST WITH MY TEST USER
+            profile.active = False
+            changed_profiles.append(profile)
+            print(f"Profile", profile, "changed to INACTIVE")
+
+    if changed_profiles:
+        await repository.save_object_async(*changed_profiles)
+    if lookup.failed:
+        print(f"{len(lookup.failed)} profiles could not be verified, ignored on this run")
+    print("Twitter API quota:", TwitterAPIClient.get().stats())
+    return active_profiles
+
+
+async def _create_syncprofilestweets_profile_jobs(userid: str, from_date: datetime.date, to_ts: int) -> int:
+    """Create PersistedReview jobs for a single user, during the given timestamps range (inclusive-exclusive).
+    Only the days with active persisted tweets, which review is due according to their age and last review
+    (see JobsSettings.review_intervals), are reviewed.
+    Return the amount of skipped (duplicated) ranges."""
+    settings = MainSettings.get()
+    ranges_per_job = settings.jobs.ranges_per_job
+    review_intervals = settings.jobs.get_review_intervals_seconds()
+    days_last_review = await Repository.get().get_profile_days_last_review(userid)
+
+    ranges = list()
     for from_datetime, to_datetime in date_to_datetime_range(from_date, timestamp_to_datetime(to_ts)):
-        jobs.append(PersistedReviewJob(
+        from_ts = datetime_to_timestamp(from_datetime)
+        if from_ts not in days_last_review:
+            # no active tweets persisted on this day
+            continue
+        if not is_review_due(
+                day_timestamp=from_ts,
+                last_review_timestamp=days_last_review[from_ts],
+                now=to_ts,
+                review_intervals=review_intervals
+        ):
+            continue
+        ranges.append((from_ts, datetime_to_timestamp(to_datetime)))
+
+    print(f"Profile {userid}: {len(ranges)} days to review, of {len(days_last_review)} days with tweets")
+    jobs = [
+        PersistedReviewRangesJob(
             job_id=get_uuid(),
             userid=userid,
-            from_timestamp=datetime_to_timestamp(from_datetime),
-            to_timestamp=datetime_to_timestamp(to_datetime)
-        ))
+            ranges=ranges_chunk,
+            priority=settings.amqp.priorities.sync_profiles_tweets
+        )
+        for ranges_chunk in chunked(ranges, ranges_per_job)
+    ]
 
-    await twitterscraper.controllers.persistedreview.enqueue_persistedreview_jobs(*jobs)
+    return await twitterscraper.controllers.persistedreview.enqueue_persistedreview_jobs(*jobs)
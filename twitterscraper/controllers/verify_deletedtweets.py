@@ -23,7 +23,7 @@ async def run_verify_deletedtweets():
 
 async def _verify_tweet_against_server(tweet: TwitterTweet, server: str) -> Tuple[TwitterTweet, str, bool]:
     print("Verifying", tweet.tweet_id)
-    status = await TwitterNitterClient([server]).get_tweet_status(tweet.tweet_id)
+    status = await TwitterNitterClient.get().get_tweet_status(tweet.tweet_id, server=server)
     return tweet, server, status.exists
 
 
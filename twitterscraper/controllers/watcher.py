@@ -0,0 +1,168 @@
+import time
+import random
+import asyncio
+import hashlib
+from typing import *
+
+from twitterscraper.services import Repository, TwitterNitterClient
+from twitterscraper.models import TwitterProfile
+from twitterscraper.settings import MainSettings, WatchSettings
+from twitterscraper.utils import get_timestamp
+import twitterscraper.controllers.persistedreview
+
+_stop_event: Optional[asyncio.Event] = None
+
+
+class _WatchedProfile:
+    """In-memory state of a watched profile, kept between polls"""
+
+    def __init__(self, profile: TwitterProfile):
+        self.profile = profile
+        self.known_tweets: Dict[str, int] = dict()
+        """Persisted active tweets of the watched window: {tweet id: timestamp}"""
+        self.verified_tweets: Dict[str, int] = dict()
+        """Tweets missing from the recent timeline, verified as existing: {tweet id: verification timestamp}"""
+        self.unknown_tweets_ids: Set[str] = set()
+        """Online tweets not persisted (yet) on the last resync from the database"""
+        self.baseurl: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.body_hash: Optional[str] = None
+
+
+async def run_watcher():
+    """Poll the recent timeline of the watched profiles (WatchSettings) until stop_watcher() is called,
+    detecting their deleted tweets within minutes."""
+    global _stop_event
+    _stop_event = asyncio.Event()
+    settings = MainSettings.get().watch
+    if not settings.profiles:
+        print("No profiles to watch")
+        return
+
+    print(f"Running Watcher for {len(settings.profiles)} profiles")
+    await asyncio.gather(*[_watch_profile(username, settings) for username in settings.profiles])
+    print("Watcher stopped")
+
+
+def stop_watcher():
+    """Stop the watcher. Polls currently running are completed before run_watcher() returns."""
+    if _stop_event is not None:
+        _stop_event.set()
+
+
+async def _watch_profile(username: str, settings: WatchSettings):
+    interval = settings.interval.total_seconds()
+    watched: Optional[_WatchedProfile] = None
+    # spread the polls of the profiles along the interval
+    delay = random.uniform(0, interval)
+
+    while True:
+        try:
+            await asyncio.wait_for(_stop_event.wait(), timeout=delay)
+            # stop event set while waiting
+            return
+        except asyncio.TimeoutError:
+            pass
+        delay = interval
+
+        start = time.monotonic()
+        try:
+            if watched is None:
+                watched = _WatchedProfile(await Repository.get().get_profile_by(username=username))
+                await _resync_known_tweets(watched, settings)
+            result = await _poll_profile(watched, settings)
+        except Exception as ex:
+            result = f"failed ({ex!r})"
+        print(f"Watcher poll of {username} {result} in {time.monotonic() - start:.1f}s")
+
+
+async def _resync_known_tweets(watched: _WatchedProfile, settings: WatchSettings):
+    """Load the persisted active tweets of the watched window into memory"""
+    tweets = await Repository.get().get_tweets(
+        userid=watched.profile.userid,
+        from_ts=get_timestamp() - int(settings.window.total_seconds()),
+        filter_active_tweets=True
+    )
+    watched.known_tweets = {tweet.tweet_id: tweet.timestamp for tweet in tweets}
+
+
+async def _poll_profile(watched: _WatchedProfile, settings: WatchSettings) -> str:
+    """Compare the recent timeline of the profile against its persisted tweets, marking the deleted tweets.
+    Return a summary of the poll result."""
+    now = get_timestamp()
+    window_from = now - int(settings.window.total_seconds())
+    username = watched.profile.username
+
+    body, baseurl, headers = await TwitterNitterClient.get().get_profile_rss(
+        username=username,
+        baseurl=watched.baseurl,
+        etag=watched.etag,
+        last_modified=watched.last_modified
+    )
+    if body is None:
+        return "not modified"
+    body_hash = hashlib.sha1(body).hexdigest()
+    if body_hash == watched.body_hash:
+        return "unchanged"
+
+    # noinspection PyProtectedMember
+    online_tweets, reached_from = TwitterNitterClient._nitter_parse_rss(
+        username=username,
+        from_timestamp=window_from,
+        to_timestamp=now + 3600,
+        chunks=[body]
+    )
+    online_tweets_ids = {tweet.tweet_id for tweet in online_tweets}
+    # the feed only contains the most recent tweets: compare only the period it covers
+    covered_from = window_from
+    if not reached_from:
+        covered_from = min((tweet.timestamp for tweet in online_tweets), default=now)
+
+    unknown_tweets_ids = online_tweets_ids - set(watched.known_tweets)
+    if unknown_tweets_ids and unknown_tweets_ids != watched.unknown_tweets_ids:
+        # new tweets found online, that may have been persisted since the last resync
+        await _resync_known_tweets(watched, settings)
+        watched.unknown_tweets_ids = online_tweets_ids - set(watched.known_tweets)
+
+    watched.known_tweets = {
+        tweet_id: timestamp for tweet_id, timestamp in watched.known_tweets.items() if timestamp >= window_from
+    }
+    recheck_after = now - int(settings.recheck_interval.total_seconds())
+    watched.verified_tweets = {
+        tweet_id: timestamp for tweet_id, timestamp in watched.verified_tweets.items() if timestamp >= recheck_after
+    }
+    candidates_ids = {
+        tweet_id for tweet_id, timestamp in watched.known_tweets.items()
+        if timestamp >= covered_from and tweet_id not in online_tweets_ids and tweet_id not in watched.verified_tweets
+    }
+
+    removed_tweets_ids = set()
+    if candidates_ids:
+        print(f"Watcher found {len(candidates_ids)} tweets of {username} missing, double-checking... {candidates_ids}")
+        removed_tweets_ids = await twitterscraper.controllers.persistedreview.verify_removed_tweets(candidates_ids)
+        if removed_tweets_ids:
+            await _set_tweets_deleted(removed_tweets_ids)
+        for tweet_id in candidates_ids - removed_tweets_ids:
+            watched.verified_tweets[tweet_id] = now
+        for tweet_id in removed_tweets_ids:
+            watched.known_tweets.pop(tweet_id, None)
+
+    watched.baseurl = baseurl
+    watched.etag = headers.get("ETag")
+    watched.last_modified = headers.get("Last-Modified")
+    watched.body_hash = body_hash
+    return f"compared online={len(online_tweets_ids)} known={len(watched.known_tweets)} " \
+           f"candidates={len(candidates_ids)} removed={len(removed_tweets_ids)}"
+
+
+async def _set_tweets_deleted(tweets_ids: Set[str]):
+    repository = Repository.get()
+    now = get_timestamp()
+    async with repository.session_async():
+        tweets = await repository.get_tweets(tweets_ids=list(tweets_ids), filter_active_tweets=True)
+        for tweet in tweets:
+            tweet.last_review_timestamp = now
+            tweet.deletion_detected_timestamp = now
+            print(f"Detected deleted tweet {tweet.tweet_id}, published {now - tweet.timestamp}s ago")
+        await repository.save_object_async(*tweets)
@@ -1,4 +1,6 @@
+import signal
 import asyncio
+import functools
 import contextlib
 from typing import *
 
@@ -8,9 +10,15 @@ import twitterscraper.controllers.creator
 import twitterscraper.controllers.fetchandpersist
 import twitterscraper.controllers.persistedreview
 import twitterscraper.controllers.tasks_scanners
+import twitterscraper.controllers.scheduler
+import twitterscraper.controllers.supervisor
+import twitterscraper.controllers.watcher
 import twitterscraper.controllers.system
 from twitterscraper.settings import MainSettings, load_settings
-from twitterscraper.services import Repository, AMQPClient, TwitterAPIClient, TwitterNitterClient
+from twitterscraper.services import (
+    Repository, AMQPClient, TwitterAPIClient, TwitterNitterClient, TwitterTimelineRouter
+)
+from twitterscraper.services.knowntweets import KnownTweetsFilter
 from twitterscraper.utils import async_entrypoint
 
 
@@ -26,11 +34,28 @@ async def creator(username: str):
 
 @app.command()
 @async_entrypoint
-async def worker_fetchandpersist(workers: Optional[int] = None):
+async def worker_fetchandpersist(workers: Optional[int] = None, processes: int = 1):
+    if processes > 1:
+        await run_supervisor(
+            name="FetchAndPersist",
+            processes=processes,
+            target=functools.partial(worker_fetchandpersist, workers=workers)
+        )
+        return
+
     async with setup_teardown():
+        settings = MainSettings.get()
         if workers is not None:
-            MainSettings.get().amqp.queues.fetchpersist.workers = workers
-        await twitterscraper.controllers.fetchandpersist.run_fetchandpersist_worker()
+            settings.amqp.queues.fetchpersist.workers = workers
+        handle_stop_signals()
+        await twitterscraper.controllers.supervisor.run_reporting_stats(
+            twitterscraper.controllers.fetchandpersist.run_fetchandpersist_worker(),
+            get_stats=lambda: dict(
+                amqp=AMQPClient.get().stats(),
+                timeline=TwitterTimelineRouter.get().stats(),
+                known_tweets=KnownTweetsFilter.get().stats() if settings.jobs.known_tweets_filter else None
+            )
+        )
 
 
 @app.command()
@@ -42,11 +67,27 @@ async def worker_fetchandpersist_once():
 
 @app.command()
 @async_entrypoint
-async def worker_persistedreview(workers: Optional[int] = None):
+async def worker_persistedreview(workers: Optional[int] = None, processes: int = 1):
+    if processes > 1:
+        await run_supervisor(
+            name="PersistedReview",
+            processes=processes,
+            target=functools.partial(worker_persistedreview, workers=workers)
+        )
+        return
+
     async with setup_teardown():
         if workers is not None:
             MainSettings.get().amqp.queues.persistedreview.workers = workers
-        await twitterscraper.controllers.persistedreview.run_persistedreview_worker()
+        handle_stop_signals()
+        await twitterscraper.controllers.supervisor.run_reporting_stats(
+            twitterscraper.controllers.persistedreview.run_persistedreview_worker(),
+            get_stats=lambda: dict(
+                amqp=AMQPClient.get().stats(),
+                timeline=TwitterTimelineRouter.get().stats(),
+                twitter_api=TwitterAPIClient.get().stats()
+            )
+        )
 
 
 @app.command()
@@ -77,6 +118,13 @@ async def task_syncprofilestweets():
         await twitterscraper.controllers.tasks_scanners.run_task_syncprofilestweets()
 
 
+@app.command()
+@async_entrypoint
+async def task_fillcoveragegaps(username: Optional[str] = None):
+    async with setup_teardown():
+        await twitterscraper.controllers.tasks_scanners.run_task_fillcoveragegaps(username)
+
+
 @app.command()
 @async_entrypoint
 async def verify_deletedtweets():
@@ -85,6 +133,26 @@ async def verify_deletedtweets():
         await twitterscraper.controllers.verify_deletedtweets.run_verify_deletedtweets()
 
 
+@app.command()
+@async_entrypoint
+async def scheduler():
+    async with setup_teardown():
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, twitterscraper.controllers.scheduler.stop_scheduler)
+        await twitterscraper.controllers.scheduler.run_scheduler()
+
+
+@app.command()
+@async_entrypoint
+async def watcher():
+    async with setup_teardown():
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, twitterscraper.controllers.watcher.stop_watcher)
+        await twitterscraper.controllers.watcher.run_watcher()
+
+
 @app.command()
 def db_migrate():
     twitterscraper.controllers.system.db_migrate()
@@ -108,6 +176,27 @@ async def setup_teardown():
         await teardown()
 
 
+async def run_supervisor(name: str, processes: int, target: Callable[[], Any]):
+    """Run a worker command on multiple supervised processes (each process sets up its own connections)"""
+    settings = load_settings()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, twitterscraper.controllers.supervisor.stop_supervisor)
+    await twitterscraper.controllers.supervisor.run_supervisor(
+        name=name,
+        processes=processes,
+        target=target,
+        settings=settings.supervisor
+    )
+
+
+def handle_stop_signals():
+    """Stop consuming on SIGINT/SIGTERM, letting the worker drain its in-flight jobs before the teardown."""
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, AMQPClient.get().stop_consuming)
+
+
 async def setup():
     settings = load_settings()
     twitter_keys = settings.twitter.keys
@@ -116,10 +205,45 @@ async def setup():
         api_key=twitter_keys.key,
         api_secret=twitter_keys.secret,
         api_token=twitter_keys.token,
+        users_lookup_batch_size=settings.twitter.users_lookup_batch_size,
+        users_lookup_concurrency=settings.twitter.users_lookup_concurrency,
+        tweets_lookup_concurrency=settings.twitter.tweets_lookup_concurrency,
+        api_async=settings.twitter.api_async,
+        api_pacing_ratio=settings.twitter.api_pacing_ratio,
+        api_timeout=settings.twitter.api_timeout,
+    ).set_singleton()
+    TwitterNitterClient(
+        baseurls=settings.twitter.nitter_baseurl,
+        failures_threshold=settings.twitter.nitter_failures_threshold,
+        failures_cooldown=settings.twitter.nitter_failures_cooldown,
+        page_attempts=settings.twitter.nitter_page_attempts,
+    ).set_singleton()
+    TwitterTimelineRouter(
+        nitter_client=TwitterNitterClient.get(),
+        api_client=TwitterAPIClient.get(),
+        mode=settings.twitter.timeline_source,
+        api_max_age=int(settings.twitter.timeline_api_max_age.total_seconds()),
+        api_cost=settings.twitter.timeline_api_cost,
+        api_min_remaining=settings.twitter.timeline_api_min_remaining,
     ).set_singleton()
-    TwitterNitterClient(baseurls=settings.twitter.nitter_baseurl).set_singleton()
     Repository(uri=settings.persistence.uri).set_singleton()
-    AMQPClient(uri=settings.amqp.uri).set_singleton()
+    KnownTweetsFilter(
+        loader=Repository.get().get_profile_tweets_ids,
+        max_profiles=settings.jobs.known_tweets_filter_max_profiles,
+        ttl=int(settings.jobs.known_tweets_filter_ttl.total_seconds()),
+    ).set_singleton()
+    AMQPClient(
+        uri=settings.amqp.uri,
+        publish_batch_size=settings.amqp.publish_batch_size,
+        publish_max_unconfirmed=settings.amqp.publish_max_unconfirmed,
+        publish_retries=settings.amqp.publish_retries,
+        publish_timeout=settings.amqp.publish_timeout,
+        drain_timeout=settings.amqp.drain_timeout,
+        retry_max_attempts=settings.amqp.retry_max_attempts,
+        retry_delay=settings.amqp.retry_delay,
+        retry_backoff=settings.amqp.retry_backoff,
+        partition_defer_delay=settings.amqp.partition_defer_delay,
+    ).set_singleton()
 
     await asyncio.gather(
         AMQPClient.get().connect(),
@@ -130,7 +254,9 @@ async def setup():
 async def teardown():
     await asyncio.gather(
         AMQPClient.get().close(),
-        Repository.get().close()
+        Repository.get().close(),
+        TwitterAPIClient.get().close(),
+        TwitterNitterClient.get().close()
     )
 
 
@@ -2,9 +2,11 @@ import datetime
 from typing import *
 
 import pydantic
-from sqlmodel import SQLModel, Field, Relationship, Column, JSON
+from sqlalchemy import text
+from sqlmodel import SQLModel, Field, Relationship, Column, JSON, Index
 
-__all__ = ("TwitterProfile", "TwitterTweet", "JobHistoric", "TweetScanStatus")
+__all__ = ("TwitterProfile", "TwitterTweet", "ScrapedTweet", "JobHistoric", "JobHistoricKey", "ProfileCoverage",
+           "TweetsRangeFingerprint", "TweetScanStatus", "TwitterUsersLookup")
 
 
 class TwitterProfile(SQLModel, table=True):
@@ -17,6 +19,9 @@ class TwitterProfile(SQLModel, table=True):
     joined_date: datetime.date = Field()
     active: bool = Field(default=True)
     last_scan_timestamp: Optional[int] = Field(default=None, gt=0)
+    """Watermark of the NewTweetsScan: all the tweets before this timestamp were fetched"""
+    last_scan_enqueued_timestamp: Optional[int] = Field(default=None, gt=0)
+    """End timestamp of the ranges enqueued by the last NewTweetsScan, which may not be fetched yet"""
 
     # Relationships
     tweets: List["TwitterTweet"] = Relationship(back_populates="profile")
@@ -44,6 +49,24 @@ class TwitterTweet(SQLModel, table=True):
         return f"https://www.twitter.com/{self.profile.username}/status/{self.tweet_id}"
 
 
+class ScrapedTweet(NamedTuple):
+    """Tweet parsed from a timeline (Nitter or Twitter API). Plain tuple, without the validation and ORM
+    instrumentation of TwitterTweet, which is only built (to_tweet) when persisting the tweet"""
+    tweet_id: str
+    text: str
+    timestamp: int
+    is_reply: bool
+
+    def to_tweet(self, profile: TwitterProfile) -> TwitterTweet:
+        return TwitterTweet(
+            profile_id=profile.id,
+            tweet_id=self.tweet_id,
+            text=self.text,
+            timestamp=self.timestamp,
+            is_reply=self.is_reply
+        )
+
+
 class JobHistoric(SQLModel, table=True):
     __tablename__ = "jobs_historic"
 
@@ -52,6 +75,76 @@ class JobHistoric(SQLModel, table=True):
     data: Dict = Field(sa_column=Column(JSON, nullable=False))
     timestamp_created: int = Field(gt=0, nullable=False)
     timestamp_finalized: Optional[int] = Field(default=None, gt=0)
+    failures: int = Field(default=0, nullable=False, sa_column_kwargs=dict(server_default="0"))
+    last_failure_timestamp: Optional[int] = Field(default=None, gt=0)
+    progress: Optional[Dict] = Field(default=None, sa_column=Column(JSON, nullable=True))
+    """Partial progress of the job, for resuming it if retried (like the time ranges completed)"""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class JobHistoricKey(SQLModel, table=True):
+    """Idempotency key of a time range of a persisted job (see BaseJob.get_idempotency_keys). A key can be pending on
+    a single job only (partial unique index), guarding against duplicated jobs enqueued concurrently."""
+    __tablename__ = "jobs_historic_keys"
+    __table_args__ = (
+        Index("ix_jobs_historic_keys_pending_key", "idempotency_key", unique=True, postgresql_where=text("pending")),
+    )
+
+    # Columns
+    job_id: str = Field(foreign_key=f"{JobHistoric.__tablename__}.job_id", primary_key=True)
+    idempotency_key: str = Field(primary_key=True, index=True)
+    pending: bool = Field(default=True, nullable=False)
+    """The job is not finalized, and not considered lost (created within the dedup_pending_window)"""
+    timestamp_created: int = Field(gt=0)
+    timestamp_finalized: Optional[int] = Field(default=None, gt=0)
+
+
+class ProfileCoverage(SQLModel, table=True):
+    """Time range of a profile that was successfully scanned. Ranges of the same profile and kind are merged when
+    persisted, although they may overlap if persisted concurrently."""
+    __tablename__ = "profiles_coverage"
+    __table_args__ = (
+        Index("ix_profiles_coverage_profile_kind_from", "profile_id", "kind", "from_timestamp"),
+    )
+
+    class Kind:
+        FETCH = "fetch"
+        REVIEW = "review"
+
+    # Columns
+    id: Optional[int] = Field(default=None, primary_key=True)  # autoincrement
+    profile_id: int = Field(foreign_key=f"{TwitterProfile.__tablename__}.id")
+    kind: str = Field()
+    """Kind of scan: fetch (FetchAndPersist) or review (PersistedReview)"""
+    from_timestamp: int = Field()
+    """Unix timestamp, UTC, inclusive"""
+    to_timestamp: int = Field()
+    """Unix timestamp, UTC, exclusive"""
+
+
+class TweetsRangeFingerprint(SQLModel, table=True):
+    """Fingerprint of the last review of a profile time range, for skipping the next review if nothing changed"""
+    __tablename__ = "tweets_ranges_fingerprints"
+    __table_args__ = (
+        Index("ix_tweets_ranges_fingerprints_profile_range", "profile_id", "from_timestamp", "to_timestamp",
+              unique=True),
+    )
+
+    # Columns
+    id: Optional[int] = Field(default=None, primary_key=True)  # autoincrement
+    profile_id: int = Field(foreign_key=f"{TwitterProfile.__tablename__}.id")
+    from_timestamp: int = Field()
+    to_timestamp: int = Field()
+    source: str = Field()
+    """Timeline source the pages were fetched from (pages differ between sources)"""
+    pages_hashes: List[str] = Field(sa_column=Column(JSON, nullable=False))
+    """Hash of the tweets ids of each non-empty page fetched online, in order (see get_ids_fingerprint)"""
+    persisted_fingerprint: str = Field()
+    """Hash of the ids of the active persisted tweets of the range after the review (see get_ids_fingerprint)"""
+    timestamp: int = Field(gt=0)
+    """When the range was last reviewed"""
 
     class Config:
         arbitrary_types_allowed = True
@@ -61,3 +154,13 @@ class TweetScanStatus(pydantic.BaseModel):
     tweet_id: str
     exists: bool
     timestamp: Optional[int]
+
+
+class TwitterUsersLookup(pydantic.BaseModel):
+    """Result of looking up multiple profiles by userid on the Twitter API"""
+    usernames: Dict[str, str] = pydantic.Field(default_factory=dict)
+    """Found profiles, as {userid: current username}"""
+    not_found: Set[str] = pydantic.Field(default_factory=set)
+    """Userids of profiles that do not exist or are not available (deleted, suspended)"""
+    failed: Set[str] = pydantic.Field(default_factory=set)
+    """Userids which lookup failed (request error or unexpected response), so their state is unknown"""
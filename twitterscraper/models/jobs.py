@@ -1,6 +1,23 @@
+import json
+import uuid
+import hashlib
+from typing import *
+
+import msgpack
 import pydantic
 
-__all__ = ("BaseJob", "FetchPersistJob", "PersistedReviewJob")
+__all__ = (
+    "BaseJob", "FetchPersistJob", "PersistedReviewJob", "FetchPersistRangesJob", "PersistedReviewRangesJob",
+    "JobPriority", "JobScrollCheckpoint", "JobEncoding", "encode_job", "decode_job"
+)
+
+TimestampRange = Tuple[int, int]
+
+
+class JobPriority:
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
 
 
 class BaseJob(pydantic.BaseModel):
@@ -10,9 +27,23 @@ class BaseJob(pydantic.BaseModel):
     """Constant string for each class of job."""
     job_version: int
     """Schema version of the job. Must be upgraded on breaking changes."""
+    priority: Literal["high", "normal", "low"] = JobPriority.NORMAL
+    """Priority of the job. Each priority is enqueued on a different lane (queue) of the job type queue."""
+
+    def get_idempotency_keys(self) -> Dict[TimestampRange, str]:
+        """Return a key for each time range of the job, identifying the work done on it: jobs (of any class) with the
+        same key do the same work on that range, so the range can be deduplicated. Empty if the job can not be
+        deduplicated."""
+        return dict()
+
+
+def _get_range_idempotency_key(work_type: str, userid: str, from_ts: int, to_ts: int) -> str:
+    return hashlib.sha1(f"{work_type}:{userid}:{from_ts}-{to_ts}".encode("utf-8")).hexdigest()
 
 
 class _BaseUserTweetsJob(BaseJob):
+    work_type: ClassVar[str]
+    """Work done by the job on each time range, shared by the single and multiple ranges classes of a job"""
     userid: str
     """Current username. Should be queried using the userid before creating the job, so we query the updated username"""
     from_timestamp: int
@@ -20,12 +51,202 @@ class _BaseUserTweetsJob(BaseJob):
     to_timestamp: int
     """End of the scan time range. Unix timestamp, UTC, exclusive."""
 
+    def get_ranges(self) -> List[TimestampRange]:
+        return [(self.from_timestamp, self.to_timestamp)]
+
+    def get_idempotency_keys(self) -> Dict[TimestampRange, str]:
+        return {
+            (from_ts, to_ts): _get_range_idempotency_key(self.work_type, self.userid, from_ts, to_ts)
+            for from_ts, to_ts in self.get_ranges()
+        }
+
+
+class _BaseUserTweetsRangesJob(BaseJob):
+    work_type: ClassVar[str]
+    userid: str
+    """Current username. Should be queried using the userid before creating the job, so we query the updated username"""
+    ranges: List[Tuple[int, int]]
+    """Scan time ranges, as (from_timestamp, to_timestamp). Unix timestamps, UTC, from inclusive, to exclusive."""
+
+    def get_ranges(self) -> List[TimestampRange]:
+        return [(from_ts, to_ts) for from_ts, to_ts in self.ranges]
+
+    def get_idempotency_keys(self) -> Dict[TimestampRange, str]:
+        return {
+            (from_ts, to_ts): _get_range_idempotency_key(self.work_type, self.userid, from_ts, to_ts)
+            for from_ts, to_ts in self.get_ranges()
+        }
+
 
 class FetchPersistJob(_BaseUserTweetsJob):
     job_type: str = pydantic.ConstrainedStr("FetchAndPersist")
-    job_version: int = pydantic.ConstrainedInt(1)
+    job_version: int = pydantic.ConstrainedInt(2)
+    work_type = "FetchAndPersist"
 
 
 class PersistedReviewJob(_BaseUserTweetsJob):
     job_type: str = pydantic.ConstrainedStr("PersistedReviewJob")
-    job_version: int = pydantic.ConstrainedInt(1)
+    job_version: int = pydantic.ConstrainedInt(2)
+    work_type = "PersistedReview"
+
+
+class FetchPersistRangesJob(_BaseUserTweetsRangesJob):
+    """FetchAndPersist job for multiple time ranges of the same profile, processed on a single message."""
+    job_type: str = pydantic.ConstrainedStr("FetchAndPersistRanges")
+    job_version: int = pydantic.ConstrainedInt(2)
+    work_type = "FetchAndPersist"
+
+
+class PersistedReviewRangesJob(_BaseUserTweetsRangesJob):
+    """PersistedReview job for multiple time ranges of the same profile, processed on a single message."""
+    job_type: str = pydantic.ConstrainedStr("PersistedReviewRanges")
+    job_version: int = pydantic.ConstrainedInt(2)
+    work_type = "PersistedReview"
+
+
+class JobScrollCheckpoint(pydantic.BaseModel):
+    """Progress of a paginated fetch of a job time range, persisted after each page, so a retried job can resume the
+    scroll from the next page instead of the first one."""
+    from_timestamp: int
+    to_timestamp: int
+    cursor: str
+    """Cursor of the next page to fetch (Nitter URL params or Twitter API pagination token, depending on source)"""
+    source: str = "nitter"
+    """Timeline source the cursor belongs to"""
+    last_timestamp: Optional[int] = None
+    """Timestamp of the oldest tweet fetched so far (pages are fetched from newest to oldest)"""
+    pages_count: int = 0
+    tweets_count: int = 0
+    """Tweets found on the pages fetched so far, already persisted"""
+    failed_count: int = 0
+    """Tweets found on the pages fetched so far that failed persisting"""
+
+
+class JobEncoding:
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+_JOB_CLASSES: Tuple[Type[BaseJob], ...] = (
+    FetchPersistJob, PersistedReviewJob, FetchPersistRangesJob, PersistedReviewRangesJob
+)
+_JOB_HEADER_FIELDS = ("job_type", "job_version", "job_id")
+_JobLayout = Tuple[Type[BaseJob], Tuple[str, ...]]
+
+
+def _get_job_layout(cls: Type[BaseJob], exclude: Tuple[str, ...] = ()) -> _JobLayout:
+    """Return the (class, fields) of a job class, where fields are the field names encoded after the header,
+    on the order they are encoded."""
+    return cls, tuple(field for field in cls.__fields__ if field not in (*_JOB_HEADER_FIELDS, *exclude))
+
+
+def _get_job_class_key(cls: Type[BaseJob]) -> Tuple[str, int]:
+    return str(cls.__fields__["job_type"].default), int(cls.__fields__["job_version"].default)
+
+
+_JOB_LAYOUTS: Dict[Tuple[str, int], _JobLayout] = {
+    _get_job_class_key(cls): _get_job_layout(cls) for cls in _JOB_CLASSES
+}
+"""Encoding layout of each (job_type, job_version). Layouts of previous versions must be kept here while messages
+with those versions may still be enqueued."""
+# Version 1: jobs without priority (jobs with multiple ranges were never enqueued with version 1)
+_JOB_LAYOUTS.update({
+    (_get_job_class_key(cls)[0], 1): _get_job_layout(cls, exclude=("priority",))
+    for cls in (FetchPersistJob, PersistedReviewJob)
+})
+_JOB_TYPES: Dict[str, Type[BaseJob]] = {job_type: cls for (job_type, _), (cls, _) in _JOB_LAYOUTS.items()}
+
+
+def encode_job(job: BaseJob, encoding: str = JobEncoding.MSGPACK) -> bytes:
+    """Encode a job for sending it through AMQP.
+    The msgpack encoding is an array of [job_type, job_version, job_id, *fields values], with the fields on the
+    class declaration order. UUID job_ids are encoded as their 16 raw bytes."""
+    if encoding == JobEncoding.JSON:
+        return job.json().encode("utf-8")
+    if encoding != JobEncoding.MSGPACK:
+        raise ValueError(f"Unknown job encoding {encoding}")
+
+    _, fields = _JOB_LAYOUTS[(job.job_type, job.job_version)]
+    job_id = job.job_id
+    try:
+        job_uuid = uuid.UUID(job_id)
+        if str(job_uuid) == job_id:
+            job_id = job_uuid.bytes
+    except ValueError:
+        pass
+
+    data = [job.job_type, job.job_version, job_id]
+    data.extend(getattr(job, field) for field in fields)
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def decode_job(
+        payload: bytes,
+        expected_class: Optional[Union[Type[BaseJob], Tuple[Type[BaseJob], ...]]] = None
+) -> BaseJob:
+    """Decode a job encoded with encode_job, in any of the available encodings (JSON payloads are also accepted,
+    for compatibility with jobs enqueued before the msgpack encoding).
+    If expected_class (or tuple of classes) is given, raise ValueError if the decoded job is of a different class.
+    msgpack-encoded jobs skip the full pydantic validation when all the values have the expected types."""
+    if payload[:1] == b"{":
+        data = json.loads(payload)
+        cls = _JOB_TYPES.get(data.get("job_type"))
+        if cls is None:
+            raise ValueError(f"Unknown job type {data.get('job_type')}")
+        job = cls(**data)
+
+    else:
+        data = msgpack.unpackb(payload, raw=False)
+        job_type, job_version, job_id, *values = data
+        layout = _JOB_LAYOUTS.get((job_type, job_version))
+        if layout is None:
+            raise ValueError(f"Unknown job type {job_type} version {job_version}")
+        cls, fields = layout
+        if len(values) != len(fields):
+            raise ValueError(f"Job {job_type} version {job_version} must have {len(fields)} fields, got {len(values)}")
+
+        if isinstance(job_id, bytes):
+            job_id = str(uuid.UUID(bytes=job_id))
+        kwargs = dict(zip(fields, values), job_type=job_type, job_version=job_version, job_id=job_id)
+        construct_kwargs = _get_job_construct_values(cls, kwargs)
+        if construct_kwargs is not None:
+            job = cls.construct(**construct_kwargs)
+        else:
+            job = cls(**kwargs)
+
+    if expected_class is not None and not isinstance(job, expected_class):
+        raise ValueError(f"Unexpected job of type {job.__class__.__name__}")
+    return job
+
+
+def _get_job_construct_values(cls: Type[BaseJob], values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Fast validation path: if all the values are exactly of the declared type of each field (simple types: str, int,
+    bool, float; or lists of int pairs, like the time ranges), return the values for constructing the job without
+    running the pydantic validation, with the int pairs as tuples. Return None if the job must be validated."""
+    construct_values = dict()
+    for field_name, value in values.items():
+        field_type = cls.__fields__[field_name].outer_type_
+        if field_name == "priority":
+            if value not in (JobPriority.HIGH, JobPriority.NORMAL, JobPriority.LOW):
+                return None
+        elif field_type == List[Tuple[int, int]]:
+            value = _get_int_pairs(value)
+            if value is None:
+                return None
+        elif field_type not in (str, int, bool, float) or type(value) is not field_type:
+            return None
+        construct_values[field_name] = value
+    return construct_values
+
+
+def _get_int_pairs(value: Any) -> Optional[List[Tuple[int, int]]]:
+    """Return the value as a list of int tuples, if it is a list of int pairs (decoded as lists by msgpack);
+    otherwise None"""
+    if type(value) is not list:
+        return None
+    pairs = list()
+    for item in value:
+        if type(item) not in (list, tuple) or len(item) != 2 or type(item[0]) is not int or type(item[1]) is not int:
+            return None
+        pairs.append((item[0], item[1]))
+    return pairs
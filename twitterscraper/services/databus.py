@@ -1,4 +1,5 @@
 import asyncio
+import collections
 from typing import *
 
 import aio_pika
@@ -9,14 +10,113 @@ from twitterscraper.utils import Singleton
 ConsumerCallback = Callable[[bytes], Awaitable[None]]
 
 
+class AMQPPublishError(Exception):
+    def __init__(self, unconfirmed_count: int, total_count: int, unconfirmed_indexes: Optional[List[int]] = None):
+        self.unconfirmed_count = unconfirmed_count
+        self.total_count = total_count
+        self.unconfirmed_indexes = unconfirmed_indexes or list()
+        """Indexes of the unconfirmed messages, on the given payloads"""
+
+    def __str__(self):
+        return f"{self.unconfirmed_count} of {self.total_count} messages were not confirmed by the AMQP broker"
+
+
+PARTITION_KEY_HEADER = "x-partition-key"
+
+
+class _ConsumerLane:
+    """Queue being consumed, with the messages received from it that are pending to dispatch.
+    Pending messages are grouped by their partition key (sub-queues), and picked round-robin between keys."""
+    def __init__(self, queue: aio_pika.Queue, weight: int):
+        self.queue = queue
+        self.weight = weight
+        self.current_weight = 0
+        self.buffers: "collections.OrderedDict[Optional[str], Deque[aio_pika.IncomingMessage]]" = \
+            collections.OrderedDict()
+        self.consumer_tag: Optional[str] = None
+
+    @property
+    def pending_count(self) -> int:
+        return sum(len(buffer) for buffer in self.buffers.values())
+
+    @staticmethod
+    def get_partition_key(message: aio_pika.IncomingMessage) -> Optional[str]:
+        key = (message.headers or {}).get(PARTITION_KEY_HEADER)
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        return key
+
+    def get_key_pending_count(self, key: Optional[str]) -> int:
+        buffer = self.buffers.get(key)
+        return len(buffer) if buffer else 0
+
+    def push(self, message: aio_pika.IncomingMessage):
+        self.buffers.setdefault(self.get_partition_key(message), collections.deque()).append(message)
+
+    def has_available(self, is_key_available: Callable[[Optional[str]], bool]) -> bool:
+        return any(is_key_available(key) for key in self.buffers)
+
+    def pop(
+            self,
+            is_key_available: Callable[[Optional[str]], bool]
+    ) -> Optional[Tuple[Optional[str], aio_pika.IncomingMessage]]:
+        """Pop the next message of the first available key, then move the key to the end (round-robin).
+        Return (key, message), or None if no key is available."""
+        for key, buffer in self.buffers.items():
+            if not is_key_available(key):
+                continue
+            message = buffer.popleft()
+            if buffer:
+                self.buffers.move_to_end(key)
+            else:
+                del self.buffers[key]
+            return key, message
+        return None
+
+    def pop_all(self) -> List[aio_pika.IncomingMessage]:
+        messages = [message for buffer in self.buffers.values() for message in buffer]
+        self.buffers.clear()
+        return messages
+
+
 class AMQPClient(Singleton):
     get: Callable[..., "AMQPClient"]
     _connection: aio_pika.Connection
     _channel: aio_pika.Channel
 
-    def __init__(self, uri: str):
+    def __init__(
+            self,
+            uri: str,
+            publish_batch_size: int = 500,
+            publish_max_unconfirmed: int = 100,
+            publish_retries: int = 3,
+            publish_timeout: Optional[float] = 30,
+            drain_timeout: Optional[float] = 60,
+            retry_max_attempts: int = 5,
+            retry_delay: float = 30,
+            retry_backoff: float = 4,
+            partition_defer_delay: float = 5
+    ):
         self._uri = uri
         self._exchanges = dict()
+        self._publish_batch_size = publish_batch_size
+        self._publish_max_unconfirmed = publish_max_unconfirmed
+        self._publish_retries = publish_retries
+        self._publish_timeout = publish_timeout
+        self._drain_timeout = drain_timeout
+        self._retry_max_attempts = retry_max_attempts
+        self._retry_delay = retry_delay
+        self._retry_backoff = retry_backoff
+        self._partition_defer_delay = partition_defer_delay
+        self._declared_queues: Dict[str, aio_pika.Queue] = dict()
+        self._inflight_tasks: Set[asyncio.Task] = set()
+        self._lanes: List[_ConsumerLane] = list()
+        self._inflight_keys: Counter[Optional[str]] = collections.Counter()
+        self._consuming = False
+        self._dispatch_event: Optional[asyncio.Event] = None
+        self._processed_count = 0
+        self._failed_count = 0
+        self._deferred_count = 0
         # noinspection PyTypeChecker
         self._connection, self._channel = None, None
 
@@ -25,7 +125,8 @@ class AMQPClient(Singleton):
         if loop is None:
             loop = asyncio.get_event_loop()
         self._connection = await aio_pika.robust_connection.connect_robust(self._uri, loop=loop)
-        self._channel = await self._connection.channel()
+        # publisher_confirms: each publish awaits the broker Ack, and a Nack raises DeliveryError
+        self._channel = await self._connection.channel(publisher_confirms=True)
         print("AMQP Connected")
 
     async def get_exchange(self, exchange_name: str) -> aio_pika.Exchange:
@@ -48,61 +149,386 @@ class AMQPClient(Singleton):
             exchange: str,
             routingkey: str,
             persistent: bool,
-            payloads: List[Union[bytes, str]]
+            payloads: List[Union[bytes, str]],
+            partition_keys: Optional[List[Optional[str]]] = None,
+            message_ids: Optional[List[Optional[str]]] = None,
+            message_types: Optional[List[Optional[str]]] = None
     ):
+        """Publish the given payloads, in chunks of `publish_batch_size` messages.
+        Each message is published with publisher confirms, keeping at most `publish_max_unconfirmed` messages
+        waiting for the broker confirmation at the same time. Messages not confirmed (Nack, timeout or error)
+        are published again, up to `publish_retries` times; if any message remains unconfirmed after that,
+        AMQPPublishError is raised.
+        partition_keys, if given, are set on each message for balancing their consumption (see consume()).
+        message_ids and message_types, if given, are set on the message_id and type properties of each message."""
         exchange = await self.get_exchange(exchange)
-        coroutines = list()
-
-        # TODO run in batches
-        # TODO wrap in AMQP transaction
-        for payload in payloads:
-            if isinstance(payload, str):
-                payload = payload.encode("utf-8")
-
-            message = aio_pika.Message(body=payload)
-            if persistent:
-                message.delivery_mode = aio_pika.DeliveryMode(aio_pika.DeliveryMode.PERSISTENT)
-
-            coroutines.append(exchange.publish(
-                message=message,
-                routing_key=routingkey
-            ))
-            print(f"AMQP TX exchange={exchange} routingkey={routingkey} payload={payload}")
-
-        await asyncio.gather(*coroutines)
-
-    async def consume(self, queue: str, callback: ConsumerCallback, workers: int, msg_limit: Optional[int] = None):
-        """Async blocking consume"""
-        print("Consuming", queue)
-        queue = await self._channel.get_queue(queue, ensure=True)
-        await self._channel.set_qos(prefetch_count=workers)
-        consumed_msgs = 0 if msg_limit is not None else None
-
-        async def _message_handler_task(message: aio_pika.IncomingMessage):
+        semaphore = asyncio.Semaphore(self._publish_max_unconfirmed)
+        empty = [None] * len(payloads)
+        messages = [
+            self._build_message(payload, persistent, partition_key, message_id, message_type)
+            for payload, partition_key, message_id, message_type
+            in zip(payloads, partition_keys or empty, message_ids or empty, message_types or empty)
+        ]
+        print(f"AMQP TX exchange={exchange} routingkey={routingkey} messages={len(messages)}")
+
+        messages_indexes = {id(message): index for index, message in enumerate(messages)}
+        unconfirmed_indexes = list()
+        for batch_start in range(0, len(messages), self._publish_batch_size):
+            batch = messages[batch_start:batch_start + self._publish_batch_size]
+            unconfirmed = await self._publish_batch_confirmed(
+                exchange=exchange,
+                routingkey=routingkey,
+                messages=batch,
+                semaphore=semaphore
+            )
+            unconfirmed_indexes.extend(messages_indexes[id(message)] for message in unconfirmed)
+
+        if unconfirmed_indexes:
+            raise AMQPPublishError(
+                unconfirmed_count=len(unconfirmed_indexes),
+                total_count=len(messages),
+                unconfirmed_indexes=unconfirmed_indexes
+            )
+        print(f"AMQP TX confirmed messages={len(messages)}")
+
+    async def _publish_batch_confirmed(
+            self,
+            exchange: aio_pika.Exchange,
+            routingkey: str,
+            messages: List[aio_pika.Message],
+            semaphore: asyncio.Semaphore
+    ) -> List[aio_pika.Message]:
+        """Publish a batch of messages, retrying the unconfirmed ones. Return the messages that could not be confirmed
+        after all the retries."""
+        async def _publish(message: aio_pika.Message) -> bool:
+            async with semaphore:
+                try:
+                    await exchange.publish(
+                        message=message,
+                        routing_key=routingkey,
+                        timeout=self._publish_timeout
+                    )
+                    return True
+                except (aio_pika.exceptions.DeliveryError, asyncio.TimeoutError) as ex:
+                    print("AMQP TX message not confirmed:", repr(ex))
+                    return False
+
+        pending = messages
+        for attempt in range(self._publish_retries + 1):
+            if attempt > 0:
+                print(f"AMQP TX retrying {len(pending)} unconfirmed messages "
+                      f"(attempt {attempt}/{self._publish_retries})")
+            confirmed = await asyncio.gather(*[_publish(message) for message in pending])
+            pending = [message for message, ok in zip(pending, confirmed) if not ok]
+            if not pending:
+                break
+
+        return pending
+
+    @staticmethod
+    def _build_message(
+            payload: Union[bytes, str],
+            persistent: bool,
+            partition_key: Optional[str] = None,
+            message_id: Optional[str] = None,
+            message_type: Optional[str] = None
+    ) -> aio_pika.Message:
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+
+        headers = {PARTITION_KEY_HEADER: partition_key} if partition_key is not None else None
+        message = aio_pika.Message(body=payload, headers=headers, message_id=message_id, type=message_type)
+        if persistent:
+            message.delivery_mode = aio_pika.DeliveryMode(aio_pika.DeliveryMode.PERSISTENT)
+        return message
+
+    async def declare_queue(self, queue: str) -> aio_pika.Queue:
+        """Declare a durable queue, if not declared before by this client."""
+        declared_queue = self._declared_queues.get(queue)
+        if declared_queue is None:
+            declared_queue = self._declared_queues[queue] = await self._channel.declare_queue(queue, durable=True)
+        return declared_queue
+
+    async def consume(
+            self,
+            queues: Union[str, Dict[str, int]],
+            callback: ConsumerCallback,
+            workers: int,
+            msg_limit: Optional[int] = None,
+            max_per_partition_key: Optional[int] = None,
+            prefetch_count: Optional[int] = None
+    ):
+        """Async blocking consume.
+        queues can be a single queue name, or a dict of {queue name: weight} (lanes). Messages received from all the
+        queues are dispatched to up to `workers` concurrent callbacks. When messages from multiple queues are pending,
+        they are dispatched proportionally to the weight of each queue (smooth weighted round-robin).
+        Within each queue, pending messages are dispatched round-robin between their partition keys, with up to
+        `max_per_partition_key` in-flight messages per key (if given; messages without key are not limited).
+        Messages received for a key that already has `max_per_partition_key` messages pending are deferred (see
+        defer_message()), so they do not fill the prefetch while messages of other keys wait behind them on the queue.
+        prefetch_count (by default, `workers`) should be greater than `workers` when limiting by partition key,
+        so messages from other keys can be received while a key is at its limit. It is shared by all the queues
+        (channel-global QoS), instead of applying to each queue consumer.
+        Consume until stop_consuming() is called, or `msg_limit` messages are dispatched. Then stop receiving
+        messages and wait for the in-flight messages to complete (drain), up to `drain_timeout` seconds."""
+        if isinstance(queues, str):
+            queues = {queues: 1}
+        print("Consuming", queues)
+        # global QoS: the prefetch is shared by the consumers of all the lanes, so the messages received but not
+        # dispatched yet do not grow with the amount of lanes
+        await self._channel.set_qos(prefetch_count=prefetch_count or workers, global_=True)
+
+        lanes = list()
+        for queue_name, weight in queues.items():
+            queue = await self.declare_queue(queue_name)
+            await self.declare_retry_queues(queue_name)
+            if max_per_partition_key is not None:
+                await self.declare_deferred_queue(queue_name)
+            lanes.append(_ConsumerLane(queue=queue, weight=weight))
+
+        async def _message_handler_task(lane: _ConsumerLane, key: Optional[str], message: aio_pika.IncomingMessage):
             try:
-                print("AMQP RX", message.body)
+                print(f"AMQP RX queue={lane.queue.name} message_id={message.message_id} type={message.type} "
+                      f"bytes={len(message.body)}")
                 await callback(message.body)
             except Exception as ex:
                 print("AMQP RX Callback exception:", ex)
-                message.nack()
+                self._failed_count += 1
+                await self._retry_message(lane.queue.name, message, ex)
                 raise ex
             else:
+                self._processed_count += 1
                 message.ack()
+            finally:
+                self._inflight_keys[key] -= 1
+                if self._inflight_keys[key] <= 0:
+                    del self._inflight_keys[key]
+
+        def _is_key_available(key: Optional[str]) -> bool:
+            return key is None or max_per_partition_key is None or self._inflight_keys[key] < max_per_partition_key
+
+        def _on_message(lane: _ConsumerLane):
+            async def _on_lane_message(message: aio_pika.IncomingMessage):
+                key = lane.get_partition_key(message)
+                if key is not None and max_per_partition_key is not None and \
+                        lane.get_key_pending_count(key) >= max_per_partition_key and \
+                        await self.defer_message(lane.queue.name, message):
+                    return
+                lane.push(message)
+                self._dispatch_event.set()
+            return _on_lane_message
+
+        self._lanes = lanes
+        self._consuming = True
+        self._dispatch_event = asyncio.Event()
+        dispatched_msgs = 0
+        for lane in lanes:
+            lane.consumer_tag = await lane.queue.consume(_on_message(lane))
+
+        try:
+            while self._consuming and (msg_limit is None or dispatched_msgs < msg_limit):
+                if len(self._inflight_tasks) < workers:
+                    picked = self._pick_message(lanes, _is_key_available)
+                    if picked is not None:
+                        self._inflight_keys[picked[1]] += 1
+                        task = asyncio.create_task(_message_handler_task(*picked))
+                        self._inflight_tasks.add(task)
+                        task.add_done_callback(self._on_inflight_task_done)
+                        dispatched_msgs += 1
+                        continue
+
+                # wait until a message is received, a worker slot is released, or the consumer is stopped
+                self._dispatch_event.clear()
+                await self._dispatch_event.wait()
+
+        finally:
+            print("Stop consuming", queues)
+            # when stopped by reaching msg_limit, wait for the dispatched messages without timeout
+            drain_timeout = self._drain_timeout if not self._consuming else None
+            self._consuming = False
+            for lane in lanes:
+                await lane.queue.cancel(lane.consumer_tag)
+                # requeue the messages received but not dispatched
+                for message in lane.pop_all():
+                    message.nack(requeue=True)
+            await self.drain(timeout=drain_timeout)
+            self._lanes = list()
+
+    @staticmethod
+    def _pick_message(
+            lanes: List[_ConsumerLane],
+            is_key_available: Callable[[Optional[str]], bool]
+    ) -> Optional[Tuple[_ConsumerLane, Optional[str], aio_pika.IncomingMessage]]:
+        """Pick the next message to dispatch from the lanes with pending messages of available partition keys,
+        using smooth weighted round-robin between lanes. Return (lane, key, message), or None if no messages can be
+        dispatched."""
+        candidates = [lane for lane in lanes if lane.has_available(is_key_available)]
+        if not candidates:
+            return None
+
+        total_weight = sum(lane.weight for lane in candidates)
+        for lane in candidates:
+            lane.current_weight += lane.weight
+        picked_lane = max(candidates, key=lambda _lane: _lane.current_weight)
+        picked_lane.current_weight -= total_weight
+        return (picked_lane, *picked_lane.pop(is_key_available))
+
+    def get_retry_queue_name(self, queue: str, attempt: int) -> str:
+        return f"{queue}.retry.{attempt}"
+
+    def get_deadletter_queue_name(self, queue: str) -> str:
+        return f"{queue}.dead"
+
+    def get_retry_delay(self, attempt: int) -> float:
+        """Seconds that a message failed `attempt` times waits before being delivered again (exponential backoff)."""
+        return self._retry_delay * (self._retry_backoff ** (attempt - 1))
+
+    async def declare_retry_queues(self, queue: str):
+        """Declare the delayed retry queues and the dead-letter queue for the given queue.
+        Each retry queue holds the failed messages for a fixed TTL (growing with the attempt number), then
+        dead-letters them back to the original queue, through the default exchange."""
+        for attempt in range(1, self._retry_max_attempts):
+            await self._channel.declare_queue(
+                self.get_retry_queue_name(queue, attempt),
+                durable=True,
+                arguments={
+                    "x-message-ttl": int(self.get_retry_delay(attempt) * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": queue,
+                }
+            )
+        await self._channel.declare_queue(self.get_deadletter_queue_name(queue), durable=True)
+
+    def get_deferred_queue_name(self, queue: str) -> str:
+        return f"{queue}.deferred"
+
+    async def declare_deferred_queue(self, queue: str):
+        """Declare the deferred queue for the given queue, which holds the deferred messages for
+        `partition_defer_delay` seconds, then dead-letters them back to the tail of the original queue."""
+        await self._channel.declare_queue(
+            self.get_deferred_queue_name(queue),
+            durable=True,
+            arguments={
+                "x-message-ttl": int(self._partition_defer_delay * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue,
+            }
+        )
+
+    async def defer_message(self, queue: str, message: aio_pika.IncomingMessage) -> bool:
+        """Publish a received message on the deferred queue of its queue, and ack the original message, so it is
+        delivered again after `partition_defer_delay` seconds, behind the messages currently on the queue.
+        Return False if the message could not be published (then it must be kept by the consumer)."""
+        try:
+            await self._channel.default_exchange.publish(
+                message=self._copy_message(message, dict(message.headers or {})),
+                routing_key=self.get_deferred_queue_name(queue),
+                timeout=self._publish_timeout
+            )
+        except Exception as ex:
+            print("AMQP RX could not defer message:", ex)
+            return False
+        message.ack()
+        self._deferred_count += 1
+        return True
+
+    @staticmethod
+    def _copy_message(message: aio_pika.IncomingMessage, headers: dict) -> aio_pika.Message:
+        return aio_pika.Message(
+            body=message.body,
+            headers=headers,
+            content_type=message.content_type,
+            message_id=message.message_id,
+            type=message.type,
+            delivery_mode=message.delivery_mode,
+            priority=message.priority,
+        )
+
+    async def _retry_message(self, queue: str, message: aio_pika.IncomingMessage, ex: Exception):
+        """Handle a message which callback failed. The message is published on the retry queue corresponding to its
+        attempts count (tracked on the "x-attempts" header); if the attempts limit is reached, it is published on the
+        dead-letter queue. The original message is acked after that. If the publish fails, the message is requeued."""
+        headers = dict(message.headers or {})
+        attempt = int(headers.get("x-attempts", 0)) + 1
+        headers["x-attempts"] = attempt
+        headers["x-last-error"] = repr(ex)[:1000]
+
+        if attempt >= self._retry_max_attempts:
+            routingkey = self.get_deadletter_queue_name(queue)
+            print(f"AMQP RX message failed {attempt} times, sending to dead-letter queue {routingkey}")
+        else:
+            routingkey = self.get_retry_queue_name(queue, attempt)
+            print(f"AMQP RX message failed {attempt} times, retrying in {self.get_retry_delay(attempt)}s")
+
+        try:
+            await self._channel.default_exchange.publish(
+                message=self._copy_message(message, headers),
+                routing_key=routingkey,
+                timeout=self._publish_timeout
+            )
+        except Exception as publish_ex:
+            print("AMQP RX could not publish failed message for retrying, requeueing:", publish_ex)
+            message.nack()
+        else:
+            message.ack()
+
+    def stop_consuming(self):
+        """Stop the current consume() execution. No more messages will be received, and the in-flight
+        messages will be drained before consume() returns."""
+        self._consuming = False
+        if self._dispatch_event is not None:
+            self._dispatch_event.set()
+
+    async def drain(self, timeout: Optional[float] = ...):
+        """Wait for the in-flight messages to complete, up to `timeout` seconds (by default, `drain_timeout`).
+        The messages still running after the timeout are cancelled, so they are redelivered by the broker."""
+        if not self._inflight_tasks:
+            return
+        if timeout is ...:
+            timeout = self._drain_timeout
+
+        print(f"AMQP Draining {len(self._inflight_tasks)} in-flight messages (timeout={timeout}s)...")
+        _, pending = await asyncio.wait(set(self._inflight_tasks), timeout=timeout)
+        if pending:
+            print(f"AMQP Drain timeout; cancelling {len(pending)} in-flight messages")
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+        print("AMQP Drained")
+
+    def _on_inflight_task_done(self, task: asyncio.Task):
+        self._inflight_tasks.discard(task)
+        if self._dispatch_event is not None:
+            self._dispatch_event.set()
+        if not task.cancelled():
+            # exceptions are already logged by the message handler; retrieve them to avoid asyncio warnings
+            task.exception()
+
+    @property
+    def inflight_count(self) -> int:
+        """Amount of messages currently being processed"""
+        return len(self._inflight_tasks)
+
+    @property
+    def queued_count(self) -> int:
+        """Amount of messages delivered to this consumer, waiting for a worker slot"""
+        return sum(lane.pending_count for lane in self._lanes)
 
-        async with queue.iterator() as queue_iter:
-            async for _message in queue_iter:
-                if msg_limit is None:
-                    # Worker execution mode
-                    asyncio.create_task(_message_handler_task(_message))
-                else:
-                    # Run-once execution mode
-                    await _message_handler_task(_message)
-                    consumed_msgs += 1
-                    if consumed_msgs >= msg_limit:
-                        break
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            processed=self._processed_count,
+            failed=self._failed_count,
+            deferred=self._deferred_count,
+            inflight=self.inflight_count,
+            inflight_partition_keys=len(self._inflight_keys),
+            queued=self.queued_count,
+            **{f"queued_{lane.queue.name}": lane.pending_count for lane in self._lanes}
+        )
 
     async def close(self):
         print("AMQP Closing...")
+        self.stop_consuming()
+        await self.drain()
         if self._channel:
             await self._channel.close()
         if self._connection:
@@ -0,0 +1,102 @@
+import time
+import array
+import bisect
+import asyncio
+import collections
+from typing import *
+
+from twitterscraper.utils import Singleton
+
+__all__ = ("KnownTweetsFilter",)
+
+
+class _ProfileKnownTweets:
+    """Ids of the tweets known to be persisted for a profile: a sorted array loaded from the database,
+    plus the tweets persisted (or found existing) since"""
+
+    def __init__(self):
+        self.loaded_ids = array.array("q")
+        self.added_ids: Set[int] = set()
+        self.loaded_timestamp: Optional[float] = None
+        self.lock = asyncio.Lock()
+
+    def load(self, tweets_ids: Iterable[str], timestamp: float):
+        self.loaded_ids = array.array("q", sorted(int(tweet_id) for tweet_id in tweets_ids if tweet_id.isdigit()))
+        self.added_ids = set()
+        self.loaded_timestamp = timestamp
+
+    def contains(self, tweet_id: int) -> bool:
+        if tweet_id in self.added_ids:
+            return True
+        index = bisect.bisect_left(self.loaded_ids, tweet_id)
+        return index < len(self.loaded_ids) and self.loaded_ids[index] == tweet_id
+
+    def __len__(self):
+        return len(self.loaded_ids) + len(self.added_ids)
+
+
+class KnownTweetsFilter(Singleton):
+    """Per-worker in-memory filter of the tweets already persisted for each profile, so FetchAndPersist can skip
+    them before any database round trip. The ids of a profile are loaded (with the loader) on its first lookup,
+    and reloaded after ttl seconds, to include the tweets persisted by other workers; the filter is exact, so a tweet
+    not found on it is just tried to be persisted. Only the max_profiles most recently used profiles are kept."""
+
+    def __init__(
+            self,
+            loader: Callable[[int], Awaitable[Iterable[str]]],
+            max_profiles: int = 100,
+            ttl: int = 3600,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self._loader = loader
+        self._max_profiles = max_profiles
+        self._ttl = ttl
+        self._clock = clock
+        self._profiles: "collections.OrderedDict[int, _ProfileKnownTweets]" = collections.OrderedDict()
+        self._lookups_count = 0
+        self._hits_count = 0
+        self._loads_count = 0
+
+    async def _get_profile(self, profile_id: int) -> _ProfileKnownTweets:
+        profile = self._profiles.get(profile_id)
+        if profile is None:
+            profile = self._profiles[profile_id] = _ProfileKnownTweets()
+            while len(self._profiles) > self._max_profiles:
+                self._profiles.popitem(last=False)
+        self._profiles.move_to_end(profile_id)
+
+        async with profile.lock:
+            now = self._clock()
+            if profile.loaded_timestamp is None or now - profile.loaded_timestamp >= self._ttl:
+                profile.load(await self._loader(profile_id), now)
+                self._loads_count += 1
+        return profile
+
+    async def filter_unknown(self, profile_id: int, tweets_ids: Iterable[str]) -> Set[str]:
+        """Return the given tweets ids that are not known to be persisted for the profile"""
+        profile = await self._get_profile(profile_id)
+        unknown_ids = set()
+        for tweet_id in tweets_ids:
+            self._lookups_count += 1
+            if tweet_id.isdigit() and profile.contains(int(tweet_id)):
+                self._hits_count += 1
+            else:
+                unknown_ids.add(tweet_id)
+        return unknown_ids
+
+    def add(self, profile_id: int, tweets_ids: Iterable[str]):
+        """Register tweets as persisted for the profile (if the profile is currently loaded)"""
+        profile = self._profiles.get(profile_id)
+        if profile is None:
+            return
+        profile.added_ids.update(int(tweet_id) for tweet_id in tweets_ids if tweet_id.isdigit())
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            lookups=self._lookups_count,
+            hits=self._hits_count,
+            hit_rate=round(self._hits_count / self._lookups_count, 3) if self._lookups_count else None,
+            loads=self._loads_count,
+            profiles=len(self._profiles),
+            tweets=sum(len(profile) for profile in self._profiles.values())
+        )
@@ -7,11 +7,14 @@ from typing import *
 
 import wait4it
 import sqlmodel
+import sqlalchemy
 from sqlmodel import Session
 from aioify import aioify
 
-from twitterscraper.models.domain import TwitterProfile, TwitterTweet, JobHistoric
-from twitterscraper.utils import Singleton
+from twitterscraper.models.domain import (
+    TwitterProfile, TwitterTweet, JobHistoric, JobHistoricKey, ProfileCoverage, TweetsRangeFingerprint
+)
+from twitterscraper.utils import Singleton, merge_timestamp_ranges
 
 
 class Repository(Singleton):
@@ -90,6 +93,19 @@ class Repository(Singleton):
             await aioify(session.close)()
             self._clear_context_session()
 
+    @contextlib.asynccontextmanager
+    async def savepoint_async(self) -> Session:
+        """Contextmanager that wraps code behind a savepoint (nested transaction) of the current session.
+        Any error during the execution rolls back only the data saved within the savepoint."""
+        async with self.session_async() as session:
+            savepoint = await aioify(session.begin_nested)()
+            try:
+                yield session
+                await aioify(savepoint.commit)()
+            except Exception as ex:
+                await aioify(savepoint.rollback)()
+                raise ex
+
     def save_object(self, obj: sqlmodel.SQLModel, flush: bool = False):
         """Save or update any SQLModel object instance"""
         with self.session() as session:
@@ -201,11 +217,232 @@ class Repository(Singleton):
             tweets.extend(tweets_batch)
         return tweets
 
+    async def get_profile_tweets_ids(self, profile_id: int) -> List[str]:
+        """Get the ids of all the persisted tweets of a profile (including deleted tweets), without loading
+        the tweets"""
+        async with self.session_async() as session:
+            query = sqlmodel.select(TwitterTweet.tweet_id).where(TwitterTweet.profile_id == profile_id)
+            result = await aioify(session.exec)(query)
+            return await aioify(result.all)()
+
+    # noinspection PyComparisonWithNone
+    async def get_active_tweets_ids(self, profile_id: int, from_timestamp: int, to_timestamp: int) -> List[str]:
+        """Get the ids of the active tweets of a profile in a time range, without loading the tweets"""
+        async with self.session_async() as session:
+            query = sqlmodel.select(TwitterTweet.tweet_id). \
+                where(TwitterTweet.profile_id == profile_id). \
+                where(TwitterTweet.timestamp >= from_timestamp). \
+                where(TwitterTweet.timestamp < to_timestamp). \
+                where(TwitterTweet.deletion_detected_timestamp == None)
+            result = await aioify(session.exec)(query)
+            return await aioify(result.all)()
+
+    # noinspection PyComparisonWithNone
+    async def get_tweets_ids_page(
+            self,
+            profile_id: int,
+            from_timestamp: int,
+            to_timestamp: int,
+            limit: int,
+            before_tweet_id: Optional[str] = None
+    ) -> List[str]:
+        """Get the ids of the active tweets of a profile in a time range, sorted by id descending, up to limit.
+        Ids are sorted by (length, id), equivalent to their numeric order, without casting them.
+        Following pages are requested giving the last id received as before_tweet_id (keyset pagination)."""
+        async with self.session_async() as session:
+            id_length = sqlalchemy.func.length(TwitterTweet.tweet_id)
+            query = sqlmodel.select(TwitterTweet.tweet_id). \
+                where(TwitterTweet.profile_id == profile_id). \
+                where(TwitterTweet.timestamp >= from_timestamp). \
+                where(TwitterTweet.timestamp < to_timestamp). \
+                where(TwitterTweet.deletion_detected_timestamp == None)
+            if before_tweet_id is not None:
+                query = query.where(
+                    sqlalchemy.tuple_(id_length, TwitterTweet.tweet_id) < (len(before_tweet_id), before_tweet_id)
+                )
+            query = query.order_by(id_length.desc(), TwitterTweet.tweet_id.desc()).limit(limit)
+            result = await aioify(session.exec)(query)
+            return await aioify(result.all)()
+
+    # noinspection PyComparisonWithNone
+    async def get_profile_days_last_review(self, userid: str) -> Dict[int, int]:
+        """Get the days when the given profile has active tweets, with the last time each day was reviewed.
+        Return {timestamp of the day start (UTC): oldest last_review_timestamp of the tweets of the day}.
+        Days with tweets never reviewed have last review 0."""
+        day_seconds = 86400
+        async with self.session_async() as session:
+            day_column = TwitterTweet.timestamp - (TwitterTweet.timestamp % day_seconds)
+            query = sqlmodel.select(
+                day_column,
+                sqlalchemy.func.min(sqlalchemy.func.coalesce(TwitterTweet.last_review_timestamp, 0))
+            ).join(TwitterProfile).where(TwitterProfile.userid == userid). \
+                where(TwitterTweet.deletion_detected_timestamp == None). \
+                group_by(day_column)
+            result = await aioify(session.exec)(query)
+            return {day_ts: last_review_ts for day_ts, last_review_ts in await aioify(result.all)()}
+
     async def get_job_historic(self, job_id: str) -> Optional[JobHistoric]:
         async with self.session_async() as session:
             query = sqlmodel.select(JobHistoric).where(JobHistoric.job_id == job_id)
             return session.exec(query).one_or_none()
 
+    # noinspection PyComparisonWithNone,PyUnresolvedReferences
+    async def get_jobs_keys_duplicated(
+            self,
+            idempotency_keys: Iterable[str],
+            pending_created_after: int,
+            finalized_after: int,
+            batch_size: int = 500
+    ) -> Set[str]:
+        """Get which of the given idempotency keys belong to a job that is pending and created after
+        `pending_created_after`, or finalized after `finalized_after`. Queried by the indexed idempotency_key."""
+        idempotency_keys = list(idempotency_keys)
+        duplicated_keys = set()
+        async with self.session_async() as session:
+            for batch_start in range(0, len(idempotency_keys), batch_size):
+                batch_keys = idempotency_keys[batch_start:batch_start + batch_size]
+                query = sqlmodel.select(JobHistoricKey.idempotency_key). \
+                    where(JobHistoricKey.idempotency_key.in_(batch_keys)). \
+                    where(sqlmodel.or_(
+                        sqlmodel.and_(
+                            JobHistoricKey.pending == True,
+                            JobHistoricKey.timestamp_created >= pending_created_after
+                        ),
+                        JobHistoricKey.timestamp_finalized >= finalized_after
+                    ))
+                result = await aioify(session.exec)(query)
+                duplicated_keys.update(await aioify(result.all)())
+        return duplicated_keys
+
+    # noinspection PyComparisonWithNone,PyUnresolvedReferences
+    async def release_jobs_keys(self, idempotency_keys: Collection[str], created_before: int):
+        """Set as not pending the given idempotency keys of jobs created before `created_before` (considered lost),
+        so they can be taken by new jobs. Not commited."""
+        if not idempotency_keys:
+            return
+        async with self.session_async() as session:
+            query = sqlalchemy.update(JobHistoricKey). \
+                where(JobHistoricKey.idempotency_key.in_(list(idempotency_keys))). \
+                where(JobHistoricKey.pending == True). \
+                where(JobHistoricKey.timestamp_created < created_before). \
+                values(pending=False). \
+                execution_options(synchronize_session=False)
+            await aioify(session.exec)(query)
+
+    async def release_jobs_keys_of_jobs(self, job_ids: Collection[str]):
+        """Set as not pending the idempotency keys of the given jobs (e.g. not enqueued), so they can be taken by
+        new jobs. Not commited."""
+        if not job_ids:
+            return
+        async with self.session_async() as session:
+            query = sqlalchemy.update(JobHistoricKey). \
+                where(JobHistoricKey.job_id.in_(list(job_ids))). \
+                values(pending=False). \
+                execution_options(synchronize_session=False)
+            await aioify(session.exec)(query)
+
+    async def set_job_keys_finalized(self, job_id: str, timestamp: int):
+        """Set the idempotency keys of a job as finalized (not pending). Not commited."""
+        async with self.session_async() as session:
+            query = sqlalchemy.update(JobHistoricKey). \
+                where(JobHistoricKey.job_id == job_id). \
+                values(pending=False, timestamp_finalized=timestamp). \
+                execution_options(synchronize_session=False)
+            await aioify(session.exec)(query)
+
+    async def get_profile_coverage(
+            self,
+            profile_id: int,
+            kind: str,
+            from_timestamp: Optional[int] = None,
+            to_timestamp: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """Get the merged ranges (from_ts, to_ts) covered by scans of the given kind on a profile,
+        optionally only those overlapping from_timestamp~to_timestamp."""
+        async with self.session_async() as session:
+            query = sqlmodel.select(ProfileCoverage.from_timestamp, ProfileCoverage.to_timestamp). \
+                where(ProfileCoverage.profile_id == profile_id). \
+                where(ProfileCoverage.kind == kind)
+            if to_timestamp is not None:
+                query = query.where(ProfileCoverage.from_timestamp < to_timestamp)
+            if from_timestamp is not None:
+                query = query.where(ProfileCoverage.to_timestamp > from_timestamp)
+            result = await aioify(session.exec)(query)
+            return merge_timestamp_ranges(await aioify(result.all)())
+
+    async def add_profile_coverage(self, profile_id: int, kind: str, from_timestamp: int, to_timestamp: int):
+        """Persist a range covered by a scan of the given kind on a profile, merging it with the existing ranges
+        that overlap or are contiguous, so the profile keeps one row per covered interval. Not commited."""
+        async with self.session_async() as session:
+            query = sqlmodel.select(ProfileCoverage). \
+                where(ProfileCoverage.profile_id == profile_id). \
+                where(ProfileCoverage.kind == kind). \
+                where(ProfileCoverage.from_timestamp <= to_timestamp). \
+                where(ProfileCoverage.to_timestamp >= from_timestamp)
+            result = await aioify(session.exec)(query)
+            existing_coverages = await aioify(result.all)()
+
+            for coverage in existing_coverages:
+                from_timestamp = min(from_timestamp, coverage.from_timestamp)
+                to_timestamp = max(to_timestamp, coverage.to_timestamp)
+                await self.delete_object_async(coverage)
+
+            await self.save_object_async(ProfileCoverage(
+                profile_id=profile_id,
+                kind=kind,
+                from_timestamp=from_timestamp,
+                to_timestamp=to_timestamp
+            ))
+
+    async def get_tweets_range_fingerprint(
+            self,
+            profile_id: int,
+            from_timestamp: int,
+            to_timestamp: int
+    ) -> Optional[TweetsRangeFingerprint]:
+        async with self.session_async() as session:
+            query = sqlmodel.select(TweetsRangeFingerprint). \
+                where(TweetsRangeFingerprint.profile_id == profile_id). \
+                where(TweetsRangeFingerprint.from_timestamp == from_timestamp). \
+                where(TweetsRangeFingerprint.to_timestamp == to_timestamp)
+            result = await aioify(session.exec)(query)
+            return await aioify(result.one_or_none)()
+
+    # noinspection PyComparisonWithNone
+    async def set_tweets_reviewed(self, profile_id: int, from_timestamp: int, to_timestamp: int, timestamp: int):
+        """Set the last review timestamp of the active tweets of a profile in a time range, on a single UPDATE.
+        Not commited."""
+        async with self.session_async() as session:
+            query = sqlalchemy.update(TwitterTweet). \
+                where(TwitterTweet.profile_id == profile_id). \
+                where(TwitterTweet.timestamp >= from_timestamp). \
+                where(TwitterTweet.timestamp < to_timestamp). \
+                where(TwitterTweet.deletion_detected_timestamp == None). \
+                values(last_review_timestamp=timestamp). \
+                execution_options(synchronize_session=False)
+            await aioify(session.exec)(query)
+
+    async def set_tweets_timestamps(
+            self,
+            tweets_ids: Collection[str],
+            last_review_timestamp: int,
+            deletion_detected_timestamp: Optional[int] = None
+    ):
+        """Set the last review timestamp (and deletion detected timestamp, if given) of the given tweets,
+        on a single UPDATE. Not commited."""
+        if not tweets_ids:
+            return
+        values = dict(last_review_timestamp=last_review_timestamp)
+        if deletion_detected_timestamp is not None:
+            values["deletion_detected_timestamp"] = deletion_detected_timestamp
+        async with self.session_async() as session:
+            # noinspection PyUnresolvedReferences
+            query = sqlalchemy.update(TwitterTweet). \
+                where(TwitterTweet.tweet_id.in_(list(tweets_ids))). \
+                values(**values). \
+                execution_options(synchronize_session=False)
+            await aioify(session.exec)(query)
+
     # TODO remove "with self.session..." from everything, since we're returning ORM models, it's always needed on the outside
 
     async def close(self):
@@ -0,0 +1,136 @@
+import time
+import asyncio
+import contextlib
+from typing import *
+
+__all__ = ("RateLimitScheduler",)
+
+
+class _EndpointRateLimit:
+    """Rate limit state of a single endpoint, as reported by the last response headers"""
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        """Requests remaining on the current window, discounting the requests in flight. None if unknown"""
+        self.reset_timestamp: Optional[float] = None
+        self.next_request_timestamp: float = 0
+        self.inflight = 0
+        self.waiting = 0
+        self.throttled_count = 0
+        self.lock = asyncio.Lock()
+
+
+class RateLimitScheduler:
+    """Schedule requests to a rate-limited API, per endpoint, according to the x-rate-limit-* headers returned by it.
+    Requests are queued (FIFO, per endpoint) while no quota remains, until the window resets.
+    While the remaining quota is below pacing_ratio of the limit, requests are spaced evenly until the window resets,
+    so bursts of concurrent requests do not consume the whole quota at once."""
+
+    def __init__(
+            self,
+            pacing_ratio: float = 0.5,
+            safety_margin: int = 1,
+            default_reset_seconds: int = 60,
+            clock: Callable[[], float] = time.time
+    ):
+        self._pacing_ratio = pacing_ratio
+        self._safety_margin = safety_margin
+        self._default_reset_seconds = default_reset_seconds
+        self._clock = clock
+        self._endpoints: Dict[str, _EndpointRateLimit] = dict()
+
+    def _get_endpoint(self, endpoint: str) -> _EndpointRateLimit:
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = _EndpointRateLimit()
+        return self._endpoints[endpoint]
+
+    def get_delay(self, endpoint: str) -> float:
+        """Seconds to wait before a new request to the endpoint can be sent (0 if it can be sent now)"""
+        state = self._get_endpoint(endpoint)
+        now = self._clock()
+        if state.reset_timestamp is not None and now >= state.reset_timestamp:
+            # window reset: quota unknown until the next response
+            state.remaining = None
+            state.reset_timestamp = None
+        if state.remaining is None:
+            return 0
+
+        if state.remaining <= self._safety_margin:
+            if state.reset_timestamp is None:
+                return self._default_reset_seconds
+            return state.reset_timestamp - now
+
+        if state.limit and state.reset_timestamp is not None and state.remaining < state.limit * self._pacing_ratio:
+            interval = (state.reset_timestamp - now) / state.remaining
+            return max(0.0, state.next_request_timestamp + interval - now)
+        return 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, endpoint: str):
+        """Wait until a request to the endpoint can be sent, and reserve its quota while the request runs.
+        The response headers must be given to update() before leaving the context."""
+        state = self._get_endpoint(endpoint)
+        state.waiting += 1
+        try:
+            async with state.lock:
+                delay = self.get_delay(endpoint)
+                while delay > 0:
+                    state.throttled_count += 1
+                    await asyncio.sleep(delay)
+                    delay = self.get_delay(endpoint)
+                state.next_request_timestamp = self._clock()
+                state.inflight += 1
+                if state.remaining is not None:
+                    state.remaining -= 1
+        finally:
+            state.waiting -= 1
+
+        try:
+            yield
+        finally:
+            state.inflight -= 1
+
+    def update(self, endpoint: str, headers: Mapping[str, str], status_code: Optional[int] = None):
+        """Update the rate limit state of the endpoint with the headers of a response (received within acquire)"""
+        state = self._get_endpoint(endpoint)
+        limit = _parse_int_header(headers, "x-rate-limit-limit")
+        remaining = _parse_int_header(headers, "x-rate-limit-remaining")
+        reset_timestamp = _parse_int_header(headers, "x-rate-limit-reset")
+
+        if limit is not None:
+            state.limit = limit
+        if reset_timestamp is not None:
+            state.reset_timestamp = reset_timestamp
+        if remaining is not None:
+            # the other requests in flight were not counted by the server yet
+            state.remaining = max(0, remaining - (state.inflight - 1))
+
+        if status_code == 429:
+            state.remaining = 0
+            if reset_timestamp is None:
+                state.reset_timestamp = self._clock() + self._default_reset_seconds
+
+    def stats(self) -> Dict[str, Dict[str, Optional[int]]]:
+        """Current quota of each endpoint used"""
+        return {
+            endpoint: dict(
+                limit=state.limit,
+                remaining=state.remaining,
+                reset=int(state.reset_timestamp) if state.reset_timestamp is not None else None,
+                inflight=state.inflight,
+                waiting=state.waiting,
+                throttled=state.throttled_count
+            )
+            for endpoint, state in self._endpoints.items()
+        }
+
+
+def _parse_int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
@@ -1,18 +1,24 @@
+import time
 import datetime
 import asyncio
 import random
-from urllib.parse import urljoin
+import email.utils
+import xml.etree.ElementTree
+from urllib.parse import urljoin, urlparse
 from typing import *
 
+import httpx
 import requests
 import tweepy
 from aioify import aioify
 from parse import parse
 from bs4 import BeautifulSoup
 
-from twitterscraper.models.domain import TwitterProfile, TwitterTweet, TweetScanStatus
+from twitterscraper.services.ratelimit import RateLimitScheduler
+from twitterscraper.models.domain import TwitterProfile, ScrapedTweet, TweetScanStatus, TwitterUsersLookup
 from twitterscraper.utils import (
-    Singleton, datetime_to_timestamp, timestamp_to_datetime, datetime_to_twitter_isoformat, timestamp_in_range
+    Singleton, datetime_to_timestamp, timestamp_to_datetime, datetime_to_twitter_isoformat, timestamp_in_range,
+    chunked, get_timestamp
 )
 
 
@@ -30,35 +36,139 @@ class TwitterProfileNotFoundError(Exception):
         return f"The profile {identifier} does not exists".replace("  ", " ")
 
 
+class TwitterAPIError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+
+    def __str__(self):
+        return f"Twitter API request failed with status {self.status_code}: {self.detail}"
+
+
 class TwitterAPIClient(Singleton):
     get: Callable[..., "TwitterAPIClient"]
     _twitter: tweepy.Client
     _twitterapi_minimum_datetime = datetime.datetime.fromisoformat("2010-11-06T00:00:01+00:00")
     """Twitter API does not allow fetching tweets before this datetime"""
 
-    def __init__(self, api_key: str, api_secret: str, api_token: str):
+    _users_notfound_error_types = {
+        "https://api.twitter.com/2/problems/resource-not-found",
+        "https://api.twitter.com/2/problems/not-authorized-for-resource",
+    }
+    """Types of the per-user errors returned by the users lookup that mean the profile is not available"""
+    _tweets_notfound_error_types = {
+        "https://api.twitter.com/2/problems/resource-not-found",
+    }
+    """Types of the per-tweet errors returned by the tweets lookup that mean the tweet does not exist
+    (tweets not authorized, e.g. from protected or suspended profiles, may still exist)"""
+
+    _api_baseurl = "https://api.twitter.com"
+    _timeline_endpoint = "/2/users/:id/tweets"
+
+    def __init__(
+            self,
+            api_key: str,
+            api_secret: str,
+            api_token: str,
+            users_lookup_batch_size: int = 100,
+            users_lookup_concurrency: int = 4,
+            tweets_lookup_concurrency: int = 4,
+            api_async: bool = True,
+            api_pacing_ratio: float = 0.5,
+            api_timeout: float = 30
+    ):
         self._twitter = tweepy.Client(
             consumer_key=api_key,
             consumer_secret=api_secret,
             bearer_token=api_token
         )
+        self._users_lookup_batch_size = users_lookup_batch_size
+        self._users_lookup_concurrency = users_lookup_concurrency
+        self._tweets_lookup_concurrency = tweets_lookup_concurrency
+
+        # Native async client, used instead of tweepy (on threads) where supported
+        self._http: Optional[httpx.AsyncClient] = None
+        self._ratelimit = RateLimitScheduler(pacing_ratio=api_pacing_ratio)
+        if api_async:
+            self._http = httpx.AsyncClient(
+                base_url=self._api_baseurl,
+                headers={"Authorization": f"Bearer {api_token}"},
+                timeout=api_timeout
+            )
+
+    async def _api_get(self, endpoint: str, path: str, params: Dict[str, str]) -> dict:
+        """GET request to the Twitter API with the native async client, scheduled according to the rate limit of
+        the endpoint (identified by its path template, since rate limits are per endpoint).
+        A request rejected by rate limit (429) is retried once, after the rate limit window resets."""
+        response = None
+        for attempt in range(2):
+            async with self._ratelimit.acquire(endpoint):
+                response = await self._http.get(path, params=params)
+                self._ratelimit.update(endpoint, response.headers, response.status_code)
+            if response.status_code != 429:
+                break
+            print(f"Twitter API rate limit exceeded on {endpoint}")
+
+        if response.status_code >= 400:
+            raise TwitterAPIError(response.status_code, response.text)
+        return response.json()
+
+    def stats(self) -> Dict[str, Dict[str, Optional[int]]]:
+        """Rate limit quota of each Twitter API endpoint used by the native async client"""
+        return self._ratelimit.stats()
+
+    @property
+    def is_async(self) -> bool:
+        return self._http is not None
+
+    def get_timeline_quota(self) -> Tuple[Optional[int], Optional[int]]:
+        """Return (remaining, limit) of the user tweets timeline endpoint quota; None values if still unknown"""
+        stats = self._ratelimit.stats().get(self._timeline_endpoint, {})
+        return stats.get("remaining"), stats.get("limit")
+
+    async def close(self):
+        if self._http:
+            await self._http.aclose()
 
     async def get_userinfo(self, username: str) -> TwitterProfile:
-        data = await aioify(self._twitter.get_user)(
-            username=username,
-            user_fields=["id", "created_at"]
-        )
-        data = data.data
-        if not data:
-            raise TwitterProfileNotFoundError(username=username)
+        if self._http:
+            data = (await self._api_get(
+                endpoint="/2/users/by/username/:username",
+                path=f"/2/users/by/username/{username}",
+                params={"user.fields": "id,created_at"}
+            )).get("data")
+            if not data:
+                raise TwitterProfileNotFoundError(username=username)
+            userid = data["id"]
+            created_at = datetime.datetime.fromisoformat(data["created_at"].replace("Z", "+00:00"))
+        else:
+            data = await aioify(self._twitter.get_user)(
+                username=username,
+                user_fields=["id", "created_at"]
+            )
+            data = data.data
+            if not data:
+                raise TwitterProfileNotFoundError(username=username)
+            userid = data.id
+            created_at = data.created_at
 
         return TwitterProfile(
             username=username,
-            userid=data.id,
-            joined_date=data.created_at
+            userid=userid,
+            joined_date=created_at
         )
 
     async def get_username(self, userid: str) -> str:
+        if self._http:
+            data = (await self._api_get(
+                endpoint="/2/users/:id",
+                path=f"/2/users/{userid}",
+                params={"user.fields": "username"}
+            )).get("data")
+            if not data:
+                raise TwitterProfileNotFoundError(userid=userid)
+            return data["username"]
+
         data = await aioify(self._twitter.get_user)(
             id=userid,
             user_fields=["username"]
@@ -69,6 +179,115 @@ class TwitterAPIClient(Singleton):
 
         return data.username
 
+    async def _get_users_by_ids(self, userids: List[str]) -> Tuple[Dict[str, str], List[dict]]:
+        """Request the users lookup by userids (up to 100). Return ({userid: username}, per-user errors)"""
+        if self._http:
+            response = await self._api_get(
+                endpoint="/2/users",
+                path="/2/users",
+                params={"ids": ",".join(userids), "user.fields": "username"}
+            )
+            users = {str(user["id"]): user["username"] for user in response.get("data") or []}
+            return users, response.get("errors") or []
+
+        response: tweepy.Response = await aioify(self._twitter.get_users)(
+            ids=userids,
+            user_fields=["username"]
+        )
+        users = {str(user.id): user.username for user in response.data or []}
+        return users, response.errors or []
+
+    async def get_usernames(self, userids: Iterable[str]) -> TwitterUsersLookup:
+        """Lookup the current username of multiple profiles by userid, requesting up to users_lookup_batch_size
+        userids per API call, with up to users_lookup_concurrency calls running concurrently.
+        Profiles not found (or suspended) are told apart from those which lookup failed."""
+        result = TwitterUsersLookup()
+        semaphore = asyncio.Semaphore(self._users_lookup_concurrency)
+
+        async def lookup_batch(batch_userids: List[str]):
+            async with semaphore:
+                try:
+                    users, errors = await self._get_users_by_ids(batch_userids)
+                except Exception as ex:
+                    print(f"Users lookup of {len(batch_userids)} userids failed:", ex)
+                    result.failed.update(batch_userids)
+                    return
+
+            result.usernames.update(users)
+            for error in errors:
+                error_userid = error.get("resource_id") or error.get("value")
+                if error_userid is None or error.get("resource_type", "user") != "user":
+                    continue
+                if error.get("type") in self._users_notfound_error_types:
+                    result.not_found.add(str(error_userid))
+                else:
+                    print("Users lookup error for userid", error_userid, error)
+                    result.failed.add(str(error_userid))
+
+            # userids missing on the response, neither found nor reported as error
+            for userid in batch_userids:
+                if userid not in result.usernames and userid not in result.not_found:
+                    result.failed.add(userid)
+
+        userids = list(dict.fromkeys(str(userid) for userid in userids))
+        await asyncio.gather(*[
+            lookup_batch(batch_userids)
+            for batch_userids in chunked(userids, self._users_lookup_batch_size)
+        ])
+        print(f"Users lookup: {len(result.usernames)} found, {len(result.not_found)} not found, "
+              f"{len(result.failed)} failed")
+        return result
+
+    async def _get_tweets_by_ids(self, tweets_ids: List[str]) -> Tuple[Dict[str, int], List[dict]]:
+        """Request the tweets lookup by tweet ids (up to 100). Return ({tweet_id: timestamp}, per-tweet errors)"""
+        if self._http:
+            response = await self._api_get(
+                endpoint="/2/tweets",
+                path="/2/tweets",
+                params={"ids": ",".join(tweets_ids), "tweet.fields": "created_at"}
+            )
+            tweets = {
+                str(tweet["id"]): datetime_to_timestamp(
+                    datetime.datetime.fromisoformat(tweet["created_at"].replace("Z", "+00:00"))
+                )
+                for tweet in response.get("data") or []
+            }
+            return tweets, response.get("errors") or []
+
+        response: tweepy.Response = await aioify(self._twitter.get_tweets)(
+            ids=tweets_ids,
+            tweet_fields=["created_at"]
+        )
+        tweets = {str(tweet.id): datetime_to_timestamp(tweet.created_at) for tweet in response.data or []}
+        return tweets, response.errors or []
+
+    async def get_tweets_statuses(self, tweets_ids: Iterable[str]) -> Dict[str, TweetScanStatus]:
+        """Verify if multiple tweets exist, requesting up to 100 tweet ids per API call, with up to
+        tweets_lookup_concurrency calls running concurrently (paced by the rate limit scheduler on the async client).
+        Tweets which existence could not be verified (failed requests, or not authorized) are not returned."""
+        statuses: Dict[str, TweetScanStatus] = dict()
+        semaphore = asyncio.Semaphore(self._tweets_lookup_concurrency)
+
+        async def lookup_batch(batch_tweets_ids: List[str]):
+            async with semaphore:
+                try:
+                    tweets, errors = await self._get_tweets_by_ids(batch_tweets_ids)
+                except Exception as ex:
+                    print(f"Tweets lookup of {len(batch_tweets_ids)} tweets failed:", ex)
+                    return
+
+            for tweet_id, timestamp in tweets.items():
+                statuses[tweet_id] = TweetScanStatus(tweet_id=tweet_id, exists=True, timestamp=timestamp)
+            for error in errors:
+                error_tweet_id = error.get("resource_id") or error.get("value")
+                if error_tweet_id is not None and error.get("type") in self._tweets_notfound_error_types:
+                    statuses[str(error_tweet_id)] = TweetScanStatus(tweet_id=str(error_tweet_id), exists=False)
+
+        tweets_ids = list(dict.fromkeys(str(tweet_id) for tweet_id in tweets_ids))
+        await asyncio.gather(*[lookup_batch(batch_tweets_ids) for batch_tweets_ids in chunked(tweets_ids, 100)])
+        print(f"Tweets lookup: {len(statuses)} of {len(tweets_ids)} tweets verified")
+        return statuses
+
     def get_tweets_status(self, tweets_ids: List[str]) -> Dict[str, TweetScanStatus]:
         # TODO Deprecate
         batch_limit = 100
@@ -104,7 +323,97 @@ class TwitterAPIClient(Singleton):
 
     async def get_tweets_status_async(self, tweets_ids: List[str]) -> Dict[str, TweetScanStatus]:
         # TODO Deprecate
-        return await aioify(self.get_tweets_status)(tweets_ids)
+        if not self._http:
+            return await aioify(self.get_tweets_status)(tweets_ids)
+
+        batch_limit = 100
+        if len(tweets_ids) > batch_limit:
+            raise Exception(f"No more than {batch_limit} tweets can be requested")
+
+        response = await self._api_get(
+            endpoint="/2/tweets",
+            path="/2/tweets",
+            params={"ids": ",".join(tweets_ids), "tweet.fields": "created_at"}
+        )
+        found_tweets: Dict[str, TweetScanStatus] = dict()
+        for tweet_found in response.get("data") or []:
+            try:
+                tweet_datetime = datetime.datetime.fromisoformat(tweet_found["created_at"].replace("Z", "+00:00"))
+                tweet_scanstatus = TweetScanStatus(
+                    tweet_id=tweet_found["id"],
+                    exists=True,
+                    timestamp=datetime_to_timestamp(tweet_datetime)
+                )
+                found_tweets[tweet_scanstatus.tweet_id] = tweet_scanstatus
+            except Exception as ex:
+                print("Error parsing tweet scan status", tweet_found, ex)
+
+        notfound_tweets = {
+            tweet_id: TweetScanStatus(
+                tweet_id=tweet_id,
+                exists=False
+            )
+            for tweet_id in tweets_ids
+            if tweet_id not in found_tweets
+        }
+        return {**found_tweets, **notfound_tweets}
+
+    async def iter_tweets_in_range_pages(
+            self,
+            userid: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            include_replies: bool = True,
+            start_cursor: Optional[str] = None,
+            page_size: int = 100
+    ) -> AsyncIterable[Tuple[List[ScrapedTweet], Optional[str]]]:
+        """Iterate the pages of the tweets timeline of a profile, in the given time range, with the native async client.
+        Pages are returned from newest to oldest tweets. For each page yield (found tweets, pagination token to next
+        page), being the token None on the last page. A scroll can be resumed by giving a token as start_cursor.
+        Only the most recent 3200 tweets of a profile can be fetched."""
+        # from_timestamp inclusive, to_timestamp exclusive
+        start_time = max(timestamp_to_datetime(from_timestamp), self._twitterapi_minimum_datetime)
+        end_time = timestamp_to_datetime(to_timestamp)
+        if end_time <= start_time:
+            return
+
+        exclude = ["retweets"]
+        if not include_replies:
+            exclude.append("replies")
+        params = {
+            "start_time": datetime_to_twitter_isoformat(start_time),
+            "end_time": datetime_to_twitter_isoformat(end_time),
+            "exclude": ",".join(exclude),
+            "tweet.fields": "id,created_at,text,conversation_id",
+            "max_results": str(page_size)
+        }
+
+        pagination_token = start_cursor
+        while True:
+            page_params = dict(params)
+            if pagination_token:
+                page_params["pagination_token"] = pagination_token
+            response = await self._api_get(
+                endpoint=self._timeline_endpoint,
+                path=f"/2/users/{userid}/tweets",
+                params=page_params
+            )
+
+            tweets = list()
+            for response_tweet in response.get("data") or []:
+                tweet_datetime = datetime.datetime.fromisoformat(response_tweet["created_at"].replace("Z", "+00:00"))
+                tweets.append(ScrapedTweet(
+                    tweet_id=response_tweet["id"],
+                    text=response_tweet["text"],
+                    timestamp=datetime_to_timestamp(tweet_datetime),
+                    is_reply=response_tweet["id"] != response_tweet.get("conversation_id", response_tweet["id"])
+                ))
+
+            pagination_token = (response.get("meta") or {}).get("next_token")
+            print(f"{len(tweets)} found on Twitter API timeline")
+            yield tweets, pagination_token
+            if not pagination_token:
+                break
 
     def get_tweets_in_range(
             self,
@@ -113,7 +422,7 @@ class TwitterAPIClient(Singleton):
             to_timestamp: int,
             include_replies: bool = True,
             page_size: int = 100
-    ) -> List[TwitterTweet]:
+    ) -> List[ScrapedTweet]:
         # TODO Deprecate
         tweets = list()
         pagination_token = False
@@ -153,8 +462,7 @@ class TwitterAPIClient(Singleton):
                 tweet_datetime = response_tweet.created_at
                 tweet_is_reply = response_tweet.id != response_tweet.conversation_id
 
-                tweets.append(TwitterTweet(
-                    profile_id=userid,
+                tweets.append(ScrapedTweet(
                     tweet_id=tweet_id,
                     text=tweet_text,
                     timestamp=datetime_to_timestamp(tweet_datetime),
@@ -171,23 +479,117 @@ class TwitterAPIClient(Singleton):
             to_timestamp: int,
             include_replies: bool = True,
             page_size: int = 100
-    ) -> List[TwitterTweet]:
+    ) -> List[ScrapedTweet]:
         # TODO Deprecate
         return await aioify(self.get_tweets_in_range)(userid, from_timestamp, to_timestamp, include_replies, page_size)
 
 
+class _NitterInstanceHealth:
+    """Live health of a Nitter instance, from the requests sent to it"""
+    latency_smoothing = 0.2
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        """Exponentially weighted moving average of the successful requests duration, in seconds"""
+        self.requests_count = 0
+        self.failures_count = 0
+        self.consecutive_failures = 0
+        self.disabled_until: float = 0
+
+    def record(self, elapsed: float, success: bool, failures_threshold: int, failures_cooldown: int):
+        self.requests_count += 1
+        if success:
+            self.consecutive_failures = 0
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += self.latency_smoothing * (elapsed - self.latency)
+        else:
+            self.failures_count += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= failures_threshold:
+                self.disabled_until = time.time() + failures_cooldown
+
+    def is_healthy(self) -> bool:
+        return time.time() >= self.disabled_until
+
+
 class TwitterNitterClient(Singleton):
     get: Callable[..., "TwitterNitterClient"]
     _nitter_baseurls: List[str]
 
-    def __init__(self, baseurls: List[str]):
+    def __init__(
+            self,
+            baseurls: List[str],
+            failures_threshold: int = 3,
+            failures_cooldown: int = 300,
+            page_attempts: int = 3,
+            timeout: float = 30
+    ):
         if not baseurls:
             raise Exception("No baseurls given for TwitterNitterClient")
         self._nitter_baseurls = baseurls
         self._nitter_baseurls_unique = set(baseurls)
+        self._failures_threshold = failures_threshold
+        self._failures_cooldown = failures_cooldown
+        self._page_attempts = page_attempts
+        self._health: Dict[str, _NitterInstanceHealth] = {baseurl: _NitterInstanceHealth() for baseurl in baseurls}
+        self._http = httpx.AsyncClient(timeout=timeout, follow_redirects=True)
+
+    async def close(self):
+        await self._http.aclose()
+
+    def pick_nitter_baseurl(self, exclude: Collection[str] = ()) -> str:
+        """Pick a random instance, among the healthy ones (instances in cooldown after failing are skipped).
+        If no instance is healthy, pick any of them."""
+        candidates = [
+            baseurl for baseurl in self._nitter_baseurls
+            if baseurl not in exclude and self._health[baseurl].is_healthy()
+        ]
+        if not candidates:
+            candidates = [baseurl for baseurl in self._nitter_baseurls if baseurl not in exclude] or \
+                self._nitter_baseurls
+        return random.choice(candidates)
+
+    def _record_request(self, baseurl: str, elapsed: float, success: bool):
+        self._health[baseurl].record(
+            elapsed=elapsed,
+            success=success,
+            failures_threshold=self._failures_threshold,
+            failures_cooldown=self._failures_cooldown
+        )
+
+    async def _request(self, baseurl: str, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET request to a Nitter instance, recording its duration and result on the instance health.
+        404 responses are valid responses (e.g. tweet not found), as well as 304 (not modified) responses to
+        conditional requests."""
+        start = time.perf_counter()
+        success = False
+        try:
+            r = await self._http.get(url, headers=headers)
+            success = r.is_success or r.status_code in (304, 404)
+            return r
+        finally:
+            self._record_request(baseurl, time.perf_counter() - start, success)
 
-    def pick_nitter_baseurl(self) -> str:
-        return random.choice(self._nitter_baseurls)
+    def get_health(self) -> Tuple[int, int, Optional[float]]:
+        """Return (amount of healthy instances, amount of instances,
+        average latency of the healthy instances with known latency)"""
+        healthy = [health for health in self._health.values() if health.is_healthy()]
+        latencies = [health.latency for health in healthy if health.latency is not None]
+        return len(healthy), len(self._health), (sum(latencies) / len(latencies) if latencies else None)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Health of each Nitter instance"""
+        return {
+            baseurl: dict(
+                healthy=health.is_healthy(),
+                latency=round(health.latency, 3) if health.latency is not None else None,
+                requests=health.requests_count,
+                failures=health.failures_count
+            )
+            for baseurl, health in self._health.items()
+        }
 
     async def get_tweets_removed(self, tweets_ids: Iterable[str]) -> Set[str]:
         statuses = await self.get_tweets_status(tweets_ids=tweets_ids, ensure=True)
@@ -216,7 +618,7 @@ class TwitterNitterClient(Singleton):
             server = self.pick_nitter_baseurl()
         url_suffix = f"/status/status/{tweet_id}"
         url = urljoin(server, url_suffix)
-        r: requests.Response = await aioify(requests.get)(url)
+        r = await self._request(server, url)
 
         if r.status_code == 404 and "Tweet not found" in r.text:
             exists = False
@@ -237,7 +639,32 @@ class TwitterNitterClient(Singleton):
             from_timestamp: int,
             to_timestamp: int,
             include_replies: bool = True
-    ) -> List[TwitterTweet]:
+    ) -> List[ScrapedTweet]:
+        # from_timestamp inclusive, to_timestamp exclusive
+        tweets = list()
+        async for scroll_tweets, _ in self.iter_tweets_in_range_pages(
+            username=username,
+            from_timestamp=from_timestamp,
+            to_timestamp=to_timestamp,
+            include_replies=include_replies
+        ):
+            tweets.extend(scroll_tweets)
+
+        print(f"{len(tweets)} total tweets found on Nitter")
+        return tweets
+
+    async def iter_tweets_in_range_pages(
+            self,
+            username: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            include_replies: bool = True,
+            start_urlparams: Optional[str] = None
+    ) -> AsyncIterable[Tuple[List[ScrapedTweet], Optional[str]]]:
+        """Iterate the Nitter search scroll pages of tweets of a profile, in the given time range.
+        Pages are returned from newest to oldest tweets. For each page yield (found tweets, URL params to next page),
+        being the URL params None on the last page.
+        A scroll can be resumed by giving the URL params to next page yielded before as start_urlparams."""
         # from_timestamp inclusive, to_timestamp exclusive
         from_datetime = timestamp_to_datetime(from_timestamp)
         from_date = from_datetime.date()
@@ -249,18 +676,29 @@ class TwitterNitterClient(Singleton):
         from_date = from_date.isoformat()
         to_date = to_date.isoformat()
 
-        nitter_baseurl = self.pick_nitter_baseurl()
         url_suffix = f"/{username}/search"
         next_urlparams = f"?f=tweets&q=&e-nativeretweets=on&since={from_date}&until={to_date}"
         if not include_replies:
             next_urlparams += "&e-replies=on"
+        if start_urlparams:
+            next_urlparams = start_urlparams
 
-        tweets = list()
         while next_urlparams is not None:
-            url = urljoin(nitter_baseurl, url_suffix + next_urlparams)
-            print("Requesting Nitter", url)
-            r = await aioify(requests.get)(url)  # TODO use httpx
-            r.raise_for_status()
+            # Scroll cursors are valid on any instance, so failed pages are requested again on other instances
+            attempted_baseurls = list()
+            while True:
+                nitter_baseurl = self.pick_nitter_baseurl(exclude=attempted_baseurls)
+                attempted_baseurls.append(nitter_baseurl)
+                url = urljoin(nitter_baseurl, url_suffix + next_urlparams)
+                print("Requesting Nitter", url)
+                try:
+                    r = await self._request(nitter_baseurl, url)
+                    r.raise_for_status()
+                    break
+                except Exception as ex:
+                    if len(attempted_baseurls) >= self._page_attempts:
+                        raise ex
+                    print(f"Nitter request failed on {nitter_baseurl}, retrying on another instance:", ex)
 
             scroll_tweets, next_urlparams = self._nitter_parse_tweets(
                 from_timestamp=from_timestamp,
@@ -268,13 +706,135 @@ class TwitterNitterClient(Singleton):
                 body=r.text
             )
             print(f"{len(scroll_tweets)} found on Nitter scroll")
-            tweets.extend(scroll_tweets)
+            yield scroll_tweets, next_urlparams
 
-        print(f"{len(tweets)} total tweets found on Nitter")
+    async def get_tweets_in_range_rss(
+            self,
+            username: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            include_replies: bool = True
+    ) -> Optional[List[ScrapedTweet]]:
+        """Get the tweets of a profile in the given time range from the Nitter RSS feed of the profile, which is much
+        lighter than the search pages, but only contains the most recent tweets.
+        Return None if the feed does not reach back to from_timestamp, so the search scroll must be used instead."""
+        # from_timestamp inclusive, to_timestamp exclusive
+        nitter_baseurl = self.pick_nitter_baseurl()
+        url_suffix = f"/{username}/with_replies/rss" if include_replies else f"/{username}/rss"
+        url = urljoin(nitter_baseurl, url_suffix)
+        print("Requesting Nitter RSS", url)
+
+        def fetch_rss() -> Tuple[List[ScrapedTweet], bool]:
+            with requests.get(url, stream=True, timeout=30) as r:
+                r.raise_for_status()
+                return self._nitter_parse_rss(
+                    username=username,
+                    from_timestamp=from_timestamp,
+                    to_timestamp=to_timestamp,
+                    chunks=r.iter_content(chunk_size=8192)
+                )
+
+        start = time.perf_counter()
+        success = False
+        try:
+            tweets, reached_from = await aioify(fetch_rss)()
+            success = True
+        finally:
+            self._record_request(nitter_baseurl, time.perf_counter() - start, success)
+
+        if not reached_from:
+            print(f"Nitter RSS of {username} does not reach back to {from_timestamp}")
+            return None
+        print(f"{len(tweets)} found on Nitter RSS")
         return tweets
 
+    async def get_profile_rss(
+            self,
+            username: str,
+            include_replies: bool = True,
+            baseurl: Optional[str] = None,
+            etag: Optional[str] = None,
+            last_modified: Optional[str] = None
+    ) -> Tuple[Optional[bytes], str, Mapping[str, str]]:
+        """Request the Nitter RSS feed of a profile, on the given instance if healthy (or a random healthy instance).
+        If the ETag or Last-Modified of a previous response of the same instance are given, the request is conditional.
+        Return (feed body, or None if not modified since the previous response; instance used; response headers)."""
+        if baseurl is None or not self._health[baseurl].is_healthy():
+            baseurl = self.pick_nitter_baseurl()
+            etag = last_modified = None
+
+        headers = dict()
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        url_suffix = f"/{username}/with_replies/rss" if include_replies else f"/{username}/rss"
+        r = await self._request(baseurl, urljoin(baseurl, url_suffix), headers=headers)
+        if r.status_code == 304:
+            return None, baseurl, r.headers
+        r.raise_for_status()
+        return r.content, baseurl, r.headers
+
+    @staticmethod
+    def _nitter_parse_rss(
+            username: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            chunks: Iterable[bytes]
+    ) -> Tuple[List[ScrapedTweet], bool]:
+        """Parse the tweets of a profile from a Nitter RSS feed body, given in chunks, with a streaming parser.
+        Items are sorted from newest to oldest, so parsing stops on the first tweet of the profile older than
+        from_timestamp (ignoring its first tweet, which may be pinned). Retweets (items created by other profiles)
+        are ignored, as they carry the date of the original tweet, and so are not sorted with the rest of items.
+        Return (found tweets in range, if the feed reaches back to from_timestamp)."""
+        creator_tag = "{http://purl.org/dc/elements/1.1/}creator"
+        parser = xml.etree.ElementTree.XMLPullParser(events=("end",))
+        tweets = list()
+        profile_items_count = 0
+
+        for chunk in chunks:
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if element.tag != "item":
+                    continue
+                creator = (element.findtext(creator_tag) or "").lstrip("@")
+                title = element.findtext("title") or ""
+                guid = element.findtext("guid") or element.findtext("link") or ""
+                pubdate = element.findtext("pubDate")
+                element.clear()
+
+                if creator.lower() != username.lower():
+                    continue
+                try:
+                    tweet_timestamp = datetime_to_timestamp(email.utils.parsedate_to_datetime(pubdate))
+                except (TypeError, ValueError):
+                    continue
+                # guid example: https://nitter.net/username/status/1494658237361381379#m
+                tweet_id = urlparse(guid).path.rstrip("/").split("/")[-1]
+                if not tweet_id.isdigit():
+                    continue
+
+                profile_items_count += 1
+                if tweet_timestamp < from_timestamp and profile_items_count > 1:
+                    return tweets, True
+                if not timestamp_in_range(ts=tweet_timestamp, from_ts=from_timestamp, to_ts=to_timestamp):
+                    continue
+
+                tweet_is_reply = title.startswith("R to @")
+                if tweet_is_reply:
+                    title = title.split(": ", 1)[-1]
+                tweets.append(ScrapedTweet(
+                    tweet_id=tweet_id,
+                    text=title,
+                    timestamp=tweet_timestamp,
+                    is_reply=tweet_is_reply
+                ))
+
+        return tweets, False
+
     @staticmethod
-    def _nitter_parse_tweets(from_timestamp: int, to_timestamp: int, body: str) -> Tuple[List[TwitterTweet], Optional[str]]:
+    def _nitter_parse_tweets(from_timestamp: int, to_timestamp: int, body: str) -> Tuple[List[ScrapedTweet], Optional[str]]:
         """Parse tweets from a Nitter page body. Returns (found tweets, URL params to next page of results)
         URL params example:
         ?f=tweets&e-nativeretweets=on&since=2022-01-01&until=2022-02-22&cursor=scroll%3AthGAVUV0VFVBaSwL75487urSkWiMC54czMg74pEnEVyIV6FYCJehgHREVGQVVMVDUBFQAVAAA%3D
@@ -337,8 +897,7 @@ class TwitterNitterClient(Singleton):
             if tweet_text is None:
                 continue
 
-            tweets.append(TwitterTweet(
-                profile_id=None,
+            tweets.append(ScrapedTweet(
                 tweet_id=tweet_id,
                 text=tweet_text,
                 timestamp=tweet_timestamp,
@@ -354,3 +913,160 @@ class TwitterNitterClient(Singleton):
             pass
 
         return tweets, next_urlparams
+
+
+class TwitterTimelineRouter(Singleton):
+    """Route the fetches of tweets timelines to the cheapest source for each time range: Nitter, or the Twitter API
+    (native async client only). The cost of Nitter is the latency of its healthy instances (growing as instances
+    become unhealthy); the cost of the API is a fixed equivalent latency, growing as its remaining quota decreases.
+    The API is not eligible for ranges older than api_max_age, or when its remaining quota is below api_min_remaining.
+    If the picked source fails, the range is fetched from the other source."""
+    get: Callable[..., "TwitterTimelineRouter"]
+    SOURCE_NITTER = "nitter"
+    SOURCE_API = "api"
+
+    def __init__(
+            self,
+            nitter_client: TwitterNitterClient,
+            api_client: TwitterAPIClient,
+            mode: str = "auto",
+            api_max_age: int = 7 * 86400,
+            api_cost: float = 3.0,
+            api_min_remaining: int = 50
+    ):
+        self._nitter = nitter_client
+        self._api = api_client
+        self._mode = mode
+        self._api_max_age = api_max_age
+        self._api_cost = api_cost
+        self._api_min_remaining = api_min_remaining
+        self._picked_counts: Dict[str, int] = {self.SOURCE_NITTER: 0, self.SOURCE_API: 0}
+        self._fallbacks_count = 0
+
+    def is_api_eligible(self, from_timestamp: int, now: Optional[int] = None) -> bool:
+        if not self._api.is_async:
+            return False
+        if now is None:
+            now = get_timestamp()
+        if now - from_timestamp > self._api_max_age:
+            return False
+        remaining, _ = self._api.get_timeline_quota()
+        return remaining is None or remaining >= self._api_min_remaining
+
+    def get_costs(self, from_timestamp: int, now: Optional[int] = None) -> Dict[str, float]:
+        """Return the cost of each source eligible for fetching a range starting at from_timestamp"""
+        costs = dict()
+        healthy_count, instances_count, latency = self._nitter.get_health()
+        if healthy_count:
+            # while the latency is unknown (no requests yet) Nitter is preferred, so its latency is learned
+            costs[self.SOURCE_NITTER] = (latency or 0) * instances_count / healthy_count
+        else:
+            costs[self.SOURCE_NITTER] = float("inf")
+
+        if self.is_api_eligible(from_timestamp, now):
+            remaining, limit = self._api.get_timeline_quota()
+            scarcity = limit / remaining if remaining and limit else 1
+            costs[self.SOURCE_API] = self._api_cost * scarcity
+        return costs
+
+    def pick_source(self, from_timestamp: int) -> str:
+        if self._mode == self.SOURCE_NITTER:
+            source = self.SOURCE_NITTER
+        elif self._mode == self.SOURCE_API:
+            source = self.SOURCE_API if self.is_api_eligible(from_timestamp) else self.SOURCE_NITTER
+        else:
+            costs = self.get_costs(from_timestamp)
+            source = min(costs, key=costs.get)  # on equal costs, Nitter (first) is picked
+        self._picked_counts[source] += 1
+        return source
+
+    def _iter_source_pages(
+            self,
+            source: str,
+            username: str,
+            userid: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            include_replies: bool,
+            start_cursor: Optional[str]
+    ) -> AsyncIterable[Tuple[List[ScrapedTweet], Optional[str]]]:
+        if source == self.SOURCE_API:
+            return self._api.iter_tweets_in_range_pages(
+                userid=userid,
+                from_timestamp=from_timestamp,
+                to_timestamp=to_timestamp,
+                include_replies=include_replies,
+                start_cursor=start_cursor
+            )
+        return self._nitter.iter_tweets_in_range_pages(
+            username=username,
+            from_timestamp=from_timestamp,
+            to_timestamp=to_timestamp,
+            include_replies=include_replies,
+            start_urlparams=start_cursor
+        )
+
+    async def iter_tweets_in_range_pages(
+            self,
+            username: str,
+            userid: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            include_replies: bool = True,
+            source: Optional[str] = None,
+            start_cursor: Optional[str] = None
+    ) -> AsyncIterable[Tuple[List[ScrapedTweet], Optional[str], str]]:
+        """Iterate the pages of tweets of a profile in the given time range, from newest to oldest tweets, on the given
+        source or the cheapest one. For each page yield (found tweets, cursor to next page, source); the cursor is only
+        valid for the same source. If the source fails, the range is fetched from the start on the other source,
+        so tweets already yielded may be yielded again."""
+        # from_timestamp inclusive, to_timestamp exclusive
+        if source is None:
+            source = self.pick_source(from_timestamp)
+        try:
+            async for tweets, cursor in self._iter_source_pages(
+                source, username, userid, from_timestamp, to_timestamp, include_replies, start_cursor
+            ):
+                yield tweets, cursor, source
+            return
+        except Exception as ex:
+            fallback_source = self.SOURCE_API if source == self.SOURCE_NITTER else self.SOURCE_NITTER
+            if fallback_source == self.SOURCE_API and not self.is_api_eligible(from_timestamp):
+                raise ex
+            print(f"Timeline fetch from {source} failed, falling back to {fallback_source}:", ex)
+            self._fallbacks_count += 1
+
+        async for tweets, cursor in self._iter_source_pages(
+            fallback_source, username, userid, from_timestamp, to_timestamp, include_replies, None
+        ):
+            yield tweets, cursor, fallback_source
+
+    async def get_tweets_in_range(
+            self,
+            username: str,
+            userid: str,
+            from_timestamp: int,
+            to_timestamp: int,
+            include_replies: bool = True
+    ) -> List[ScrapedTweet]:
+        # from_timestamp inclusive, to_timestamp exclusive
+        tweets: Dict[str, ScrapedTweet] = dict()
+        async for page_tweets, _, _ in self.iter_tweets_in_range_pages(
+            username=username,
+            userid=userid,
+            from_timestamp=from_timestamp,
+            to_timestamp=to_timestamp,
+            include_replies=include_replies
+        ):
+            tweets.update({tweet.tweet_id: tweet for tweet in page_tweets})
+
+        print(f"{len(tweets)} total tweets found on timeline")
+        return list(tweets.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            picked=dict(self._picked_counts),
+            fallbacks=self._fallbacks_count,
+            nitter=self._nitter.stats(),
+            api_timeline_quota=self._api.get_timeline_quota()
+        )
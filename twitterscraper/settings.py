@@ -11,6 +11,22 @@ import twitterscraper.utils
 SETTINGS_FILE = os.getenv("SETTINGS_FILE", "settings.yaml")
 
 
+def _parse_duration(v):
+    """If a duration is given as string, try to convert it to ISO 8601 duration format.
+    Accepts durations like "1d2h3m4s"
+    https://pydantic-docs.helpmanual.io/usage/types/#datetime-types"""
+    if not isinstance(v, str):
+        return v
+    v = v.upper()
+    if not v.startswith("P"):
+        v = "P" + v
+    if "D" in v and "DT" not in v:
+        v = v.replace("D", "DT")
+    if "DT" not in v:
+        v = v.replace("P", "PT")
+    return v
+
+
 class AMQPSettings(pydantic.BaseModel):
     class Queues(pydantic.BaseModel):
         class QueueConfig(pydantic.BaseModel):
@@ -20,7 +36,38 @@ class AMQPSettings(pydantic.BaseModel):
             """If persistent, enqueue messages with Persistent mode (deliveryMode=2)"""
             workers: int = 10
             """Amount of concurrent messages that can be consumed, thus effective parallel works that can be handled.
-            This sets the channel QoS prefetch_count when consuming"""
+            This sets the channel QoS prefetch_count when consuming, unless `prefetch` is given"""
+            workers_per_profile: Optional[int] = 2
+            """Maximum amount of concurrent jobs of a same profile, so a profile with many pending jobs (like a big
+            backfill) can not use all the workers. Pending jobs are processed round-robin between profiles, and jobs
+            of a profile received beyond this amount pending are deferred (see `partition_defer_delay`).
+            Set to null to disable the limit"""
+            prefetch: Optional[int] = None
+            """Channel QoS prefetch_count when consuming: amount of pending jobs received by each worker process
+            (shared by all the priority lanes), between which jobs are chosen. By default, 4 times `workers`
+            if `workers_per_profile` is set, else `workers`"""
+
+            @property
+            def prefetch_count(self) -> int:
+                if self.prefetch:
+                    return self.prefetch
+                if self.workers_per_profile:
+                    return self.workers * 4
+                return self.workers
+
+            lanes_weights: Dict[str, int] = {"high": 6, "normal": 3, "low": 1}
+            """Weight of each priority lane when consuming. Each job priority is enqueued on a different queue (lane):
+            "{name}" for normal priority, "{name}.{priority}" for the rest. Pending jobs from the lanes are processed
+            proportionally to these weights"""
+
+            def get_lane_name(self, priority: str) -> str:
+                if priority == "normal":
+                    return self.name
+                return f"{self.name}.{priority}"
+
+            def get_lanes(self) -> Dict[str, int]:
+                """Return {lane queue name: weight}"""
+                return {self.get_lane_name(priority): weight for priority, weight in self.lanes_weights.items()}
 
         # Queues
         fetchpersist: QueueConfig
@@ -28,13 +75,46 @@ class AMQPSettings(pydantic.BaseModel):
         persistedreview: QueueConfig
         """Queue for Persisted Review jobs"""
 
+    class Priorities(pydantic.BaseModel):
+        creator: Literal["high", "normal", "low"] = "low"
+        """Priority of the FetchAndPersist jobs created by the Creator (profile historical backfill)"""
+        new_tweets_scan: Literal["high", "normal", "low"] = "high"
+        """Priority of the FetchAndPersist jobs created by the NewTweetsScan task"""
+        sync_profiles_tweets: Literal["high", "normal", "low"] = "normal"
+        """Priority of the PersistedReview jobs created by the SyncProfilesTweets task"""
+
     # AMQPSettings
     uri: pydantic.AnyUrl
     """AMQP connection URI"""
     queues: Queues
     """Queues for each job type"""
+    priorities: Priorities = Priorities()
+    """Priority of the jobs created by each job source"""
     exchange: str = ""
     """Exchange to use when consuming"""
+    publish_batch_size: int = 500
+    """Amount of messages published on each batch when enqueueing jobs"""
+    publish_max_unconfirmed: int = 100
+    """Maximum amount of published messages waiting for the broker confirmation (publisher confirms) at the same time"""
+    publish_retries: int = 3
+    """Times that messages not confirmed by the broker are published again"""
+    publish_timeout: Optional[float] = 30
+    """Seconds to wait for the broker confirmation of each published message"""
+    drain_timeout: Optional[float] = 60
+    """Seconds to wait for the in-flight messages to complete when a worker is stopped.
+    Messages still running after the timeout are cancelled and redelivered by the broker"""
+    retry_max_attempts: int = 5
+    """Times that a job is attempted before sending it to the dead-letter queue ("{queue}.dead")"""
+    retry_delay: float = 30
+    """Seconds to wait before retrying a failed job for the first time"""
+    retry_backoff: float = 4
+    """Multiplier of the retry delay for each further attempt (exponential backoff)"""
+    partition_defer_delay: float = 5
+    """Seconds that the jobs of a profile received while the profile has `workers_per_profile` jobs pending wait on
+    the deferred queue ("{queue}.deferred") before returning to the tail of their queue, so the jobs of other
+    profiles enqueued behind them can be received"""
+    jobs_encoding: Literal["msgpack", "json"] = "msgpack"
+    """Encoding of the enqueued jobs. Workers can always decode both encodings"""
 
 
 class TwitterSettings(pydantic.BaseModel):
@@ -52,6 +132,38 @@ class TwitterSettings(pydantic.BaseModel):
     nitter_baseurl: List[pydantic.AnyHttpUrl] = pydantic.Field(default="https://nitter.net", min_items=1)
     """Base URL of a Nitter instance, used for scraping purposes. A list of URLs can be given, in which case
     a random instance will be picked each time"""
+    users_lookup_batch_size: int = pydantic.Field(default=100, ge=1, le=100)
+    """Userids requested per Twitter API call when looking up multiple profiles (API limit is 100)"""
+    users_lookup_concurrency: int = pydantic.Field(default=4, ge=1)
+    """Twitter API calls running concurrently when looking up multiple profiles"""
+    tweets_lookup_concurrency: int = pydantic.Field(default=4, ge=1)
+    """Twitter API calls running concurrently when verifying multiple tweets (100 tweets per call)"""
+    api_async: bool = True
+    """Use the native async Twitter API client (where supported), which schedules the requests according to the
+    rate limits reported by the API, instead of the tweepy client running on threads"""
+    api_pacing_ratio: float = pydantic.Field(default=0.5, ge=0, le=1)
+    """When the remaining quota of an endpoint falls below this ratio of its limit, requests are spaced evenly until
+    the rate limit window resets (async client only)"""
+    api_timeout: float = 30
+    """Timeout of the Twitter API requests, in seconds (async client only)"""
+    nitter_failures_cooldown: int = 300
+    """Seconds a Nitter instance is not used after failing nitter_failures_threshold consecutive requests"""
+    nitter_failures_threshold: int = pydantic.Field(default=3, ge=1)
+    nitter_page_attempts: int = pydantic.Field(default=3, ge=1)
+    """Attempts for requesting each page of a Nitter scroll, each on a different instance if available"""
+    timeline_source: Literal["auto", "nitter", "api"] = "auto"
+    """Source of the tweets timelines fetched by FetchAndPersist and PersistedReview: always "nitter", always "api"
+    (falling back to Nitter when the range can not be fetched from the API), or "auto" to pick the cheapest for each
+    range, based on the Nitter instances health and latency, the Twitter API remaining quota, and the range age"""
+    timeline_api_max_age: datetime.timedelta = datetime.timedelta(days=7)
+    """Ranges older than this are never fetched from the Twitter API, since its timeline only returns the most
+    recent 3200 tweets of a profile"""
+    timeline_api_cost: float = 3.0
+    """Cost of fetching a timeline page from the Twitter API, as the equivalent seconds of a Nitter page request:
+    on "auto", Nitter is used while its healthy instances respond faster than this (the cost grows as the API
+    remaining quota decreases)"""
+    timeline_api_min_remaining: int = 50
+    """The Twitter API is not used for timelines while the timeline endpoint remaining quota is below this"""
 
     @pydantic.validator("nitter_baseurl", pre=True)
     def _nitter_baseurl_string_to_list(cls, v):
@@ -59,6 +171,10 @@ class TwitterSettings(pydantic.BaseModel):
             v = [v]
         return v
 
+    @pydantic.validator("timeline_api_max_age", pre=True)
+    def _parse_durations(cls, v):
+        return _parse_duration(v)
+
 
 class TasksSettings(pydantic.BaseModel):
     class Task(pydantic.BaseModel):
@@ -72,28 +188,47 @@ class TasksSettings(pydantic.BaseModel):
         period_start_now: bool = True
         """For Period schedule method, run the task at the beginning; otherwise, wait `period` until the first run."""
         daily_times: Optional[List[datetime.time]]
-        """Run the task at the given times (like "12:25:00" or "12:25"), everyday."""
+        """Run the task at the given times (like "12:25:00" or "12:25"), everyday. Times are UTC."""
+        jitter: int = 0
+        """Delay each run by a random amount of seconds, between 0 and this value."""
 
         @property
         def period_seconds(self) -> Optional[int]:
             if self.period is not None:
                 return int(self.period.total_seconds())
 
+        @property
+        def enabled(self) -> bool:
+            return bool(self.period or self.daily_times)
+
+        def get_next_run(
+                self,
+                now: datetime.datetime,
+                last_run_start: Optional[datetime.datetime] = None
+        ) -> Optional[datetime.datetime]:
+            """Get the datetime of the next run of the task, given the current UTC datetime, and the start datetime
+            of the last run (None if the task did not run yet). If the last run took longer than the period,
+            the next run is now. Return None if the task has no schedule."""
+            if self.period:
+                if last_run_start is None:
+                    return now if self.period_start_now else now + self.period
+                return max(now, last_run_start + self.period)
+
+            if self.daily_times:
+                candidates = list()
+                for day in (now.date(), now.date() + datetime.timedelta(days=1)):
+                    for daily_time in self.daily_times:
+                        candidate = datetime.datetime.combine(day, daily_time.replace(tzinfo=None)). \
+                            replace(tzinfo=datetime.timezone.utc)
+                        if candidate > now and (last_run_start is None or candidate > last_run_start):
+                            candidates.append(candidate)
+                return min(candidates)
+
+            return None
+
         @pydantic.validator("period", pre=True)
         def _parse_period(cls, v):
-            """If the period is given as string, try to convert it to ISO 8601 duration format.
-            Accepts durations like "1d2h3m4s"
-            https://pydantic-docs.helpmanual.io/usage/types/#datetime-types"""
-            if not isinstance(v, str):
-                return v
-            v = v.upper()
-            if not v.startswith("P"):
-                v = "P" + v
-            if "D" in v and "DT" not in v:
-                v = v.replace("D", "DT")
-            if "DT" not in v:
-                v = v.replace("P", "PT")
-            return v
+            return _parse_duration(v)
 
         @pydantic.validator("daily_times", pre=True)
         def _parse_arrays(cls, v):
@@ -109,16 +244,135 @@ class TasksSettings(pydantic.BaseModel):
     persisted_tweets_scan: Task
 
 
+class JobsSettings(pydantic.BaseModel):
+    class ReviewInterval(pydantic.BaseModel):
+        max_age: Optional[datetime.timedelta]
+        """Maximum age of the tweets (days) this interval applies to. None for no limit"""
+        interval: datetime.timedelta
+        """Review the tweets of each day with this frequency"""
+
+        @pydantic.validator("max_age", "interval", pre=True)
+        def _parse_durations(cls, v):
+            return _parse_duration(v)
+
+    ranges_per_job: int = 30
+    """Amount of time ranges packed on each FetchAndPersist or PersistedReview job, when planning jobs for
+    multiple time ranges of a profile"""
+    backfill_range_days: int = 30
+    """Days covered by each time range when fetching all the tweets of a new profile (Creator). Ranges with many
+    tweets are split by the workers (see split_pages_threshold)"""
+    split_pages_threshold: int = 10
+    """When a FetchAndPersist worker fetches this amount of pages on a time range longer than a day, it stops
+    fetching, and enqueues new jobs for fetching the rest of the range, sized by the page density observed to have
+    about half this amount of pages each (at least an hour); longer ranges are split again if still too dense"""
+    dedup_pending_window: int = 86400
+    """Seconds since creation that a not finalized job is considered pending. When enqueueing a job, it is skipped if
+    a pending job with the same idempotency key (same work, profile and time range) exists; the ranges of jobs with
+    multiple ranges are deduplicated one by one.
+    NewTweetsScan ranges not fetched after this time are considered lost, and enqueued again"""
+    dedup_finished_window: int = 3600
+    """Seconds since finalization that a job is considered recently finished. When enqueueing a job, it is skipped if
+    a recently finished job with the same idempotency key exists"""
+    review_intervals: List[ReviewInterval] = [
+        ReviewInterval(max_age="7d", interval="1d"),
+        ReviewInterval(max_age="365d", interval="7d"),
+        ReviewInterval(max_age=None, interval="30d"),
+    ]
+    """How often the persisted tweets of each day are reviewed (SyncProfilesTweets task), depending on their age.
+    Sorted by max_age; for each day, the first interval which max_age is greater than the day age is used"""
+    rss_max_age: Optional[datetime.timedelta] = datetime.timedelta(days=1)
+    """FetchAndPersist ranges starting within this age (usually the NewTweetsScan ranges) are fetched from the Nitter
+    RSS feed of the profile, falling back to the search scroll if the feed does not reach back to the range start.
+    None to disable"""
+    review_fingerprints: bool = True
+    """Save a fingerprint of each reviewed range (hashes of the ids of the online pages and the persisted tweets), so
+    the next review of the range compares the hash of each online page while fetching them, and if all the pages and
+    the persisted tweets are the same, sets the range as reviewed without loading the persisted tweets nor
+    double-checking deletions"""
+    review_streaming: bool = False
+    """Compare the persisted and online tweets of each reviewed range while the online pages are fetched, streaming
+    the persisted tweets ids from the database sorted by id, instead of loading all the tweets of both sides at once.
+    Keeps memory bounded on reviews of long ranges or very active profiles"""
+    review_streaming_batch_size: int = 500
+    """Tweets ids loaded per query, and tweets updated or double-checked per batch, on streaming reviews"""
+    deletion_verification: Literal["nitter", "api"] = "nitter"
+    """Backend used by PersistedReview for confirming the tweets not found on the Nitter search are deleted:
+    "nitter" verifies each tweet individually on all the Nitter instances; "api" verifies them in batches of 100 tweets
+    with the Twitter API, falling back to Nitter for the tweets it could not verify"""
+    known_tweets_filter: bool = False
+    """Keep in memory, on each FetchAndPersist worker, the ids of the persisted tweets of the profiles it fetches
+    (loaded on the first job of each profile), so the tweets already persisted are skipped without trying to
+    save them"""
+    known_tweets_filter_max_profiles: int = 100
+    """Maximum profiles kept on the known tweets filter (least recently used are dropped)"""
+    known_tweets_filter_ttl: datetime.timedelta = datetime.timedelta(hours=1)
+    """Reload the known tweets of a profile after this time, to include the tweets persisted by other workers"""
+
+    @pydantic.validator("rss_max_age", "known_tweets_filter_ttl", pre=True)
+    def _parse_durations(cls, v):
+        return _parse_duration(v)
+
+    def get_review_intervals_seconds(self) -> List[Tuple[Optional[int], int]]:
+        """Return the review_intervals as (max age, interval) in seconds, sorted by max age"""
+        intervals = [
+            (
+                int(item.max_age.total_seconds()) if item.max_age is not None else None,
+                int(item.interval.total_seconds())
+            )
+            for item in self.review_intervals
+        ]
+        return sorted(intervals, key=lambda item: (item[0] is None, item[0]))
+
+
 class PersistenceSettings(pydantic.BaseModel):
     uri: pydantic.AnyUrl
 
 
+class WatchSettings(pydantic.BaseModel):
+    profiles: List[str] = []
+    """Usernames of the (already persisted) profiles polled by the "watcher" command"""
+    interval: datetime.timedelta = datetime.timedelta(minutes=2)
+    """Time between polls of the recent timeline (Nitter RSS feed) of each watched profile"""
+    window: datetime.timedelta = datetime.timedelta(hours=6)
+    """Age of the persisted tweets compared against the recent timeline on each poll"""
+    recheck_interval: datetime.timedelta = datetime.timedelta(minutes=30)
+    """Tweets missing from the recent timeline but verified as existing are not verified again during this time"""
+
+    @pydantic.validator("interval", "window", "recheck_interval", pre=True)
+    def _parse_durations(cls, v):
+        return _parse_duration(v)
+
+    @pydantic.validator("profiles", pre=True)
+    def _split_str_list(cls, v):
+        """If the profiles are given as string, try to convert it to list splitting by commas"""
+        if not isinstance(v, str):
+            return v
+        return [chunk.strip() for chunk in v.split(",") if chunk.strip()]
+
+
+class SupervisorSettings(pydantic.BaseModel):
+    restart_delay: float = 1
+    """Seconds to wait before restarting a worker process that exited. Doubled on each consecutive restart"""
+    restart_delay_max: float = 60
+    """Maximum seconds to wait before restarting a worker process"""
+    restart_reset_after: float = 60
+    """Worker processes running for at least this seconds before exiting are restarted without backoff"""
+    stats_interval: float = 60
+    """Seconds between the stats reports of each worker process to the supervisor"""
+    stop_timeout: float = 90
+    """Seconds to wait for the worker processes to stop (draining their in-flight jobs) before killing them.
+    Should be greater than the amqp drain_timeout"""
+
+
 class MainSettings(pydantic.BaseModel, twitterscraper.utils.Singleton):
     get: ClassVar[Callable[..., "MainSettings"]]
     amqp: AMQPSettings
     twitter: TwitterSettings
     persistence: PersistenceSettings
     tasks: TasksSettings
+    jobs: JobsSettings = JobsSettings()
+    watch: WatchSettings = WatchSettings()
+    supervisor: SupervisorSettings = SupervisorSettings()
 
 
 def load_settings() -> MainSettings:
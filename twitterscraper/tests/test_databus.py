@@ -0,0 +1,337 @@
+import asyncio
+import collections
+from typing import *
+
+import aio_pika
+import pytest
+
+from twitterscraper.services.databus import AMQPClient, AMQPPublishError, _ConsumerLane
+
+
+class FakeIncomingMessage:
+    def __init__(self, broker: "FakeBroker", queue: str, body: bytes, headers: Optional[dict] = None,
+                 message_id: Optional[str] = None, type: Optional[str] = None):
+        self.broker = broker
+        self.queue = queue
+        self.body = body
+        self.headers = headers
+        self.message_id = message_id
+        self.type = type
+        self.content_type = None
+        self.delivery_mode = None
+        self.priority = None
+
+    def ack(self):
+        self.broker.settle(self)
+
+    def nack(self, requeue: bool = True):
+        self.broker.settle(self)
+        if requeue:
+            self.broker.queues[self.queue].messages.appendleft(self)
+            self.broker.deliver()
+
+
+class FakeQueue:
+    def __init__(self, broker: "FakeBroker", name: str, arguments: Optional[dict] = None):
+        self.broker = broker
+        self.name = name
+        self.arguments = arguments or dict()
+        self.messages: Deque[FakeIncomingMessage] = collections.deque()
+        self.callback = None
+
+    async def consume(self, callback):
+        self.callback = callback
+        self.broker.deliver()
+        return f"ctag-{self.name}"
+
+    async def cancel(self, consumer_tag: str):
+        self.callback = None
+
+
+class FakeExchange:
+    def __init__(self, broker: "FakeBroker"):
+        self.broker = broker
+
+    async def publish(self, message, routing_key: str, timeout=None):
+        self.broker.publish(routing_key, message)
+
+
+class FakeBroker:
+    """In-memory broker for a single channel: default exchange, global QoS and TTL queues dead-lettering back to
+    another queue. Deliveries are dispatched to the consumers as tasks, like aio_pika does."""
+
+    def __init__(self):
+        self.queues: Dict[str, FakeQueue] = dict()
+        self.prefetch_count: Optional[int] = None
+        self.unacked: Set[int] = set()
+        self.default_exchange = FakeExchange(self)
+
+    # Channel interface
+    async def set_qos(self, prefetch_count: int, global_: bool = False):
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, durable: bool = True, arguments: Optional[dict] = None):
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = FakeQueue(self, name, arguments)
+        return queue
+
+    def publish(self, routing_key: str, message):
+        queue = self.queues.setdefault(routing_key, FakeQueue(self, routing_key))
+        incoming = FakeIncomingMessage(
+            broker=self,
+            queue=routing_key,
+            body=message.body,
+            headers=dict(message.headers or {}),
+            message_id=message.message_id,
+            type=message.type
+        )
+        ttl = queue.arguments.get("x-message-ttl")
+        if ttl is not None:
+            dead_letter_queue = queue.arguments["x-dead-letter-routing-key"]
+            asyncio.get_running_loop().call_later(ttl / 1000, self.publish, dead_letter_queue, incoming)
+            return
+        queue.messages.append(incoming)
+        self.deliver()
+
+    def settle(self, message: FakeIncomingMessage):
+        self.unacked.discard(id(message))
+        self.deliver()
+
+    def deliver(self):
+        while self.prefetch_count is None or len(self.unacked) < self.prefetch_count:
+            queue = next((queue for queue in self.queues.values() if queue.callback and queue.messages), None)
+            if queue is None:
+                return
+            message = queue.messages.popleft()
+            self.unacked.add(id(message))
+            asyncio.get_running_loop().create_task(queue.callback(message))
+
+
+class FakeConfirmsExchange:
+    """Exchange confirming each publish after a delay; the failures given for a message body are raised (in order)
+    on its first publishes"""
+
+    def __init__(self, failures: Optional[Dict[bytes, List[Exception]]] = None):
+        self.failures = failures or dict()
+        self.events: List[Tuple[str, bytes]] = list()
+        self.unconfirmed_count = 0
+        self.max_unconfirmed_count = 0
+
+    async def publish(self, message, routing_key: str, timeout=None):
+        self.events.append(("publish", message.body))
+        self.unconfirmed_count += 1
+        self.max_unconfirmed_count = max(self.max_unconfirmed_count, self.unconfirmed_count)
+        try:
+            await asyncio.sleep(0.001)
+            failures = self.failures.get(message.body)
+            if failures:
+                raise failures.pop(0)
+            self.events.append(("confirm", message.body))
+        finally:
+            self.unconfirmed_count -= 1
+
+    def get_confirmed(self) -> List[bytes]:
+        return [body for event, body in self.events if event == "confirm"]
+
+
+def _get_client(broker: FakeBroker, **kwargs) -> AMQPClient:
+    client = AMQPClient("amqp://localhost", **kwargs)
+    client._channel = broker
+    return client
+
+
+def test_consume_partition_key_backlog_deferred():
+    # a profile with a big backlog enqueued first, then a few jobs of other profiles
+    workers = 4
+    backlog_count = 20
+    jobs_keys = ["backlog"] * backlog_count + [f"profile{i}" for i in range(workers - 1) for _ in range(2)]
+    started_keys = list()
+    running_count = 0
+    max_running_count = 0
+
+    async def callback(payload: bytes):
+        nonlocal running_count, max_running_count
+        started_keys.append(payload.decode())
+        running_count += 1
+        max_running_count = max(max_running_count, running_count)
+        await asyncio.sleep(0.01)
+        running_count -= 1
+
+    async def run():
+        broker = FakeBroker()
+        client = _get_client(broker, partition_defer_delay=0.005)
+        await broker.declare_queue("jobs")
+        for key in jobs_keys:
+            broker.publish("jobs", client._build_message(key.encode(), persistent=True, partition_key=key))
+        await client.consume(
+            queues="jobs",
+            callback=callback,
+            workers=workers,
+            msg_limit=len(jobs_keys),
+            max_per_partition_key=1,
+            prefetch_count=workers * 4
+        )
+        return client
+
+    client = asyncio.run(run())
+    assert sorted(started_keys) == sorted(jobs_keys)
+    # the jobs of the other profiles run alongside the backlog, instead of waiting for it
+    assert set(started_keys[:workers]) == set(jobs_keys)
+    assert max_running_count == workers
+    last_other_index = max(i for i, key in enumerate(started_keys) if key != "backlog")
+    assert last_other_index < 2 * workers
+    assert client.stats()["deferred"] > 0
+
+
+def _enqueue(exchange: FakeConfirmsExchange, payloads: List[bytes], **kwargs):
+    client = _get_client(FakeBroker(), **kwargs)
+    client._exchanges[""] = exchange
+    asyncio.run(client.enqueue(exchange="", routingkey="jobs", persistent=True, payloads=payloads))
+
+
+def test_enqueue_batches_confirmed():
+    exchange = FakeConfirmsExchange()
+    payloads = [str(i).encode() for i in range(25)]
+    _enqueue(exchange, payloads, publish_batch_size=10, publish_max_unconfirmed=3)
+
+    assert sorted(exchange.get_confirmed()) == sorted(payloads)
+    assert exchange.max_unconfirmed_count == 3
+    # each batch is confirmed before publishing the next one
+    for batch_start in (10, 20):
+        batch_published_index = exchange.events.index(("publish", payloads[batch_start]))
+        previous_batch_confirmed_index = max(exchange.events.index(("confirm", payload))
+                                             for payload in payloads[batch_start - 10:batch_start])
+        assert previous_batch_confirmed_index < batch_published_index
+
+
+def test_enqueue_retries_unconfirmed():
+    exchange = FakeConfirmsExchange(failures={
+        b"nacked": [aio_pika.exceptions.DeliveryError(None, None)],
+        b"timeout": [asyncio.TimeoutError(), asyncio.TimeoutError()]
+    })
+    _enqueue(exchange, [b"nacked", b"timeout", b"ok"], publish_retries=2)
+
+    assert sorted(exchange.get_confirmed()) == [b"nacked", b"ok", b"timeout"]
+    published = [body for event, body in exchange.events if event == "publish"]
+    assert (published.count(b"nacked"), published.count(b"timeout"), published.count(b"ok")) == (2, 3, 1)
+
+
+def test_enqueue_unconfirmed_error():
+    exchange = FakeConfirmsExchange(failures={b"nacked": [aio_pika.exceptions.DeliveryError(None, None)] * 3})
+    with pytest.raises(AMQPPublishError) as error:
+        _enqueue(exchange, [b"nacked", b"ok1", b"ok2"], publish_retries=2)
+
+    assert (error.value.unconfirmed_count, error.value.total_count) == (1, 3)
+    assert sorted(exchange.get_confirmed()) == [b"ok1", b"ok2"]
+
+
+def _consume_stopped(job_duration: float, **kwargs) -> Tuple[FakeBroker, List[bytes]]:
+    """Consume 3 messages with 1 worker, stopping the consumer when the first message starts"""
+    completed = list()
+
+    async def run():
+        broker = FakeBroker()
+        client = _get_client(broker, **kwargs)
+
+        async def callback(payload: bytes):
+            client.stop_consuming()
+            await asyncio.sleep(job_duration)
+            completed.append(payload)
+
+        await broker.declare_queue("jobs")
+        for payload in (b"1", b"2", b"3"):
+            broker.publish("jobs", client._build_message(payload, persistent=True))
+        await client.consume(queues="jobs", callback=callback, workers=1, prefetch_count=3)
+        return broker
+
+    return asyncio.run(run()), completed
+
+
+def test_consume_stop_drains_inflight():
+    broker, completed = _consume_stopped(job_duration=0.05, drain_timeout=5)
+    assert completed == [b"1"]
+    assert not broker.unacked
+    # the messages received but not dispatched are requeued
+    assert sorted(message.body for message in broker.queues["jobs"].messages) == [b"2", b"3"]
+
+
+def test_consume_stop_drain_timeout_cancels():
+    broker, completed = _consume_stopped(job_duration=5, drain_timeout=0.01)
+    assert completed == []
+    # the cancelled message is not acked, so the broker redelivers it
+    assert len(broker.unacked) == 1
+    assert sorted(message.body for message in broker.queues["jobs"].messages) == [b"2", b"3"]
+
+
+def test_consume_failed_retried_then_dead_lettered():
+    attempts = list()
+
+    async def callback(payload: bytes):
+        attempts.append(payload)
+        raise ValueError("Job failed")
+
+    async def run():
+        broker = FakeBroker()
+        client = _get_client(broker, retry_max_attempts=3, retry_delay=0.001, retry_backoff=2)
+        await broker.declare_queue("jobs")
+        broker.publish("jobs", client._build_message(b"job", persistent=True, partition_key="123", message_id="1"))
+        await client.consume(queues="jobs", callback=callback, workers=1, msg_limit=3)
+        return broker
+
+    broker = asyncio.run(run())
+    assert attempts == [b"job"] * 3
+    assert [broker.queues[f"jobs.retry.{attempt}"].arguments for attempt in (1, 2)] == [
+        {"x-message-ttl": ttl, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "jobs"} for ttl in (1, 2)
+    ]
+    assert not broker.unacked
+    assert not broker.queues["jobs"].messages
+
+    dead_message, = broker.queues["jobs.dead"].messages
+    assert (dead_message.body, dead_message.message_id) == (b"job", "1")
+    assert dead_message.headers["x-attempts"] == 3
+    assert dead_message.headers["x-partition-key"] == "123"
+    assert "Job failed" in dead_message.headers["x-last-error"]
+
+
+def _get_lanes(broker: FakeBroker, messages_counts: Dict[str, int], weights: Dict[str, int]) -> List[_ConsumerLane]:
+    lanes = list()
+    for name, weight in weights.items():
+        lane = _ConsumerLane(queue=FakeQueue(broker, name), weight=weight)
+        for i in range(messages_counts.get(name, 0)):
+            lane.push(FakeIncomingMessage(broker, name, f"{name}{i}".encode(), {"x-partition-key": str(i % 2)}))
+        lanes.append(lane)
+    return lanes
+
+
+def _pick_lanes(lanes: List[_ConsumerLane], count: int, is_key_available=lambda key: True) -> List[str]:
+    picked_lanes = list()
+    for _ in range(count):
+        picked = AMQPClient._pick_message(lanes, is_key_available)
+        if picked is None:
+            break
+        picked_lanes.append(picked[0].queue.name)
+    return picked_lanes
+
+
+def test_pick_message_weighted_lanes():
+    lanes = _get_lanes(FakeBroker(), {"high": 100, "normal": 100, "low": 100}, {"high": 6, "normal": 3, "low": 1})
+    picked_lanes = _pick_lanes(lanes, 50)
+    assert collections.Counter(picked_lanes) == {"high": 30, "normal": 15, "low": 5}
+    # smooth: the low lane is not starved until the end of each round
+    assert "low" in picked_lanes[:10]
+
+
+def test_pick_message_skips_empty_lanes():
+    lanes = _get_lanes(FakeBroker(), {"normal": 4, "low": 10}, {"high": 6, "normal": 3, "low": 1})
+    picked_lanes = _pick_lanes(lanes, 20)
+    assert collections.Counter(picked_lanes) == {"normal": 4, "low": 10}
+    # while the normal lane has messages, the empty high lane does not take its turns
+    assert collections.Counter(picked_lanes[:5]) == {"normal": 4, "low": 1}
+
+
+def test_pick_message_skips_unavailable_keys():
+    lanes = _get_lanes(FakeBroker(), {"high": 4, "low": 4}, {"high": 6, "low": 1})
+    # only the messages of the partition key "1" can be dispatched
+    picked_lanes = _pick_lanes(lanes, 10, is_key_available=lambda key: key == "1")
+    assert collections.Counter(picked_lanes) == {"high": 2, "low": 2}
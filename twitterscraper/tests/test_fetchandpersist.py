@@ -0,0 +1,155 @@
+import asyncio
+import contextlib
+import types
+from typing import *
+
+import pytest
+
+import twitterscraper.controllers.jobs
+import twitterscraper.controllers.fetchandpersist as fetchandpersist
+from twitterscraper.models import FetchPersistJob, FetchPersistRangesJob, JobHistoric, ScrapedTweet, TwitterProfile
+from twitterscraper.settings import MainSettings, JobsSettings
+from twitterscraper.utils import get_uuid
+
+
+class FakeSession:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeRepository:
+    """In-memory jobs historic; tweets and coverage are just recorded"""
+
+    def __init__(self, profile: TwitterProfile):
+        self.profile = profile
+        self.jobs: Dict[str, JobHistoric] = dict()
+        self.saved_tweets = list()
+        self.coverage = list()
+
+    @contextlib.asynccontextmanager
+    async def session_async(self):
+        yield FakeSession()
+
+    async def get_profile_by(self, userid=None, username=None):
+        return self.profile
+
+    async def get_job_historic(self, job_id: str) -> Optional[JobHistoric]:
+        return self.jobs.get(job_id)
+
+    async def save_object_async(self, *objs, flush: bool = False):
+        for obj in objs:
+            if isinstance(obj, JobHistoric):
+                self.jobs[obj.job_id] = obj
+            else:
+                self.saved_tweets.append(obj)
+
+    async def set_job_keys_finalized(self, job_id, timestamp):
+        pass
+
+    async def add_profile_coverage(self, profile_id, kind, from_timestamp, to_timestamp):
+        self.coverage.append((from_timestamp, to_timestamp))
+
+
+class FakeRouter:
+    """Timeline of one tweet per hour, 2 tweets per page, from newest to oldest"""
+
+    def __init__(self, from_ts: int, to_ts: int):
+        self.timestamps = list(range(to_ts - 3600, from_ts - 1, -3600))
+        self.calls = 0
+
+    async def iter_tweets_in_range_pages(self, username, userid, from_timestamp, to_timestamp, source=None,
+                                         start_cursor=None, include_replies=True):
+        self.calls += 1
+        timestamps = [ts for ts in self.timestamps if from_timestamp <= ts < to_timestamp]
+        page_index = int(start_cursor) if start_cursor else 0
+        while True:
+            page = timestamps[page_index * 2:page_index * 2 + 2]
+            page_index += 1
+            next_cursor = str(page_index) if page_index * 2 < len(timestamps) else None
+            yield [ScrapedTweet(str(ts), "", ts, False) for ts in page], next_cursor, "nitter"
+            if not next_cursor:
+                return
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    from_ts, to_ts = 1640995200, 1640995200 + 3 * 86400
+    profile = TwitterProfile(id=1, username="possumeveryhour", userid="123456", joined_date="2020-01-01")
+    repository = FakeRepository(profile)
+    router = FakeRouter(from_ts, to_ts)
+    enqueued_jobs = list()
+
+    async def enqueue_fetchandpersist_jobs(*jobs):
+        enqueued_jobs.extend(jobs)
+        return 0
+
+    settings = types.SimpleNamespace(jobs=JobsSettings(split_pages_threshold=2, rss_max_age=None))
+    monkeypatch.setattr(MainSettings, "_instance", settings, raising=False)
+    monkeypatch.setattr(fetchandpersist, "Repository", types.SimpleNamespace(get=lambda: repository))
+    monkeypatch.setattr(twitterscraper.controllers.jobs, "Repository", types.SimpleNamespace(get=lambda: repository))
+    monkeypatch.setattr(fetchandpersist, "TwitterTimelineRouter", types.SimpleNamespace(get=lambda: router))
+    monkeypatch.setattr(fetchandpersist, "enqueue_fetchandpersist_jobs", enqueue_fetchandpersist_jobs)
+
+    job = FetchPersistJob(job_id=get_uuid(), userid="123456", from_timestamp=from_ts, to_timestamp=to_ts)
+    repository.jobs[job.job_id] = JobHistoric(job_id=job.job_id, data=dict(), timestamp_created=1)
+    return types.SimpleNamespace(job=job, repository=repository, router=router, enqueued_jobs=enqueued_jobs)
+
+
+def test_retry_split_job_does_not_split_again(fakes, monkeypatch):
+    finalized_calls = list()
+    set_job_finalized = twitterscraper.controllers.jobs.set_job_finalized
+
+    async def set_job_finalized_failing_once(job_id: str):
+        finalized_calls.append(job_id)
+        if len(finalized_calls) == 1:
+            raise ConnectionError("Job failed after splitting")
+        await set_job_finalized(job_id)
+
+    monkeypatch.setattr(twitterscraper.controllers.jobs, "set_job_finalized", set_job_finalized_failing_once)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(fetchandpersist._fetchandpersist_job(fakes.job))
+    split_jobs = list(fakes.enqueued_jobs)
+    assert split_jobs
+    assert fakes.router.calls == 1
+
+    # the retried job does not resume the scroll nor enqueue the split jobs again
+    asyncio.run(fetchandpersist._fetchandpersist_job(fakes.job))
+    assert fakes.enqueued_jobs == split_jobs
+    assert fakes.router.calls == 1
+    assert fakes.repository.jobs[fakes.job.job_id].timestamp_finalized is not None
+
+
+def test_split_by_page_density(fakes):
+    # 2 pages (of 2 hours each) fetched before splitting; the rest is split in ranges of 1 page (half the threshold)
+    asyncio.run(fetchandpersist._fetchandpersist_job(fakes.job))
+    split_ranges = [(job.from_timestamp, job.to_timestamp) for job in fakes.enqueued_jobs]
+    split_to_ts = fakes.job.to_timestamp - 4 * 3600 + 60
+    assert split_ranges[0][0] == fakes.job.from_timestamp
+    assert split_ranges[-1][1] == split_to_ts
+    assert all(prev[1] == current[0] for prev, current in zip(split_ranges, split_ranges[1:]))
+    assert all(to_ts - from_ts <= 2 * 3600 for from_ts, to_ts in split_ranges)
+    assert fakes.repository.coverage == [(split_to_ts, fakes.job.to_timestamp)]
+
+
+def test_split_ranges_sparse():
+    # 10 pages fetched in 20 days: the rest of the range is split in ranges of 5 pages (10 days), split again if needed
+    day = 86400
+    assert fetchandpersist._get_split_ranges(0, 25 * day, 20 * day, 10, 10) == [(0, 10 * day), (10 * day, 20 * day),
+                                                                                 (20 * day, 25 * day)]
+    # ranges are at least an hour long
+    assert fetchandpersist._get_split_ranges(0, 3 * 3600, 60, 10, 10) == [(0, 3600), (3600, 7200), (7200, 10800)]
+
+
+def test_split_ranges_job_range_completed_once(fakes):
+    job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456",
+                                ranges=[(fakes.job.from_timestamp, fakes.job.to_timestamp)])
+    fakes.repository.jobs[job.job_id] = JobHistoric(job_id=job.job_id, data=dict(), timestamp_created=1)
+
+    asyncio.run(fetchandpersist._fetchandpersist_job(job))
+    assert fakes.enqueued_jobs
+    progress = fakes.repository.jobs[job.job_id].progress
+    assert progress["completed_ranges"] == [[fakes.job.from_timestamp, fakes.job.to_timestamp]]
@@ -0,0 +1,117 @@
+import msgpack
+import pytest
+import pydantic
+
+from twitterscraper.models import (
+    BaseJob, FetchPersistJob, PersistedReviewJob, FetchPersistRangesJob, PersistedReviewRangesJob,
+    JobPriority, JobEncoding, encode_job, decode_job
+)
+from twitterscraper.utils import get_uuid
+
+
+def _get_jobs():
+    return [
+        FetchPersistJob(job_id=get_uuid(), userid="123456", from_timestamp=1640995200, to_timestamp=1641081600),
+        PersistedReviewJob(job_id=get_uuid(), userid="123456", from_timestamp=1640995200, to_timestamp=1641081600),
+        FetchPersistJob(job_id="not-an-uuid", userid="123456", from_timestamp=1640995200, to_timestamp=1641081600),
+        FetchPersistRangesJob(
+            job_id=get_uuid(), userid="123456", ranges=[(1640995200, 1641081600), (1641081600, 1641168000)]
+        ),
+        PersistedReviewRangesJob(job_id=get_uuid(), userid="123456", ranges=[(1640995200, 1641081600)]),
+        FetchPersistJob(
+            job_id=get_uuid(), userid="123456", from_timestamp=1, to_timestamp=2, priority=JobPriority.HIGH
+        ),
+    ]
+
+
+@pytest.mark.parametrize("job", _get_jobs())
+@pytest.mark.parametrize("encoding", [JobEncoding.MSGPACK, JobEncoding.JSON])
+def test_encode_decode_job(job: BaseJob, encoding: str):
+    payload = encode_job(job, encoding)
+    decoded_job = decode_job(payload, job.__class__)
+    assert decoded_job.__class__ is job.__class__
+    assert decoded_job == job
+
+
+@pytest.mark.parametrize("job", _get_jobs())
+def test_decode_job_legacy_json(job: BaseJob):
+    payload = job.json()
+    assert decode_job(payload.encode("utf-8")) == job
+
+
+def test_encode_job_msgpack_smaller_than_json():
+    job = _get_jobs()[0]
+    assert len(encode_job(job, JobEncoding.MSGPACK)) < len(encode_job(job, JobEncoding.JSON)) / 2
+
+
+def test_decode_job_unexpected_class():
+    job = _get_jobs()[0]
+    with pytest.raises(ValueError):
+        decode_job(encode_job(job), PersistedReviewJob)
+
+
+def test_ranges_job_get_ranges():
+    job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456", ranges=[[1, 2], [3, 4]])
+    assert job.get_ranges() == [(1, 2), (3, 4)]
+    job = FetchPersistJob(job_id=get_uuid(), userid="123456", from_timestamp=1, to_timestamp=2)
+    assert job.get_ranges() == [(1, 2)]
+
+
+def test_decode_ranges_job_msgpack_without_validation(monkeypatch):
+    job = _get_jobs()[3]
+    payload = encode_job(job)
+
+    def validate(*args, **kwargs):
+        raise AssertionError("Job validated")
+
+    monkeypatch.setattr(FetchPersistRangesJob, "__init__", validate)
+    decoded_job = decode_job(payload, FetchPersistRangesJob)
+    assert decoded_job == job
+    assert decoded_job.ranges == [(1640995200, 1641081600), (1641081600, 1641168000)]
+
+
+@pytest.mark.parametrize("ranges", [[[1, "2"]], [[1.0, 2]]])
+def test_decode_ranges_job_msgpack_validated(ranges):
+    # values not of the exact type are validated (coerced) by pydantic
+    payload = msgpack.packb(["FetchAndPersistRanges", 2, "job1", "normal", "123456", ranges])
+    job = decode_job(payload)
+    assert job.ranges == [(1, 2)]
+    assert all(type(value) is int for value in job.ranges[0])
+
+
+def test_decode_ranges_job_msgpack_invalid():
+    payload = msgpack.packb(["FetchAndPersistRanges", 2, "job1", "normal", "123456", [[1, 2], [3]]])
+    with pytest.raises(pydantic.ValidationError):
+        decode_job(payload)
+
+
+def test_decode_ranges_job_msgpack_version1_rejected():
+    payload = msgpack.packb(["FetchAndPersistRanges", 1, "job1", "123456", [[1, 2]]])
+    with pytest.raises(ValueError, match="Unknown job type"):
+        decode_job(payload)
+
+
+def test_decode_job_msgpack_version1():
+    payload = msgpack.packb(["FetchAndPersist", 1, "job1", "123456", 1640995200, 1641081600])
+    job = decode_job(payload, FetchPersistJob)
+    assert job.job_version == 1
+    assert job.priority == JobPriority.NORMAL
+    assert (job.job_id, job.userid, job.from_timestamp, job.to_timestamp) == ("job1", "123456", 1640995200, 1641081600)
+
+
+def test_job_idempotency_keys():
+    job = FetchPersistJob(job_id=get_uuid(), userid="123456", from_timestamp=1, to_timestamp=2)
+    same_job = FetchPersistJob(
+        job_id=get_uuid(), userid="123456", from_timestamp=1, to_timestamp=2, priority=JobPriority.HIGH
+    )
+    other_range_job = FetchPersistJob(job_id=get_uuid(), userid="123456", from_timestamp=1, to_timestamp=3)
+    other_type_job = PersistedReviewJob(job_id=get_uuid(), userid="123456", from_timestamp=1, to_timestamp=2)
+    assert job.get_idempotency_keys() == same_job.get_idempotency_keys()
+    assert list(job.get_idempotency_keys()) == [(1, 2)]
+    assert job.get_idempotency_keys()[(1, 2)] != other_range_job.get_idempotency_keys()[(1, 3)]
+    assert job.get_idempotency_keys()[(1, 2)] != other_type_job.get_idempotency_keys()[(1, 2)]
+
+    # each range has the same key as a single range job of the same work
+    ranges_job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456", ranges=[(3, 4), (1, 2)])
+    assert ranges_job.get_idempotency_keys()[(1, 2)] == job.get_idempotency_keys()[(1, 2)]
+    assert len(set(ranges_job.get_idempotency_keys().values())) == 2
\ No newline at end of file
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import types
+from typing import *
+
+import pytest
+import sqlalchemy.exc
+
+import twitterscraper.controllers.jobs
+from twitterscraper.controllers.jobs import filter_duplicated_jobs, enqueue_jobs
+from twitterscraper.models import FetchPersistJob, FetchPersistRangesJob, PersistedReviewJob, JobHistoric, \
+    JobHistoricKey
+from twitterscraper.services import AMQPPublishError
+from twitterscraper.settings import MainSettings, JobsSettings
+from twitterscraper.utils import get_uuid, get_timestamp
+
+
+class FakeSession:
+    def commit(self):
+        pass
+
+
+class FakeRepository:
+    """Persisted jobs keys, as {key: (pending, timestamp_created, timestamp_finalized)}, and the jobs of each key"""
+
+    def __init__(self):
+        self.keys: Dict[str, Tuple[bool, int, Optional[int]]] = dict()
+        self.keys_jobs: Dict[str, str] = dict()
+        self.jobs_ids: List[str] = list()
+        self.concurrent_jobs: List[FetchPersistJob] = list()
+        """Jobs saved by another worker, after filtering and before saving the next jobs"""
+
+    @contextlib.asynccontextmanager
+    async def session_async(self):
+        yield FakeSession()
+
+    @contextlib.asynccontextmanager
+    async def savepoint_async(self):
+        for job in self.concurrent_jobs:
+            self.add_job(job)
+        self.concurrent_jobs = list()
+
+        saved = dict(self.keys), dict(self.keys_jobs), list(self.jobs_ids)
+        try:
+            yield FakeSession()
+        except Exception as ex:
+            self.keys, self.keys_jobs, self.jobs_ids = saved
+            raise ex
+
+    async def release_jobs_keys(self, idempotency_keys, created_before):
+        for key in idempotency_keys:
+            pending, created, finalized = self.keys.get(key, (False, 0, None))
+            if pending and created < created_before:
+                self.keys[key] = (False, created, finalized)
+
+    async def release_jobs_keys_of_jobs(self, job_ids):
+        for key, job_id in self.keys_jobs.items():
+            if job_id in job_ids:
+                self.keys[key] = (False, *self.keys[key][1:])
+
+    async def save_object_async(self, *objs, flush: bool = False):
+        for obj in objs:
+            if isinstance(obj, JobHistoric):
+                self.jobs_ids.append(obj.job_id)
+            elif isinstance(obj, JobHistoricKey):
+                if self.keys.get(obj.idempotency_key, (False,))[0]:
+                    raise sqlalchemy.exc.IntegrityError("INSERT", {}, Exception("Duplicated pending key"))
+                self.keys[obj.idempotency_key] = (True, obj.timestamp_created, None)
+                self.keys_jobs[obj.idempotency_key] = obj.job_id
+
+    async def get_jobs_keys_duplicated(self, idempotency_keys, pending_created_after, finalized_after):
+        return {
+            key for key in idempotency_keys if key in self.keys and (
+                (self.keys[key][0] and self.keys[key][1] >= pending_created_after) or
+                (self.keys[key][2] or 0) >= finalized_after
+            )
+        }
+
+    def add_job(self, job, pending: bool = True, created_ago: int = 0, finalized_ago: Optional[int] = None):
+        now = get_timestamp()
+        for key in job.get_idempotency_keys().values():
+            self.keys[key] = (pending, now - created_ago, now - finalized_ago if finalized_ago is not None else None)
+            self.keys_jobs[key] = job.job_id
+
+
+class FakeAMQPClient:
+    def __init__(self, unconfirmed_indexes: Optional[List[int]] = None):
+        self.unconfirmed_indexes = unconfirmed_indexes
+        self.payloads = list()
+
+    async def enqueue(self, payloads, **kwargs):
+        self.payloads.extend(payloads)
+        if self.unconfirmed_indexes:
+            raise AMQPPublishError(len(self.unconfirmed_indexes), len(payloads), self.unconfirmed_indexes)
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = FakeRepository()
+    settings = types.SimpleNamespace(
+        jobs=JobsSettings(dedup_pending_window=86400, dedup_finished_window=3600),
+        amqp=types.SimpleNamespace(jobs_encoding="msgpack")
+    )
+    monkeypatch.setattr(MainSettings, "_instance", settings, raising=False)
+    monkeypatch.setattr(twitterscraper.controllers.jobs, "Repository", types.SimpleNamespace(get=lambda: repository))
+    return repository
+
+
+def _fetch_job(from_ts: int, to_ts: int) -> FetchPersistJob:
+    return FetchPersistJob(job_id=get_uuid(), userid="123456", from_timestamp=from_ts, to_timestamp=to_ts)
+
+
+@pytest.mark.parametrize("persisted_kwargs, expected_skipped", [
+    # pending
+    (dict(), True),
+    # pending, but created before the pending window (lost)
+    (dict(created_ago=90000), False),
+    # finalized recently
+    (dict(pending=False, created_ago=90000, finalized_ago=60), True),
+    # finalized before the finished window
+    (dict(pending=False, created_ago=90000, finalized_ago=7200), False),
+])
+def test_filter_duplicated_jobs(repository, persisted_kwargs, expected_skipped):
+    repository.add_job(_fetch_job(100, 200), **persisted_kwargs)
+    job = _fetch_job(100, 200)
+
+    jobs, skipped_count = asyncio.run(filter_duplicated_jobs(job))
+    assert jobs == ([] if expected_skipped else [job])
+    assert skipped_count == (1 if expected_skipped else 0)
+
+
+def test_filter_duplicated_jobs_ranges(repository):
+    # day ranges pending on single range jobs are removed from a ranges job
+    repository.add_job(_fetch_job(200, 300))
+    repository.add_job(_fetch_job(400, 500))
+    job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456", ranges=[(100, 200), (200, 300), (300, 400),
+                                                                            (400, 500)])
+    fully_duplicated_job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456", ranges=[(200, 300), (400, 500)])
+
+    jobs, skipped_count = asyncio.run(filter_duplicated_jobs(job, fully_duplicated_job))
+    assert skipped_count == 4
+    assert len(jobs) == 1
+    assert (jobs[0].job_id, jobs[0].ranges) == (job.job_id, [(100, 200), (300, 400)])
+
+
+def test_filter_duplicated_jobs_repeated(repository):
+    job = _fetch_job(100, 200)
+    ranges_job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456", ranges=[(100, 200), (200, 300)])
+    # other work on the same range is not a duplicate
+    review_job = PersistedReviewJob(job_id=get_uuid(), userid="123456", from_timestamp=100, to_timestamp=200)
+
+    jobs, skipped_count = asyncio.run(filter_duplicated_jobs(job, _fetch_job(100, 200), ranges_job, review_job))
+    assert skipped_count == 2
+    assert [j.job_id for j in jobs] == [job.job_id, ranges_job.job_id, review_job.job_id]
+    assert jobs[1].ranges == [(200, 300)]
+
+
+def _enqueue(amqp_client: FakeAMQPClient, monkeypatch, *jobs) -> int:
+    monkeypatch.setattr(twitterscraper.controllers.jobs, "AMQPClient", types.SimpleNamespace(get=lambda: amqp_client))
+    return asyncio.run(enqueue_jobs(*jobs, exchange="", routingkey="fetchpersist", persistent=True))
+
+
+def test_enqueue_jobs_unpublished_released(repository, monkeypatch):
+    jobs = [_fetch_job(100, 200), _fetch_job(200, 300)]
+    with pytest.raises(AMQPPublishError):
+        _enqueue(FakeAMQPClient(unconfirmed_indexes=[1]), monkeypatch, *jobs)
+
+    assert repository.jobs_ids == [job.job_id for job in jobs]
+    # the range of the unpublished job can be enqueued again
+    amqp_client = FakeAMQPClient()
+    assert _enqueue(amqp_client, monkeypatch, _fetch_job(100, 200), _fetch_job(200, 300)) == 1
+    assert len(amqp_client.payloads) == 1
+
+
+def test_enqueue_jobs_concurrent_duplicate(repository, monkeypatch):
+    # a range is enqueued by another worker after the jobs were filtered
+    repository.concurrent_jobs = [_fetch_job(200, 300)]
+    job = FetchPersistRangesJob(job_id=get_uuid(), userid="123456", ranges=[(100, 200), (200, 300)])
+    other_job = _fetch_job(300, 400)
+    amqp_client = FakeAMQPClient()
+
+    assert _enqueue(amqp_client, monkeypatch, job, other_job) == 1
+    assert len(amqp_client.payloads) == 2
+    assert repository.jobs_ids == [job.job_id, other_job.job_id]
+    assert repository.keys_jobs[job.get_idempotency_keys()[(100, 200)]] == job.job_id
@@ -0,0 +1,71 @@
+import asyncio
+
+from twitterscraper.services.knowntweets import KnownTweetsFilter
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeLoader:
+    def __init__(self, tweets_ids_by_profile: dict):
+        self.tweets_ids_by_profile = tweets_ids_by_profile
+        self.calls = list()
+
+    async def __call__(self, profile_id: int):
+        self.calls.append(profile_id)
+        return list(self.tweets_ids_by_profile.get(profile_id, []))
+
+
+def test_filter_unknown():
+    loader = FakeLoader({1: ["300", "100", "200"], 2: ["400"]})
+    known_filter = KnownTweetsFilter(loader=loader, clock=FakeClock())
+
+    assert asyncio.run(known_filter.filter_unknown(1, ["100", "150", "300", "400"])) == {"150", "400"}
+    assert asyncio.run(known_filter.filter_unknown(2, ["400"])) == set()
+    assert loader.calls == [1, 2]
+
+    stats = known_filter.stats()
+    assert (stats["lookups"], stats["hits"], stats["hit_rate"]) == (5, 3, 0.6)
+
+
+def test_added_tweets_known():
+    loader = FakeLoader({1: ["100"]})
+    known_filter = KnownTweetsFilter(loader=loader, clock=FakeClock())
+
+    assert asyncio.run(known_filter.filter_unknown(1, ["100", "200"])) == {"200"}
+    known_filter.add(1, ["200"])
+    assert asyncio.run(known_filter.filter_unknown(1, ["100", "200"])) == set()
+    assert loader.calls == [1]
+
+
+def test_reload_after_ttl():
+    clock = FakeClock()
+    loader = FakeLoader({1: ["100"]})
+    known_filter = KnownTweetsFilter(loader=loader, ttl=60, clock=clock)
+
+    assert asyncio.run(known_filter.filter_unknown(1, ["200"])) == {"200"}
+    # persisted by another worker
+    loader.tweets_ids_by_profile[1].append("200")
+    clock.now += 59
+    assert asyncio.run(known_filter.filter_unknown(1, ["200"])) == {"200"}
+    clock.now += 1
+    assert asyncio.run(known_filter.filter_unknown(1, ["200"])) == set()
+    assert loader.calls == [1, 1]
+
+
+def test_least_recently_used_profiles_dropped():
+    loader = FakeLoader({1: ["100"], 2: ["200"], 3: ["300"]})
+    known_filter = KnownTweetsFilter(loader=loader, max_profiles=2, clock=FakeClock())
+
+    for profile_id in (1, 2, 1, 3):
+        asyncio.run(known_filter.filter_unknown(profile_id, []))
+    assert known_filter.stats()["profiles"] == 2
+    # profile 2 was dropped, profile 1 kept
+    asyncio.run(known_filter.filter_unknown(1, []))
+    asyncio.run(known_filter.filter_unknown(2, []))
+    assert loader.calls == [1, 2, 3, 2]
@@ -0,0 +1,76 @@
+import asyncio
+from typing import *
+
+import httpx
+
+from twitterscraper.services.twitter import TwitterNitterClient
+
+_BASEURL = "https://nitter.example.com"
+_FEED = b"<rss><channel></channel></rss>"
+
+
+class FakeNitter:
+    """Mocked transport of a Nitter instance: RSS feeds with an ETag (304 if requested with the same ETag),
+    and tweet pages of the existing tweets (404 "Tweet not found" for the rest)"""
+
+    def __init__(self, existing_ids: Collection[str] = (), etag: str = '"feed-1"'):
+        self.existing_ids = set(existing_ids)
+        self.etag = etag
+        self.requests: List[httpx.Request] = list()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.url.path.endswith("/rss"):
+            if request.headers.get("If-None-Match") == self.etag:
+                return httpx.Response(304, headers={"ETag": self.etag})
+            return httpx.Response(200, content=_FEED, headers={"ETag": self.etag})
+
+        tweet_id = request.url.path.rsplit("/", 1)[-1]
+        if tweet_id in self.existing_ids:
+            return httpx.Response(200, text="<html></html>")
+        return httpx.Response(404, text="Tweet not found")
+
+    def get_client(self) -> TwitterNitterClient:
+        client = TwitterNitterClient([_BASEURL])
+        # noinspection PyProtectedMember
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(self))
+        return client
+
+
+def _run(client: TwitterNitterClient, coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_get_profile_rss_conditional():
+    nitter = FakeNitter()
+    client = nitter.get_client()
+
+    async def poll_twice():
+        first = await client.get_profile_rss("possumeveryhour")
+        second = await client.get_profile_rss("possumeveryhour", baseurl=first[1], etag=first[2].get("ETag"))
+        return first, second
+
+    (body, baseurl, headers), (body_again, _, _) = _run(client, poll_twice())
+    assert body == _FEED and baseurl == _BASEURL and headers["etag"] == nitter.etag
+    # not modified: no body
+    assert body_again is None
+    assert "If-None-Match" not in nitter.requests[0].headers
+    assert nitter.requests[1].headers["If-None-Match"] == nitter.etag
+    # 304 responses do not count as failures on the instance health
+    assert client.stats()[_BASEURL]["failures"] == 0
+
+
+def test_get_tweets_status():
+    nitter = FakeNitter(existing_ids=["1000"])
+    client = nitter.get_client()
+
+    statuses = _run(client, client.get_tweets_status(["1000", "1001"]))
+    assert statuses["1000"].exists and not statuses["1001"].exists
+    assert client.stats()[_BASEURL]["requests"] == 2
+    assert client.stats()[_BASEURL]["failures"] == 0
@@ -0,0 +1,210 @@
+import types
+import asyncio
+from typing import *
+
+import pytest
+
+import twitterscraper.controllers.persistedreview as persistedreview
+from twitterscraper.controllers.persistedreview import _SortedIdsDiff
+from twitterscraper.models import ScrapedTweet, TwitterProfile, TweetsRangeFingerprint
+from twitterscraper.settings import MainSettings, JobsSettings
+from twitterscraper.utils import get_ids_fingerprint
+
+
+async def _iter_ids(ids: List[int]):
+    for tweet_id in ids:
+        yield tweet_id
+
+
+async def _diff(persisted_ids: List[int], online_pages: List[List[str]]) -> Tuple[List[str], List[str]]:
+    diff = _SortedIdsDiff(_iter_ids(persisted_ids))
+    remaining, missing = list(), list()
+    for page in online_pages:
+        async for tweet_id, found_online in diff.iter_page_diff(page):
+            (remaining if found_online else missing).append(tweet_id)
+    async for tweet_id in diff.iter_rest_diff():
+        missing.append(tweet_id)
+    return remaining, missing
+
+
+@pytest.mark.parametrize("persisted_ids, online_pages, expected_remaining, expected_missing", [
+    # all found
+    ([90, 80, 70, 60], [["90", "80"], ["70", "60"]], ["90", "80", "70", "60"], []),
+    # missing between pages, and older than all the pages
+    ([90, 85, 80, 70, 50], [["90", "80"], ["70"]], ["90", "80", "70"], ["85", "50"]),
+    # online tweets not persisted are ignored
+    ([80, 70], [["95", "80"], ["75", "70"]], ["80", "70"], []),
+    # nothing online
+    ([80, 70], [], [], ["80", "70"]),
+    # a tweet newer than the previous page watermark is given as missing (false positive, to be double-checked)
+    ([90, 80, 70], [["90", "70"], ["80"]], ["90", "70"], ["80"]),
+    # ids of different length compared numerically
+    ([1000, 999], [["1000", "999"]], ["1000", "999"], []),
+])
+def test_sorted_ids_diff(persisted_ids, online_pages, expected_remaining, expected_missing):
+    remaining, missing = asyncio.run(_diff(persisted_ids, online_pages))
+    assert remaining == expected_remaining
+    assert missing == expected_missing
+
+
+class FakeRepository:
+    """Persisted tweets of a single profile, as {tweet id: deleted}, and the fingerprint of its range"""
+
+    def __init__(self, tweets_ids: List[str]):
+        self.tweets: Dict[str, bool] = {tweet_id: False for tweet_id in tweets_ids}
+        self.fingerprint: Optional[TweetsRangeFingerprint] = None
+        self.reviewed_calls = 0
+        self.ids_pages_count = 0
+        self.reviewed_ids: List[str] = list()
+        self.deleted_ids: List[str] = list()
+
+    def get_active_ids(self) -> List[str]:
+        return [tweet_id for tweet_id, deleted in self.tweets.items() if not deleted]
+
+    async def get_tweets_range_fingerprint(self, profile_id, from_timestamp, to_timestamp):
+        return self.fingerprint
+
+    async def get_active_tweets_ids(self, profile_id, from_timestamp, to_timestamp):
+        return self.get_active_ids()
+
+    async def set_tweets_reviewed(self, profile_id, from_timestamp, to_timestamp, timestamp):
+        self.reviewed_calls += 1
+
+    async def save_object_async(self, *objs, flush: bool = False):
+        self.fingerprint, = objs
+
+    async def get_tweets_ids_page(self, profile_id, from_timestamp, to_timestamp, limit, before_tweet_id=None):
+        self.ids_pages_count += 1
+        tweets_ids = sorted(self.get_active_ids(), key=lambda tweet_id: (len(tweet_id), tweet_id), reverse=True)
+        if before_tweet_id is not None:
+            before_key = (len(before_tweet_id), before_tweet_id)
+            tweets_ids = [tweet_id for tweet_id in tweets_ids if (len(tweet_id), tweet_id) < before_key]
+        return tweets_ids[:limit]
+
+    async def set_tweets_timestamps(self, tweets_ids, last_review_timestamp, deletion_detected_timestamp=None):
+        if deletion_detected_timestamp is None:
+            self.reviewed_ids.extend(tweets_ids)
+            return
+        for tweet_id in tweets_ids:
+            self.tweets[tweet_id] = True
+            self.deleted_ids.append(tweet_id)
+
+
+class FakeRouter:
+    def __init__(self, pages: List[List[str]]):
+        self.pages = pages
+        self.sources: Optional[List[str]] = None
+        """Source of each page (nitter if not set)"""
+        self.fetched_pages_count = 0
+
+    async def iter_tweets_in_range_pages(self, username, userid, from_timestamp, to_timestamp, include_replies=True):
+        for i, page in enumerate(self.pages):
+            self.fetched_pages_count += 1
+            source = self.sources[i] if self.sources else "nitter"
+            yield [ScrapedTweet(tweet_id, "", 1, False) for tweet_id in page], None, source
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    repository = FakeRepository(["90", "80", "70", "60", "50"])
+    router = FakeRouter([["90", "80"], ["70", "60"], ["50"]])
+
+    async def verify_removed_tweets(tweets_ids):
+        return set(tweets_ids)
+
+    settings = types.SimpleNamespace(jobs=JobsSettings(review_streaming=True, review_streaming_batch_size=2))
+    monkeypatch.setattr(MainSettings, "_instance", settings, raising=False)
+    monkeypatch.setattr(persistedreview, "Repository", types.SimpleNamespace(get=lambda: repository))
+    monkeypatch.setattr(persistedreview, "TwitterTimelineRouter", types.SimpleNamespace(get=lambda: router))
+    monkeypatch.setattr(persistedreview, "verify_removed_tweets", verify_removed_tweets)
+    profile = TwitterProfile(id=1, username="possumeveryhour", userid="123456", joined_date="2020-01-01")
+    return types.SimpleNamespace(repository=repository, router=router, profile=profile)
+
+
+def _review(fakes):
+    fakes.router.fetched_pages_count = 0
+    asyncio.run(persistedreview._persistedreview_range(fakes.profile, 0, 86400))
+
+
+def test_review_fingerprint(fakes):
+    _review(fakes)
+    assert fakes.router.fetched_pages_count == 3
+    assert fakes.repository.fingerprint.persisted_fingerprint == get_ids_fingerprint(["90", "80", "70", "60", "50"])
+
+    # nothing changed: all the pages compared, without loading the persisted tweets
+    ids_pages_count = fakes.repository.ids_pages_count
+    _review(fakes)
+    assert fakes.router.fetched_pages_count == 3
+    assert fakes.repository.reviewed_calls == 1
+    assert fakes.repository.ids_pages_count == ids_pages_count
+
+    # a persisted tweet changed (deleted by another review): full review
+    fakes.repository.tweets["60"] = True
+    _review(fakes)
+    assert fakes.router.fetched_pages_count == 3
+    assert fakes.repository.reviewed_calls == 1
+    assert fakes.repository.fingerprint.persisted_fingerprint == get_ids_fingerprint(["90", "80", "70", "50"])
+
+
+def test_review_fingerprint_deleted_after_first_page(fakes):
+    fakes.router.pages = [["90", "80"], ["70", "60", "50"]]
+    _review(fakes)
+    assert fakes.repository.fingerprint.pages_hashes == [
+        get_ids_fingerprint(["90", "80"]), get_ids_fingerprint(["70", "60", "50"])
+    ]
+
+    # first page and persisted tweets unchanged, tweet deleted from the second page
+    fakes.router.pages = [["90", "80"], ["70", "50"]]
+    _review(fakes)
+    assert fakes.router.fetched_pages_count == 2
+    assert fakes.repository.reviewed_calls == 0
+    assert fakes.repository.deleted_ids == ["60"]
+    assert fakes.repository.fingerprint.pages_hashes[1] == get_ids_fingerprint(["70", "50"])
+    assert fakes.repository.fingerprint.persisted_fingerprint == get_ids_fingerprint(["90", "80", "70", "50"])
+
+
+def test_streaming_review_pages(fakes, monkeypatch):
+    # more than one page of persisted ids, and of online tweets; ids of different length and a non-numeric id
+    fakes.repository.tweets = {tweet_id: False for tweet_id in ["1200", "1100", "999", "950", "900", "850", "abc"]}
+    # 950 and 850 missing online, 999 on a later page than expected (false positive, not deleted when double-checked)
+    fakes.router.pages = [["1300", "1200", "1100"], ["900"], ["999", "800"]]
+    verified_ids = list()
+
+    async def verify_removed_tweets(tweets_ids):
+        verified_ids.extend(tweets_ids)
+        return set(tweets_ids) - {"999"}
+
+    monkeypatch.setattr(persistedreview, "verify_removed_tweets", verify_removed_tweets)
+    _review(fakes)
+    assert fakes.repository.ids_pages_count == 4
+    assert sorted(verified_ids) == ["850", "950", "999"]
+    assert sorted(fakes.repository.deleted_ids) == ["850", "950"]
+    assert sorted(fakes.repository.reviewed_ids) == ["1100", "1200", "900", "999"]
+    assert fakes.repository.fingerprint.persisted_fingerprint == get_ids_fingerprint(["1200", "1100", "999", "900"])
+
+
+def test_streaming_review_source_fallback(fakes):
+    tweets_ids = ["90", "85", "80", "70", "60", "50"]
+    fakes.repository.tweets = {tweet_id: False for tweet_id in tweets_ids}
+    # nitter fails after its first page (85 missing from it), and the api pages restart from the newest tweet
+    fakes.router.pages = [["90", "80"], ["90", "85", "80"], ["70", "60"], ["50"]]
+    fakes.router.sources = ["nitter", "api", "api", "api"]
+    _review(fakes)
+    assert fakes.repository.deleted_ids == []
+    assert sorted(fakes.repository.reviewed_ids) == sorted(tweets_ids)
+    assert fakes.repository.fingerprint.persisted_fingerprint == get_ids_fingerprint(tweets_ids)
+
+
+def test_review_fingerprint_source_fallback(fakes):
+    api_pages = [["90", "80"], ["70", "60"], ["50"]]
+    fakes.router.pages = [["90", "80"], *api_pages]
+    fakes.router.sources = ["nitter", "api", "api", "api"]
+    _review(fakes)
+    assert fakes.repository.fingerprint.source == "api"
+    assert fakes.repository.fingerprint.pages_hashes == [get_ids_fingerprint(page) for page in api_pages]
+
+    # the pages of the api match the fingerprint
+    fakes.router.pages = api_pages
+    fakes.router.sources = ["api", "api", "api"]
+    _review(fakes)
+    assert fakes.repository.reviewed_calls == 1
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from twitterscraper.services.ratelimit import RateLimitScheduler
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _headers(limit: int, remaining: int, reset: int):
+    return {
+        "x-rate-limit-limit": str(limit),
+        "x-rate-limit-remaining": str(remaining),
+        "x-rate-limit-reset": str(reset)
+    }
+
+
+async def _request(scheduler: RateLimitScheduler, endpoint: str, headers: dict, status_code: int = 200):
+    async with scheduler.acquire(endpoint):
+        scheduler.update(endpoint, headers, status_code)
+
+
+def test_unknown_quota_no_delay():
+    scheduler = RateLimitScheduler(clock=FakeClock())
+    assert scheduler.get_delay("/2/users") == 0
+
+
+def test_no_pacing_with_plenty_quota():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(pacing_ratio=0.5, clock=clock)
+    asyncio.run(_request(scheduler, "/2/users", _headers(limit=300, remaining=250, reset=1900)))
+    assert scheduler.get_delay("/2/users") == 0
+
+
+def test_pacing_below_ratio():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(pacing_ratio=0.5, clock=clock)
+    asyncio.run(_request(scheduler, "/2/users", _headers(limit=300, remaining=100, reset=1900)))
+    # 900 seconds until reset, 100 requests remaining: one request each 9 seconds
+    assert scheduler.get_delay("/2/users") == pytest.approx(9)
+    clock.now += 9
+    assert scheduler.get_delay("/2/users") == 0
+
+
+def test_quota_exhausted_waits_reset():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(clock=clock)
+    asyncio.run(_request(scheduler, "/2/users", _headers(limit=300, remaining=0, reset=1600)))
+    assert scheduler.get_delay("/2/users") == 600
+    # other endpoints have their own quota
+    assert scheduler.get_delay("/2/tweets") == 0
+
+    clock.now = 1600
+    assert scheduler.get_delay("/2/users") == 0
+    assert scheduler.stats()["/2/users"]["remaining"] is None
+
+
+def test_rate_limited_response_without_headers():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(default_reset_seconds=60, clock=clock)
+    asyncio.run(_request(scheduler, "/2/users", {}, status_code=429))
+    assert scheduler.get_delay("/2/users") == 60
+
+
+def test_stats():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(clock=clock)
+    asyncio.run(_request(scheduler, "/2/users", _headers(limit=300, remaining=299, reset=1900)))
+    assert scheduler.stats() == {
+        "/2/users": dict(limit=300, remaining=299, reset=1900, inflight=0, waiting=0, throttled=0)
+    }
@@ -0,0 +1,72 @@
+import datetime
+from typing import *
+
+import pytest
+import pydantic
+
+from twitterscraper.settings import TasksSettings, WatchSettings
+
+
+class TaskNextRunScenario(pydantic.BaseModel):
+    task: TasksSettings.Task
+    now: datetime.datetime
+    last_run_start: Optional[datetime.datetime]
+    expected_next_run: Optional[datetime.datetime]
+
+
+# noinspection PyTypeChecker
+@pytest.mark.parametrize("scenario", [
+    TaskNextRunScenario(
+        task=dict(period="30m"),
+        now="2022-01-01T10:00:00+00:00",
+        last_run_start=None,
+        expected_next_run="2022-01-01T10:00:00+00:00"
+    ),
+    TaskNextRunScenario(
+        task=dict(period="30m", period_start_now=False),
+        now="2022-01-01T10:00:00+00:00",
+        last_run_start=None,
+        expected_next_run="2022-01-01T10:30:00+00:00"
+    ),
+    TaskNextRunScenario(
+        task=dict(period="1h"),
+        now="2022-01-01T10:10:00+00:00",
+        last_run_start="2022-01-01T10:00:00+00:00",
+        expected_next_run="2022-01-01T11:00:00+00:00"
+    ),
+    TaskNextRunScenario(
+        task=dict(period="1h"),
+        now="2022-01-01T11:20:00+00:00",
+        last_run_start="2022-01-01T10:00:00+00:00",
+        expected_next_run="2022-01-01T11:20:00+00:00"
+    ),
+    TaskNextRunScenario(
+        task=dict(daily_times="03:00, 15:00"),
+        now="2022-01-01T10:00:00+00:00",
+        last_run_start=None,
+        expected_next_run="2022-01-01T15:00:00+00:00"
+    ),
+    TaskNextRunScenario(
+        task=dict(daily_times="03:00, 15:00"),
+        now="2022-01-01T15:00:00+00:00",
+        last_run_start="2022-01-01T15:00:00+00:00",
+        expected_next_run="2022-01-02T03:00:00+00:00"
+    ),
+    TaskNextRunScenario(
+        task=dict(),
+        now="2022-01-01T10:00:00+00:00",
+        last_run_start=None,
+        expected_next_run=None
+    ),
+])
+def test_task_get_next_run(scenario: TaskNextRunScenario):
+    next_run = scenario.task.get_next_run(now=scenario.now, last_run_start=scenario.last_run_start)
+    assert next_run == scenario.expected_next_run
+
+
+def test_watch_settings_parse():
+    settings = WatchSettings(profiles="user1, user2", interval="90s", window="6h")
+    assert settings.profiles == ["user1", "user2"]
+    assert settings.interval == datetime.timedelta(seconds=90)
+    assert settings.window == datetime.timedelta(hours=6)
+    assert settings.recheck_interval == datetime.timedelta(minutes=30)
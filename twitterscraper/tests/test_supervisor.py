@@ -0,0 +1,35 @@
+import types
+
+import pytest
+
+from twitterscraper.controllers.supervisor import _WorkerProcess, _on_worker_exited
+from twitterscraper.settings import SupervisorSettings
+
+
+def _exited_worker(exitcode: int) -> _WorkerProcess:
+    worker = _WorkerProcess(index=0)
+    worker.process = types.SimpleNamespace(exitcode=exitcode, is_alive=lambda: False)
+    worker.start_time = 1000
+    return worker
+
+
+def test_clean_exit_not_restarted():
+    worker = _exited_worker(0)
+    _on_worker_exited("Test", worker, SupervisorSettings(), now=1010)
+    assert worker.finished
+    assert worker.process is None
+    assert worker.restarts_count == 0
+
+
+@pytest.mark.parametrize("exitcode", [1, -9, -15])
+def test_crash_restarted_with_backoff(exitcode):
+    settings = SupervisorSettings(restart_delay=1, restart_delay_max=60, restart_reset_after=60)
+    worker = _exited_worker(exitcode)
+    _on_worker_exited("Test", worker, settings, now=1010)
+    assert not worker.finished
+    assert (worker.restarts_count, worker.next_start_time) == (1, 1011)
+
+    # crashed again soon after restarting: the delay doubles
+    worker.process, worker.start_time = _exited_worker(exitcode).process, 1011
+    _on_worker_exited("Test", worker, settings, now=1012)
+    assert (worker.restarts_count, worker.next_start_time) == (2, 1014)
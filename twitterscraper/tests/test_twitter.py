@@ -4,7 +4,7 @@ import datetimerange
 import pytest
 
 from twitterscraper.services import TwitterAPIClient, TwitterNitterClient
-from twitterscraper.models import TwitterTweet
+from twitterscraper.models import ScrapedTweet
 from twitterscraper.settings import load_settings
 from twitterscraper.utils import datetime_to_timestamp, timestamp_to_datetime
 from .base import BaseTest
@@ -38,69 +38,69 @@ class TestNitter(BaseTwitterTest):
         expected_tweets_datetimes = list(
             datetimerange.DateTimeRange(from_datetime, to_datetime).range(datetime.timedelta(hours=1)))
         expected_tweets = [
-            TwitterTweet(tweet_id='1477067061964775424', text='', timestamp=1640995200, is_reply=False),
-            TwitterTweet(tweet_id='1477082160490242053', text='', timestamp=1640998800, is_reply=False),
-            TwitterTweet(tweet_id='1477097253261217796', text='', timestamp=1641002400, is_reply=False),
-            TwitterTweet(tweet_id='1477112354328489988', text='', timestamp=1641006000, is_reply=False),
-            TwitterTweet(tweet_id='1477127454141652996', text='', timestamp=1641009600, is_reply=False),
-            TwitterTweet(tweet_id='1477142551849320449', text='', timestamp=1641013200, is_reply=False),
-            TwitterTweet(tweet_id='1477157652945936397', text='', timestamp=1641016800, is_reply=False),
-            TwitterTweet(tweet_id='1477172751299493888', text='', timestamp=1641020400, is_reply=False),
-            TwitterTweet(tweet_id='1477187850777108481', text='', timestamp=1641024000, is_reply=False),
-            TwitterTweet(tweet_id='1477202950120517637', text='', timestamp=1641027600, is_reply=False),
-            TwitterTweet(tweet_id='1477218051787530244', text='', timestamp=1641031200, is_reply=False),
-            TwitterTweet(tweet_id='1477233147817381891', text='', timestamp=1641034800, is_reply=False),
-            TwitterTweet(tweet_id='1477248250797305860', text='', timestamp=1641038400, is_reply=False),
-            TwitterTweet(tweet_id='1477263348748230659', text='', timestamp=1641042000, is_reply=False),
-            TwitterTweet(tweet_id='1477278448691425281', text='', timestamp=1641045600, is_reply=False),
-            TwitterTweet(tweet_id='1477293548722692097', text='', timestamp=1641049200, is_reply=False),
-            TwitterTweet(tweet_id='1477308646719639553', text='', timestamp=1641052800, is_reply=False),
-            TwitterTweet(tweet_id='1477323746310594568', text='', timestamp=1641056400, is_reply=False),
-            TwitterTweet(tweet_id='1477338848011116547', text='', timestamp=1641060000, is_reply=False),
-            TwitterTweet(tweet_id='1477353947820089345', text='', timestamp=1641063600, is_reply=False),
-            TwitterTweet(tweet_id='1477369046018445318', text='', timestamp=1641067200, is_reply=False),
-            TwitterTweet(tweet_id='1477384142929240069', text='', timestamp=1641070800, is_reply=False),
-            TwitterTweet(tweet_id='1477399249860112386', text='', timestamp=1641074400, is_reply=False),
-            TwitterTweet(tweet_id='1477414344195383296', text='', timestamp=1641078000, is_reply=False),
-            TwitterTweet(tweet_id='1477429444126121985', text='', timestamp=1641081600, is_reply=False),
-            TwitterTweet(tweet_id='1477444541120720898', text='', timestamp=1641085200, is_reply=False),
-            TwitterTweet(tweet_id='1477459644067065856', text='', timestamp=1641088800, is_reply=False),
-            TwitterTweet(tweet_id='1477474743129452544', text='', timestamp=1641092400, is_reply=False),
-            TwitterTweet(tweet_id='1477489842829279233', text='', timestamp=1641096000, is_reply=False),
-            TwitterTweet(tweet_id='1477504940163670020', text='', timestamp=1641099600, is_reply=False),
-            TwitterTweet(tweet_id='1477520038349479937', text='', timestamp=1641103200, is_reply=False),
-            TwitterTweet(tweet_id='1477535140813459463', text='', timestamp=1641106800, is_reply=False),
-            TwitterTweet(tweet_id='1477550240848879617', text='', timestamp=1641110400, is_reply=False),
-            TwitterTweet(tweet_id='1477565336883011588', text='', timestamp=1641114000, is_reply=False),
-            TwitterTweet(tweet_id='1477580436813623297', text='', timestamp=1641117600, is_reply=False),
-            TwitterTweet(tweet_id='1477595539059445762', text='', timestamp=1641121200, is_reply=False),
-            TwitterTweet(tweet_id='1477610638113492994', text='', timestamp=1641124800, is_reply=False),
-            TwitterTweet(tweet_id='1477625735468699652', text='', timestamp=1641128400, is_reply=False),
-            TwitterTweet(tweet_id='1477640835374239749', text='', timestamp=1641132000, is_reply=False),
-            TwitterTweet(tweet_id='1477655933237006341', text='', timestamp=1641135600, is_reply=False),
-            TwitterTweet(tweet_id='1477671037374509056', text='', timestamp=1641139200, is_reply=False),
-            TwitterTweet(tweet_id='1477686134981505030', text='', timestamp=1641142800, is_reply=False),
-            TwitterTweet(tweet_id='1477701237483130884', text='', timestamp=1641146400, is_reply=False),
-            TwitterTweet(tweet_id='1477716334997876738', text='', timestamp=1641150000, is_reply=False),
-            TwitterTweet(tweet_id='1477731431979835394', text='', timestamp=1641153600, is_reply=False),
-            TwitterTweet(tweet_id='1477746533244231691', text='', timestamp=1641157200, is_reply=False),
-            TwitterTweet(tweet_id='1477761633887965188', text='', timestamp=1641160800, is_reply=False),
-            TwitterTweet(tweet_id='1477776731129929733', text='', timestamp=1641164400, is_reply=False),
-            TwitterTweet(tweet_id='1477791836190216193', text='', timestamp=1641168000, is_reply=False),
-            TwitterTweet(tweet_id='1477806929418276871', text='', timestamp=1641171600, is_reply=False),
-            TwitterTweet(tweet_id='1477822031324499974', text='', timestamp=1641175200, is_reply=False),
-            TwitterTweet(tweet_id='1477837129585725443', text='', timestamp=1641178800, is_reply=False),
-            TwitterTweet(tweet_id='1477852235027685376', text='', timestamp=1641182400, is_reply=False),
-            TwitterTweet(tweet_id='1477867334308188167', text='', timestamp=1641186000, is_reply=False),
-            TwitterTweet(tweet_id='1477882431927693316', text='', timestamp=1641189600, is_reply=False),
-            TwitterTweet(tweet_id='1477897532105711621', text='', timestamp=1641193200, is_reply=False),
-            TwitterTweet(tweet_id='1477912630174097414', text='', timestamp=1641196800, is_reply=False),
-            TwitterTweet(tweet_id='1477927728561197058', text='', timestamp=1641200400, is_reply=False),
-            TwitterTweet(tweet_id='1477942825207615488', text='', timestamp=1641204000, is_reply=False),
-            TwitterTweet(tweet_id='1477957927331713025', text='', timestamp=1641207600, is_reply=False),
-            TwitterTweet(tweet_id='1477973024452362243', text='', timestamp=1641211200, is_reply=False),
-            TwitterTweet(tweet_id='1477988124374573063', text='', timestamp=1641214800, is_reply=False),
-            TwitterTweet(tweet_id='1478003225479548939', text='', timestamp=1641218400, is_reply=False)
+            ScrapedTweet(tweet_id='1477067061964775424', text='', timestamp=1640995200, is_reply=False),
+            ScrapedTweet(tweet_id='1477082160490242053', text='', timestamp=1640998800, is_reply=False),
+            ScrapedTweet(tweet_id='1477097253261217796', text='', timestamp=1641002400, is_reply=False),
+            ScrapedTweet(tweet_id='1477112354328489988', text='', timestamp=1641006000, is_reply=False),
+            ScrapedTweet(tweet_id='1477127454141652996', text='', timestamp=1641009600, is_reply=False),
+            ScrapedTweet(tweet_id='1477142551849320449', text='', timestamp=1641013200, is_reply=False),
+            ScrapedTweet(tweet_id='1477157652945936397', text='', timestamp=1641016800, is_reply=False),
+            ScrapedTweet(tweet_id='1477172751299493888', text='', timestamp=1641020400, is_reply=False),
+            ScrapedTweet(tweet_id='1477187850777108481', text='', timestamp=1641024000, is_reply=False),
+            ScrapedTweet(tweet_id='1477202950120517637', text='', timestamp=1641027600, is_reply=False),
+            ScrapedTweet(tweet_id='1477218051787530244', text='', timestamp=1641031200, is_reply=False),
+            ScrapedTweet(tweet_id='1477233147817381891', text='', timestamp=1641034800, is_reply=False),
+            ScrapedTweet(tweet_id='1477248250797305860', text='', timestamp=1641038400, is_reply=False),
+            ScrapedTweet(tweet_id='1477263348748230659', text='', timestamp=1641042000, is_reply=False),
+            ScrapedTweet(tweet_id='1477278448691425281', text='', timestamp=1641045600, is_reply=False),
+            ScrapedTweet(tweet_id='1477293548722692097', text='', timestamp=1641049200, is_reply=False),
+            ScrapedTweet(tweet_id='1477308646719639553', text='', timestamp=1641052800, is_reply=False),
+            ScrapedTweet(tweet_id='1477323746310594568', text='', timestamp=1641056400, is_reply=False),
+            ScrapedTweet(tweet_id='1477338848011116547', text='', timestamp=1641060000, is_reply=False),
+            ScrapedTweet(tweet_id='1477353947820089345', text='', timestamp=1641063600, is_reply=False),
+            ScrapedTweet(tweet_id='1477369046018445318', text='', timestamp=1641067200, is_reply=False),
+            ScrapedTweet(tweet_id='1477384142929240069', text='', timestamp=1641070800, is_reply=False),
+            ScrapedTweet(tweet_id='1477399249860112386', text='', timestamp=1641074400, is_reply=False),
+            ScrapedTweet(tweet_id='1477414344195383296', text='', timestamp=1641078000, is_reply=False),
+            ScrapedTweet(tweet_id='1477429444126121985', text='', timestamp=1641081600, is_reply=False),
+            ScrapedTweet(tweet_id='1477444541120720898', text='', timestamp=1641085200, is_reply=False),
+            ScrapedTweet(tweet_id='1477459644067065856', text='', timestamp=1641088800, is_reply=False),
+            ScrapedTweet(tweet_id='1477474743129452544', text='', timestamp=1641092400, is_reply=False),
+            ScrapedTweet(tweet_id='1477489842829279233', text='', timestamp=1641096000, is_reply=False),
+            ScrapedTweet(tweet_id='1477504940163670020', text='', timestamp=1641099600, is_reply=False),
+            ScrapedTweet(tweet_id='1477520038349479937', text='', timestamp=1641103200, is_reply=False),
+            ScrapedTweet(tweet_id='1477535140813459463', text='', timestamp=1641106800, is_reply=False),
+            ScrapedTweet(tweet_id='1477550240848879617', text='', timestamp=1641110400, is_reply=False),
+            ScrapedTweet(tweet_id='1477565336883011588', text='', timestamp=1641114000, is_reply=False),
+            ScrapedTweet(tweet_id='1477580436813623297', text='', timestamp=1641117600, is_reply=False),
+            ScrapedTweet(tweet_id='1477595539059445762', text='', timestamp=1641121200, is_reply=False),
+            ScrapedTweet(tweet_id='1477610638113492994', text='', timestamp=1641124800, is_reply=False),
+            ScrapedTweet(tweet_id='1477625735468699652', text='', timestamp=1641128400, is_reply=False),
+            ScrapedTweet(tweet_id='1477640835374239749', text='', timestamp=1641132000, is_reply=False),
+            ScrapedTweet(tweet_id='1477655933237006341', text='', timestamp=1641135600, is_reply=False),
+            ScrapedTweet(tweet_id='1477671037374509056', text='', timestamp=1641139200, is_reply=False),
+            ScrapedTweet(tweet_id='1477686134981505030', text='', timestamp=1641142800, is_reply=False),
+            ScrapedTweet(tweet_id='1477701237483130884', text='', timestamp=1641146400, is_reply=False),
+            ScrapedTweet(tweet_id='1477716334997876738', text='', timestamp=1641150000, is_reply=False),
+            ScrapedTweet(tweet_id='1477731431979835394', text='', timestamp=1641153600, is_reply=False),
+            ScrapedTweet(tweet_id='1477746533244231691', text='', timestamp=1641157200, is_reply=False),
+            ScrapedTweet(tweet_id='1477761633887965188', text='', timestamp=1641160800, is_reply=False),
+            ScrapedTweet(tweet_id='1477776731129929733', text='', timestamp=1641164400, is_reply=False),
+            ScrapedTweet(tweet_id='1477791836190216193', text='', timestamp=1641168000, is_reply=False),
+            ScrapedTweet(tweet_id='1477806929418276871', text='', timestamp=1641171600, is_reply=False),
+            ScrapedTweet(tweet_id='1477822031324499974', text='', timestamp=1641175200, is_reply=False),
+            ScrapedTweet(tweet_id='1477837129585725443', text='', timestamp=1641178800, is_reply=False),
+            ScrapedTweet(tweet_id='1477852235027685376', text='', timestamp=1641182400, is_reply=False),
+            ScrapedTweet(tweet_id='1477867334308188167', text='', timestamp=1641186000, is_reply=False),
+            ScrapedTweet(tweet_id='1477882431927693316', text='', timestamp=1641189600, is_reply=False),
+            ScrapedTweet(tweet_id='1477897532105711621', text='', timestamp=1641193200, is_reply=False),
+            ScrapedTweet(tweet_id='1477912630174097414', text='', timestamp=1641196800, is_reply=False),
+            ScrapedTweet(tweet_id='1477927728561197058', text='', timestamp=1641200400, is_reply=False),
+            ScrapedTweet(tweet_id='1477942825207615488', text='', timestamp=1641204000, is_reply=False),
+            ScrapedTweet(tweet_id='1477957927331713025', text='', timestamp=1641207600, is_reply=False),
+            ScrapedTweet(tweet_id='1477973024452362243', text='', timestamp=1641211200, is_reply=False),
+            ScrapedTweet(tweet_id='1477988124374573063', text='', timestamp=1641214800, is_reply=False),
+            ScrapedTweet(tweet_id='1478003225479548939', text='', timestamp=1641218400, is_reply=False)
         ]
 
         tweets = await self.client_nitter.get_tweets_in_range(
@@ -115,3 +115,115 @@ class TestNitter(BaseTwitterTest):
         assert tweets_datetimes == expected_tweets_datetimes
         assert tweets_datetimes[-1] == expected_last_datetime
         assert tweets == expected_tweets
+
+
+_NITTER_RSS_SAMPLE = """<?xml version="1.0" encoding="UTF-8"?>
+<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:dc="http://purl.org/dc/elements/1.1/" version="2.0">
+  <channel>
+    <title>possum / @possumeveryhour</title>
+    <item>
+      <title>pinned possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 01 Nov 2021 10:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/1455000000000000000#m</guid>
+    </item>
+    <item>
+      <title>RT by @possumeveryhour: other possum</title>
+      <dc:creator>@otherprofile</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 13:30:00 GMT</pubDate>
+      <guid>https://nitter.net/otherprofile/status/1478000000000000000#m</guid>
+    </item>
+    <item>
+      <title>R to @otherprofile: nice possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 13:10:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/1477990000000000000#m</guid>
+    </item>
+    <item>
+      <title>possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 13:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/1477988124374573063#m</guid>
+    </item>
+    <item>
+      <title>older possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 12:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/1477973024452362243#m</guid>
+    </item>
+  </channel>
+</rss>
+"""
+
+
+@pytest.mark.parametrize("from_timestamp, expected_tweets_ids, expected_reached", [
+    (1641214800, ["1477990000000000000", "1477988124374573063"], True),
+    (1641211200, ["1477990000000000000", "1477988124374573063", "1477973024452362243"], False),
+])
+def test_nitter_parse_rss(from_timestamp, expected_tweets_ids, expected_reached):
+    body = _NITTER_RSS_SAMPLE.encode()
+    tweets, reached = TwitterNitterClient._nitter_parse_rss(
+        username="possumeveryhour",
+        from_timestamp=from_timestamp,
+        to_timestamp=1641216600,
+        chunks=[body[i:i + 100] for i in range(0, len(body), 100)]
+    )
+    assert [tweet.tweet_id for tweet in tweets] == expected_tweets_ids
+    assert reached is expected_reached
+    assert tweets[0].is_reply is True
+    assert tweets[0].text == "nice possum"
+
+
+_NITTER_RSS_OLD_RETWEET_SAMPLE = """<?xml version="1.0" encoding="UTF-8"?>
+<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:dc="http://purl.org/dc/elements/1.1/" version="2.0">
+  <channel>
+    <title>possum / @possumeveryhour</title>
+    <item>
+      <title>pinned possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 01 Nov 2021 10:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/100#m</guid>
+    </item>
+    <item>
+      <title>new possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 14:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/300#m</guid>
+    </item>
+    <item>
+      <title>RT by @possumeveryhour: old possum</title>
+      <dc:creator>@otherprofile</dc:creator>
+      <pubDate>Mon, 01 Jan 2018 10:00:00 GMT</pubDate>
+      <guid>https://nitter.net/otherprofile/status/50#m</guid>
+    </item>
+    <item>
+      <title>possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 13:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/200#m</guid>
+    </item>
+    <item>
+      <title>older possum</title>
+      <dc:creator>@possumeveryhour</dc:creator>
+      <pubDate>Mon, 03 Jan 2022 12:00:00 GMT</pubDate>
+      <guid>https://nitter.net/possumeveryhour/status/150#m</guid>
+    </item>
+  </channel>
+</rss>
+"""
+
+
+@pytest.mark.parametrize("from_timestamp, expected_tweets_ids, expected_reached", [
+    # the old-dated retweet in the middle of the feed does not stop the parsing
+    (1641214800, ["300", "200"], True),
+    (1641211200, ["300", "200", "150"], False),
+])
+def test_nitter_parse_rss_old_retweet(from_timestamp, expected_tweets_ids, expected_reached):
+    tweets, reached = TwitterNitterClient._nitter_parse_rss(
+        username="possumeveryhour",
+        from_timestamp=from_timestamp,
+        to_timestamp=1641220000,
+        chunks=[_NITTER_RSS_OLD_RETWEET_SAMPLE.encode()]
+    )
+    assert [tweet.tweet_id for tweet in tweets] == expected_tweets_ids
+    assert reached is expected_reached
@@ -0,0 +1,205 @@
+import types
+import asyncio
+from typing import *
+
+import httpx
+import pytest
+
+import twitterscraper.controllers.persistedreview as persistedreview
+from twitterscraper.services.ratelimit import RateLimitScheduler
+from twitterscraper.services.twitter import TwitterAPIClient
+from twitterscraper.settings import MainSettings, JobsSettings
+from .test_ratelimit import FakeClock, _headers
+
+
+_NOT_FOUND_ERROR = "https://api.twitter.com/2/problems/resource-not-found"
+_NOT_AUTHORIZED_ERROR = "https://api.twitter.com/2/problems/not-authorized-for-resource"
+
+
+class FakeTwitterAPI:
+    """Mocked transport of the Twitter API: tweets lookup of the existing tweets, and users lookup of the existing
+    users (by userid); errors for the rest. Responses can be overridden for the first requests with `responses`."""
+
+    def __init__(
+            self,
+            existing_ids: Collection[str] = (),
+            not_authorized_ids: Collection[str] = (),
+            usernames: Optional[Dict[str, str]] = None,
+            omitted_userids: Collection[str] = ()
+    ):
+        self.existing_ids = set(existing_ids)
+        self.not_authorized_ids = set(not_authorized_ids)
+        self.usernames = usernames or dict()
+        self.omitted_userids = set(omitted_userids)
+        """Userids neither returned nor reported as error"""
+        self.responses: List[httpx.Response] = list()
+        self.requests: List[httpx.Request] = list()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.responses:
+            return self.responses.pop(0)
+        if request.url.path == "/2/users":
+            return self._users_lookup(request)
+
+        data, errors = list(), list()
+        for tweet_id in request.url.params["ids"].split(","):
+            if tweet_id in self.existing_ids:
+                data.append(dict(id=tweet_id, text="", created_at="2022-01-01T00:00:00.000Z"))
+            else:
+                error_type = _NOT_AUTHORIZED_ERROR if tweet_id in self.not_authorized_ids else _NOT_FOUND_ERROR
+                errors.append(dict(value=tweet_id, resource_id=tweet_id, resource_type="tweet", type=error_type))
+        return httpx.Response(200, json=dict(data=data, errors=errors), headers=_headers(300, 299, 1900))
+
+    def _users_lookup(self, request: httpx.Request) -> httpx.Response:
+        data, errors = list(), list()
+        for userid in request.url.params["ids"].split(","):
+            if userid in self.usernames:
+                data.append(dict(id=userid, name="", username=self.usernames[userid]))
+            elif userid not in self.omitted_userids:
+                errors.append(dict(value=userid, resource_id=userid, resource_type="user", type=_NOT_FOUND_ERROR))
+        return httpx.Response(200, json=dict(data=data, errors=errors), headers=_headers(300, 299, 1900))
+
+    def get_client(self, **kwargs) -> TwitterAPIClient:
+        client = TwitterAPIClient(api_key="key", api_secret="secret", api_token="token", api_async=False, **kwargs)
+        # noinspection PyProtectedMember
+        client._http = httpx.AsyncClient(base_url=client._api_baseurl, transport=httpx.MockTransport(self))
+        client._ratelimit = RateLimitScheduler(clock=FakeClock())
+        return client
+
+    def get_requested_ids(self) -> List[List[str]]:
+        return [request.url.params["ids"].split(",") for request in self.requests]
+
+
+def _get_tweets_statuses(api: FakeTwitterAPI, tweets_ids: List[str]):
+    async def run():
+        client = api.get_client()
+        try:
+            return await client.get_tweets_statuses(tweets_ids)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_get_tweets_statuses():
+    tweets_ids = [str(tweet_id) for tweet_id in range(1000, 1250)]
+    api = FakeTwitterAPI(existing_ids=tweets_ids[::2], not_authorized_ids=["1001"])
+
+    statuses = _get_tweets_statuses(api, tweets_ids + ["1000"])
+    assert sorted(len(ids) for ids in api.get_requested_ids()) == [50, 100, 100]
+    # not authorized tweets are not verified
+    assert set(statuses) == set(tweets_ids) - {"1001"}
+    assert statuses["1000"].exists and statuses["1000"].timestamp == 1640995200
+    assert not statuses["1003"].exists
+
+
+def test_get_tweets_statuses_failed_batch():
+    tweets_ids = [str(tweet_id) for tweet_id in range(1000, 1150)]
+    api = FakeTwitterAPI(existing_ids=tweets_ids)
+    api.responses = [httpx.Response(503, text="Service Unavailable")]
+
+    statuses = _get_tweets_statuses(api, tweets_ids)
+    # the first batch failed: its tweets are not verified
+    assert len(api.requests) == 2
+    assert set(statuses) == set(tweets_ids[100:])
+    assert all(status.exists for status in statuses.values())
+
+
+def test_get_tweets_statuses_rate_limited():
+    api = FakeTwitterAPI(existing_ids=["1000"])
+    # rejected by rate limit, with the window reset right away: retried once
+    api.responses = [httpx.Response(429, headers=_headers(300, 0, 1000))]
+
+    statuses = _get_tweets_statuses(api, ["1000", "1001"])
+    assert len(api.requests) == 2
+    assert statuses["1000"].exists and not statuses["1001"].exists
+
+
+def test_get_tweets_statuses_rate_limited_twice():
+    api = FakeTwitterAPI(existing_ids=["1000"])
+    api.responses = [httpx.Response(429, headers=_headers(300, 0, 1000)) for _ in range(2)]
+
+    assert _get_tweets_statuses(api, ["1000", "1001"]) == {}
+    assert len(api.requests) == 2
+
+
+class FakeNitterClient:
+    def __init__(self, removed_ids: Collection[str]):
+        self.removed_ids = set(removed_ids)
+        self.verified_ids: Set[str] = set()
+
+    async def get_tweets_removed(self, tweets_ids: Iterable[str]) -> Set[str]:
+        self.verified_ids.update(tweets_ids)
+        return self.removed_ids & set(tweets_ids)
+
+
+@pytest.mark.parametrize("responses, expected_nitter_ids", [
+    # not authorized tweets verified on Nitter
+    ([], {"1002"}),
+    # lookup failed (rate limited twice): all verified on Nitter
+    ([httpx.Response(429, headers=_headers(300, 0, 1000)) for _ in range(2)], {"1000", "1001", "1002"}),
+])
+def test_verify_removed_tweets(monkeypatch, responses, expected_nitter_ids):
+    api = FakeTwitterAPI(existing_ids=["1000"], not_authorized_ids=["1002"])
+    api.responses = responses
+    nitter = FakeNitterClient(removed_ids=["1001", "1002"])
+    settings = types.SimpleNamespace(jobs=JobsSettings(deletion_verification="api"))
+    monkeypatch.setattr(MainSettings, "_instance", settings, raising=False)
+    monkeypatch.setattr(persistedreview, "TwitterNitterClient", types.SimpleNamespace(get=lambda: nitter))
+
+    async def run():
+        client = api.get_client()
+        monkeypatch.setattr(persistedreview, "TwitterAPIClient", types.SimpleNamespace(get=lambda: client))
+        try:
+            return await persistedreview.verify_removed_tweets({"1000", "1001", "1002"})
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == {"1001", "1002"}
+    assert nitter.verified_ids == expected_nitter_ids
+
+
+def _get_usernames(api: FakeTwitterAPI, userids: List[str], **kwargs):
+    async def run():
+        client = api.get_client(**kwargs)
+        try:
+            return await client.get_usernames(userids)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_get_usernames_batches():
+    userids = [str(userid) for userid in range(1000, 1250)]
+    api = FakeTwitterAPI(usernames={userid: f"user{userid}" for userid in userids})
+
+    # repeated userids are looked up once
+    lookup = _get_usernames(api, userids + userids[:10], users_lookup_batch_size=100)
+    assert sorted(len(ids) for ids in api.get_requested_ids()) == [50, 100, 100]
+    assert sum(api.get_requested_ids(), []).count("1000") == 1
+    assert lookup.usernames == {userid: f"user{userid}" for userid in userids}
+    assert not lookup.not_found and not lookup.failed
+
+
+def test_get_usernames_unknown_userids():
+    api = FakeTwitterAPI(usernames={"1000": "possumeveryhour"}, omitted_userids=["1002"])
+
+    lookup = _get_usernames(api, ["1000", "1001", "1002"])
+    assert lookup.usernames == {"1000": "possumeveryhour"}
+    # reported as not found by the API
+    assert lookup.not_found == {"1001"}
+    # neither found nor reported as error: state unknown
+    assert lookup.failed == {"1002"}
+
+
+def test_get_usernames_failed_batch():
+    userids = [str(userid) for userid in range(1000, 1004)]
+    api = FakeTwitterAPI(usernames={userid: f"user{userid}" for userid in userids})
+    api.responses = [httpx.Response(503, text="Service Unavailable")]
+
+    lookup = _get_usernames(api, userids, users_lookup_batch_size=2)
+    assert lookup.failed == {"1000", "1001"}
+    assert lookup.usernames == {"1002": "user1002", "1003": "user1003"}
+    assert not lookup.not_found
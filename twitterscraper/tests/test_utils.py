@@ -4,7 +4,9 @@ from typing import *
 import pytest
 import pydantic
 
-from twitterscraper.utils import date_to_datetime_range
+from twitterscraper.utils import date_to_datetime_range, chunked, is_review_due, split_timestamp_range, \
+    merge_timestamp_ranges, get_timestamp_ranges_gaps, split_timestamp_range_by_days, get_ids_fingerprint, \
+    IdsFingerprint
 
 
 class DateToDatetimeRangeScenario(pydantic.BaseModel):
@@ -57,3 +59,94 @@ class DateToDatetimeRangeScenario(pydantic.BaseModel):
 def test_date_to_datetime_range(scenario: DateToDatetimeRangeScenario):
     intervals = list(date_to_datetime_range(scenario.start_date, scenario.end_datetime))
     assert intervals == scenario.expected_intervals
+
+
+@pytest.mark.parametrize("items, size, expected_chunks", [
+    ([], 3, []),
+    ([1, 2, 3], 3, [[1, 2, 3]]),
+    ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]]),
+    (range(4), 1, [[0], [1], [2], [3]]),
+])
+def test_chunked(items, size, expected_chunks):
+    assert list(chunked(items, size)) == expected_chunks
+
+
+_DAY = 86400
+_REVIEW_INTERVALS = [(7 * _DAY, _DAY), (365 * _DAY, 7 * _DAY), (None, 30 * _DAY)]
+
+
+@pytest.mark.parametrize("day_age_days, last_review_ago_days, expected_due", [
+    (1, None, True),
+    (1, 1, True),
+    (1, 0.5, False),
+    (30, 3, False),
+    (30, 7, True),
+    (800, 20, False),
+    (800, 30, True),
+    # margin for periodic runs delayed a few minutes
+    (1, 0.99, True),
+])
+def test_is_review_due(day_age_days, last_review_ago_days, expected_due):
+    now = 1641081600
+    day_timestamp = now - int(day_age_days * _DAY)
+    last_review_timestamp = now - int(last_review_ago_days * _DAY) if last_review_ago_days is not None else None
+    assert is_review_due(day_timestamp, last_review_timestamp, now, _REVIEW_INTERVALS) is expected_due
+
+
+def test_is_review_due_out_of_intervals():
+    assert is_review_due(0, 1, 400 * _DAY, [(365 * _DAY, _DAY)]) is False
+
+
+@pytest.mark.parametrize("from_ts, to_ts, step, expected_ranges", [
+    (0, 0, 10, []),
+    (0, 10, 10, [(0, 10)]),
+    (0, 25, 10, [(0, 10), (10, 20), (20, 25)]),
+    (5, 8, 10, [(5, 8)]),
+])
+def test_split_timestamp_range(from_ts, to_ts, step, expected_ranges):
+    assert split_timestamp_range(from_ts, to_ts, step) == expected_ranges
+
+
+@pytest.mark.parametrize("from_ts, to_ts, expected_ranges", [
+    (_DAY, _DAY, []),
+    (_DAY, 2 * _DAY, [(_DAY, 2 * _DAY)]),
+    (_DAY + 100, _DAY + 200, [(_DAY + 100, _DAY + 200)]),
+    (_DAY + 100, 3 * _DAY + 50, [(_DAY + 100, 2 * _DAY), (2 * _DAY, 3 * _DAY), (3 * _DAY, 3 * _DAY + 50)]),
+])
+def test_split_timestamp_range_by_days(from_ts, to_ts, expected_ranges):
+    assert split_timestamp_range_by_days(from_ts, to_ts) == expected_ranges
+
+
+@pytest.mark.parametrize("ranges, expected_merged", [
+    ([], []),
+    ([(10, 20)], [(10, 20)]),
+    ([(20, 30), (0, 10)], [(0, 10), (20, 30)]),
+    ([(0, 10), (10, 20)], [(0, 20)]),
+    ([(0, 15), (5, 10), (12, 30)], [(0, 30)]),
+    ([(5, 5), (0, 3)], [(0, 3)]),
+])
+def test_merge_timestamp_ranges(ranges, expected_merged):
+    assert merge_timestamp_ranges(ranges) == expected_merged
+
+
+@pytest.mark.parametrize("ranges, from_ts, to_ts, expected_gaps", [
+    ([], 0, 100, [(0, 100)]),
+    ([(0, 100)], 0, 100, []),
+    ([(-50, 200)], 0, 100, []),
+    ([(10, 20), (40, 50)], 0, 100, [(0, 10), (20, 40), (50, 100)]),
+    ([(40, 50), (10, 20), (15, 45)], 0, 100, [(0, 10), (50, 100)]),
+    ([(0, 30), (150, 200)], 20, 100, [(30, 100)]),
+])
+def test_get_timestamp_ranges_gaps(ranges, from_ts, to_ts, expected_gaps):
+    assert get_timestamp_ranges_gaps(ranges, from_ts, to_ts) == expected_gaps
+
+
+def test_get_ids_fingerprint():
+    fingerprint = get_ids_fingerprint(["3", "1", "2"])
+    assert fingerprint == get_ids_fingerprint(["1", "2", "3"])
+    assert fingerprint != get_ids_fingerprint(["1", "2"])
+
+    incremental_fingerprint = IdsFingerprint(["2"])
+    incremental_fingerprint.add(["3", "1"])
+    assert incremental_fingerprint.hexdigest() == fingerprint
+    assert len(fingerprint) == 16
@@ -1,5 +1,6 @@
 import time
 import uuid
+import hashlib
 import asyncio
 import functools
 from typing import *
@@ -37,6 +38,60 @@ def date_to_datetime_range(start_date: datetime.date, end_datetime: datetime.dat
         yield end_day_datetime, end_datetime
 
 
+def split_timestamp_range(from_ts: int, to_ts: int, step: int) -> List[Tuple[int, int]]:
+    """Split a timestamps range (from inclusive, to exclusive) in consecutive ranges of `step` seconds.
+    The last range may be shorter."""
+    ranges = list()
+    for range_from_ts in range(from_ts, to_ts, step):
+        ranges.append((range_from_ts, min(range_from_ts + step, to_ts)))
+    return ranges
+
+
+def split_timestamp_range_by_days(from_ts: int, to_ts: int) -> List[Tuple[int, int]]:
+    """Split a timestamps range (from inclusive, to exclusive) in consecutive ranges at the day boundaries (00:00h UTC).
+    The first and last ranges may be shorter than a day."""
+    day_seconds = 86400
+    ranges = list()
+    range_from_ts = from_ts
+    while range_from_ts < to_ts:
+        range_to_ts = min(range_from_ts - range_from_ts % day_seconds + day_seconds, to_ts)
+        ranges.append((range_from_ts, range_to_ts))
+        range_from_ts = range_to_ts
+    return ranges
+
+
+def merge_timestamp_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge timestamps ranges (from inclusive, to exclusive) that overlap or are contiguous.
+    Return the merged ranges sorted by from timestamp."""
+    merged = list()
+    for from_ts, to_ts in sorted(ranges):
+        if from_ts >= to_ts:
+            continue
+        if merged and from_ts <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], to_ts))
+        else:
+            merged.append((from_ts, to_ts))
+    return merged
+
+
+def get_timestamp_ranges_gaps(ranges: Iterable[Tuple[int, int]], from_ts: int, to_ts: int) -> List[Tuple[int, int]]:
+    """Given timestamps ranges (from inclusive, to exclusive), return the sorted ranges within from_ts~to_ts
+    not covered by any of them."""
+    gaps = list()
+    cursor_ts = from_ts
+    for range_from_ts, range_to_ts in merge_timestamp_ranges(ranges):
+        if range_to_ts <= cursor_ts:
+            continue
+        if range_from_ts >= to_ts:
+            break
+        if range_from_ts > cursor_ts:
+            gaps.append((cursor_ts, range_from_ts))
+        cursor_ts = range_to_ts
+    if cursor_ts < to_ts:
+        gaps.append((cursor_ts, to_ts))
+    return gaps
+
+
 def date_to_datetime(date: datetime.date) -> datetime.datetime:
     """Convert a datetime.date object to datetime.datetime, set at 00:00h UTC."""
     return datetime.datetime(date.year, date.month, date.day, tzinfo=datetime.timezone.utc)
@@ -86,6 +141,61 @@ def timestamp_in_range(from_ts: int, to_ts: int, ts: int) -> bool:
     return from_ts <= ts < to_ts
 
 
+def chunked(items: Iterable, size: int) -> Iterable[List]:
+    """Iterate the given items in lists of up to `size` items."""
+    chunk = list()
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def is_review_due(
+        day_timestamp: int,
+        last_review_timestamp: Optional[int],
+        now: int,
+        review_intervals: List[Tuple[Optional[int], int]]
+) -> bool:
+    """Given the start timestamp of a day, when it was last reviewed, and the review intervals by age, return if the
+    day must be reviewed now. review_intervals is a list of (max age, review interval) in seconds, sorted by max age;
+    the interval of the first item which max age (None = unlimited) is greater than the age of the day is used.
+    If the age is greater than all the max ages, the day is not reviewed.
+    A margin of 10% of the interval is given, so runs periodically scheduled at the same interval are not skipped
+    because of small delays."""
+    if not last_review_timestamp:
+        return True
+
+    age = now - day_timestamp
+    for max_age, interval in review_intervals:
+        if max_age is None or age < max_age:
+            return now - last_review_timestamp >= interval * 0.9
+    return False
+
+
+class IdsFingerprint:
+    """Compact fingerprint (hash) of a set of ids, independent of their order, that can be built incrementally:
+    the sum (modulo 2^64) of a hash of each id."""
+
+    def __init__(self, ids: Iterable[str] = ()):
+        self._sum = 0
+        self.add(ids)
+
+    def add(self, ids: Iterable[str]):
+        for _id in ids:
+            self._sum = (self._sum + int.from_bytes(hashlib.sha1(_id.encode("utf-8")).digest()[:8], "big")) % 2 ** 64
+
+    def hexdigest(self) -> str:
+        return f"{self._sum:016x}"
+
+
+def get_ids_fingerprint(ids: Iterable[str]) -> str:
+    """Return a compact fingerprint (hash) of a set of ids, independent of their order (see IdsFingerprint)."""
+    return IdsFingerprint(ids).hexdigest()
+
+
 def get_timestamp() -> int:
     """Get the current time as Unix seconds UTC timestamp"""
     return int(time.time())